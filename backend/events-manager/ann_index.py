@@ -0,0 +1,255 @@
+'''
+Approximate nearest-neighbour search for large events: IVF index on NumPy
+'''
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+import psycopg2
+
+ANN_MIN_ROWS = int(os.environ.get('ANN_MIN_ROWS', '2000'))
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', '8'))
+ANN_MIN_RECALL = float(os.environ.get('ANN_MIN_RECALL', '0.9'))
+ANN_TRAIN_SAMPLE = 20000
+
+class IVFIndex:
+    '''
+    Inverted-file index over a normalized embedding matrix.
+    Rows are clustered with spherical k-means; a query scores only the rows
+    of the nprobe closest centroids.
+    '''
+    
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, recall: float = 1.0):
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = assignments.astype(np.int32)
+        self.recall = recall
+        
+        self.order = np.argsort(self.assignments, kind='stable')
+        counts = np.bincount(self.assignments, minlength=self.centroids.shape[0])
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+    
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = None, iterations: int = 10, seed: int = 0) -> 'IVFIndex':
+        '''
+        Train centroids on (a sample of) the matrix and assign every row
+        '''
+        
+        rows = matrix.shape[0]
+        nlist = nlist or max(1, int(np.sqrt(rows)))
+        nlist = min(nlist, rows)
+        
+        rng = np.random.default_rng(seed)
+        sample = matrix
+        if rows > ANN_TRAIN_SAMPLE:
+            sample = matrix[rng.choice(rows, ANN_TRAIN_SAMPLE, replace=False)]
+        
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            
+            for c in range(nlist):
+                members = sample[labels == c]
+                if members.shape[0] == 0:
+                    centroids[c] = sample[rng.integers(sample.shape[0])]
+                    continue
+                
+                center = members.sum(axis=0)
+                norm = np.linalg.norm(center)
+                centroids[c] = center / norm if norm > 0 else center
+        
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        
+        return cls(centroids, assignments)
+    
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int, nprobe: int = ANN_NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Approximate top-k for a normalized query
+        
+        Returns:
+            (row indices sorted by score desc, their scores)
+        '''
+        
+        nlist = self.centroids.shape[0]
+        nprobe = min(max(nprobe, 1), nlist)
+        
+        centroid_scores = self.centroids @ query
+        if nprobe < nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(nlist)
+        
+        candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+        
+        if candidates.shape[0] == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        scores = matrix[candidates] @ query
+        k = min(top_k, scores.shape[0])
+        
+        if k < scores.shape[0]:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(scores.shape[0])
+        
+        best = best[np.argsort(-scores[best], kind='stable')]
+        
+        return candidates[best], scores[best]
+
+def recall_at_k(matrix: np.ndarray, index: IVFIndex, queries: np.ndarray, top_k: int = 10, nprobe: int = ANN_NPROBE) -> float:
+    '''
+    Mean fraction of exact top-k rows that the ANN search also returns
+    '''
+    
+    if queries.shape[0] == 0:
+        return 1.0
+    
+    k = min(top_k, matrix.shape[0])
+    hits = 0
+    
+    for query in queries:
+        exact_scores = matrix @ query
+        exact = set(np.argpartition(-exact_scores, k - 1)[:k].tolist())
+        approx, _ = index.search(matrix, query, k, nprobe)
+        hits += len(exact & set(approx.tolist()))
+    
+    return hits / (k * queries.shape[0])
+
+def build_checked_index(matrix: np.ndarray, sample_queries: int = 32, seed: int = 0) -> IVFIndex:
+    '''
+    Build an IVF index and measure recall@10 against exact search on sampled rows
+    '''
+    
+    index = IVFIndex.build(matrix, seed=seed)
+    
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(matrix.shape[0], min(sample_queries, matrix.shape[0]), replace=False)
+    index.recall = recall_at_k(matrix, index, matrix[picks])
+    
+    print(f'[ANN] Built IVF index: rows={matrix.shape[0]}, nlist={index.centroids.shape[0]}, recall@10={index.recall:.3f}')
+    
+    return index
+
+ANN_CACHE = OrderedDict()
+ANN_CACHE_LOCK = threading.Lock()
+ANN_CACHE_MAX_ENTRIES = 32
+
+def in_savepoint(conn, name: str, run):
+    '''
+    run(cur) inside a savepoint of the caller's transaction: a failed statement rolls
+    back only the savepoint, nothing is committed, and the error is re-raised
+    '''
+    
+    cur = conn.cursor()
+    if conn.autocommit:
+        return run(cur)
+    
+    cur.execute(f'SAVEPOINT {name}')
+    try:
+        result = run(cur)
+    except Exception:
+        cur.execute(f'ROLLBACK TO SAVEPOINT {name}')
+        raise
+    cur.execute(f'RELEASE SAVEPOINT {name}')
+    return result
+
+def load_index(conn, event_id: int, item_type: str, version: int, row_ids: List[int]) -> Optional[IVFIndex]:
+    '''
+    Load a persisted IVF index if it was built for this index version and row order
+    '''
+    
+    def fetch(cur):
+        cur.execute('''
+            SELECT centroids, assignments, row_ids, dim, recall
+            FROM t_p22819116_event_schedule_app.knowledge_ann_indexes
+            WHERE event_id = %s AND item_type = %s AND index_version = %s
+        ''', (event_id, item_type, version))
+        return cur.fetchone()
+    
+    row = in_savepoint(conn, 'ann_index_load', fetch)
+    if not row:
+        return None
+    
+    centroids_bytes, assignments_bytes, row_ids_bytes, dim, recall = row
+    
+    stored_ids = np.frombuffer(bytes(row_ids_bytes), dtype=np.int64)
+    if stored_ids.shape[0] != len(row_ids) or not np.array_equal(stored_ids, np.asarray(row_ids, dtype=np.int64)):
+        return None
+    
+    centroids = np.frombuffer(bytes(centroids_bytes), dtype=np.float32).reshape(-1, dim)
+    assignments = np.frombuffer(bytes(assignments_bytes), dtype=np.int32)
+    
+    return IVFIndex(centroids, assignments, recall)
+
+def save_index(conn, event_id: int, item_type: str, version: int, row_ids: List[int], index: IVFIndex):
+    '''
+    Persist an IVF index so other warm containers can load it instead of re-training.
+    Runs inside a savepoint and leaves the commit to the caller: this is reached from
+    the search path, whose transaction is not ours to commit or abort.
+    '''
+    
+    def upsert(cur):
+        cur.execute('''
+            INSERT INTO t_p22819116_event_schedule_app.knowledge_ann_indexes
+            (event_id, item_type, index_version, dim, recall, centroids, assignments, row_ids)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (event_id, item_type)
+            DO UPDATE SET index_version = EXCLUDED.index_version, dim = EXCLUDED.dim, recall = EXCLUDED.recall,
+                          centroids = EXCLUDED.centroids, assignments = EXCLUDED.assignments,
+                          row_ids = EXCLUDED.row_ids, created_at = CURRENT_TIMESTAMP
+        ''', (
+            event_id,
+            item_type,
+            version,
+            int(index.centroids.shape[1]),
+            float(index.recall),
+            psycopg2.Binary(index.centroids.tobytes()),
+            psycopg2.Binary(index.assignments.tobytes()),
+            psycopg2.Binary(np.asarray(row_ids, dtype=np.int64).tobytes())
+        ))
+    
+    in_savepoint(conn, 'ann_index_save', upsert)
+
+def get_ann_index(conn, event_id: int, item_type: str, version: int, items: List[Dict[str, Any]], matrix: np.ndarray) -> Optional[IVFIndex]:
+    '''
+    IVF index for (event_id, item_type) or None when exact search should be used:
+    below ANN_MIN_ROWS, or when the measured recall is under ANN_MIN_RECALL
+    '''
+    
+    if matrix.shape[0] < ANN_MIN_ROWS:
+        return None
+    
+    key = (event_id, item_type, version)
+    row_ids = [item['id'] for item in items]
+    
+    with ANN_CACHE_LOCK:
+        index = ANN_CACHE.get(key)
+        if index is not None:
+            ANN_CACHE.move_to_end(key)
+    
+    if index is None:
+        try:
+            index = load_index(conn, event_id, item_type, version, row_ids)
+        except Exception as e:
+            print(f'[ANN] Loading persisted index failed: {type(e).__name__} - {e}')
+        
+        if index is None:
+            index = build_checked_index(matrix)
+            try:
+                save_index(conn, event_id, item_type, version, row_ids, index)
+            except Exception as e:
+                # The in-memory index still serves this container
+                print(f'[ANN] Persisting index failed: {type(e).__name__} - {e}')
+        
+        with ANN_CACHE_LOCK:
+            ANN_CACHE[key] = index
+            while len(ANN_CACHE) > ANN_CACHE_MAX_ENTRIES:
+                ANN_CACHE.popitem(last=False)
+    
+    if index.recall < ANN_MIN_RECALL:
+        print(f'[ANN] recall@10={index.recall:.3f} below {ANN_MIN_RECALL}, using exact search')
+        return None
+    
+    return index
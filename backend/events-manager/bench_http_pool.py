@@ -0,0 +1,77 @@
+'''
+Benchmark: per-call latency of a fresh urllib connection vs the pooled keep-alive client
+
+Usage: python bench_http_pool.py [calls]                       local HTTP server (no TLS, shows the floor)
+       python bench_http_pool.py --url https://host/path [calls]  real endpoint, GET; includes TCP + TLS setup
+       HTTP_HTTP2=off python bench_http_pool.py --url ...         force the HTTP/1.1 pool when httpx is installed
+'''
+
+import sys
+import time
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+import http_pool
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def do_GET(self):
+        payload = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, *args):
+        pass
+
+def timed(call, calls: int):
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return np.array(samples) * 1000
+
+def fresh_urllib(url: str):
+    with urllib.request.urlopen(urllib.request.Request(url), timeout=30) as response:
+        response.read()
+
+def pooled(url: str):
+    http_pool.request('GET', url, timeout=30).read()
+
+def main():
+    args = sys.argv[1:]
+    server = None
+    
+    if '--url' in args:
+        url = args[args.index('--url') + 1]
+        args = [arg for arg in args if arg not in ('--url', url)]
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+    
+    calls = int(args[0]) if args else 50
+    backend = 'httpx http2' if http_pool.http2_client() is not None else 'http.client keep-alive'
+    print(f'{calls} GET {url} ({backend})')
+    
+    pooled(url)
+    fresh = timed(lambda: fresh_urllib(url), calls)
+    reused = timed(lambda: pooled(url), calls)
+    
+    for label, samples in (('urllib (new connection)', fresh), ('http_pool (reused)', reused)):
+        print(f'  {label:<24} p50={np.percentile(samples, 50):8.2f}ms  p95={np.percentile(samples, 95):8.2f}ms')
+    
+    print(f'  saved per call: {np.percentile(fresh, 50) - np.percentile(reused, 50):.2f}ms (p50), pool stats {http_pool.POOL.stats()}')
+    
+    if server:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
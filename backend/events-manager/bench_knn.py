@@ -0,0 +1,131 @@
+'''
+Benchmark: server-side KNN (pgvector, exact and HNSW) vs in-process NumPy search
+
+Usage: DATABASE_URL=postgres://... python bench_knn.py [rows ...]   (default: 10000 100000)
+Needs a disposable Postgres with the vector extension; data goes to a TEMP table.
+'''
+
+import io
+import os
+import sys
+import time
+import numpy as np
+import psycopg2
+from rag_module import pack_embedding, unpack_embeddings, build_embedding_matrix, top_k_indices, vector_literal
+
+DIM = 1536
+QUERIES = 50
+TOP_K = 10
+
+def make_vectors(rows: int, dim: int = DIM, clusters: int = 200, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=rows)] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+    return build_embedding_matrix(vectors)
+
+def load_table(conn, vectors: np.ndarray):
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS bench_knowledge')
+    cur.execute(f'''
+        CREATE TEMP TABLE bench_knowledge (
+            id SERIAL PRIMARY KEY,
+            event_id INTEGER NOT NULL,
+            item_type VARCHAR(50) NOT NULL,
+            embedding vector({vectors.shape[1]}),
+            embedding_packed BYTEA,
+            embedding_codec VARCHAR(8)
+        )
+    ''')
+    
+    buffer = io.StringIO()
+    for vector in vectors:
+        packed = pack_embedding(vector, 'i8').hex()
+        buffer.write(f'1\tprogram_item\t{vector_literal(vector)}\t\\\\x{packed}\ti8\n')
+    buffer.seek(0)
+    
+    started = time.perf_counter()
+    cur.copy_expert(
+        'COPY bench_knowledge (event_id, item_type, embedding, embedding_packed, embedding_codec) FROM STDIN',
+        buffer
+    )
+    cur.execute('CREATE INDEX ON bench_knowledge (event_id, item_type) WHERE embedding IS NOT NULL')
+    cur.execute('ANALYZE bench_knowledge')
+    print(f'  loaded {vectors.shape[0]} rows in {time.perf_counter() - started:.1f}s')
+    
+    started = time.perf_counter()
+    cur.execute('CREATE INDEX bench_knowledge_hnsw ON bench_knowledge USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)')
+    print(f'  built HNSW index in {time.perf_counter() - started:.1f}s')
+
+def server_knn(cur, query: np.ndarray, use_index: bool):
+    cur.execute('SET LOCAL enable_indexscan = %s', ('on' if use_index else 'off',))
+    cur.execute('SET LOCAL hnsw.ef_search = 100')
+    literal = vector_literal(query)
+    cur.execute('''
+        SELECT id FROM bench_knowledge
+        WHERE event_id = 1 AND item_type = 'program_item'
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+    ''', (literal, TOP_K))
+    return [row[0] for row in cur.fetchall()]
+
+def in_process_load(cur) -> np.ndarray:
+    cur.execute('''
+        SELECT embedding_packed FROM bench_knowledge
+        WHERE event_id = 1 AND item_type = 'program_item'
+        ORDER BY id
+    ''')
+    return build_embedding_matrix(unpack_embeddings([row[0] for row in cur.fetchall()], 'i8'))
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f'p50={np.percentile(ms, 50):8.2f}ms  p95={np.percentile(ms, 95):8.2f}ms'
+
+def timed(fn, queries):
+    samples, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(fn(query))
+        samples.append(time.perf_counter() - started)
+    return samples, results
+
+def recall(exact, approx):
+    return np.mean([len(set(e) & set(a)) / len(e) for e, a in zip(exact, approx)])
+
+def run(conn, rows: int):
+    print(f'\n== {rows} rows, dim {DIM} ==')
+    vectors = make_vectors(rows)
+    load_table(conn, vectors)
+    conn.commit()
+    
+    rng = np.random.default_rng(7)
+    queries = vectors[rng.choice(rows, QUERIES, replace=False)] + 0.1 * rng.normal(size=(QUERIES, DIM)).astype(np.float32)
+    
+    cur = conn.cursor()
+    
+    exact_samples, exact_ids = timed(lambda q: server_knn(cur, q, use_index=False), queries)
+    hnsw_samples, hnsw_ids = timed(lambda q: server_knn(cur, q, use_index=True), queries)
+    conn.rollback()
+    
+    started = time.perf_counter()
+    matrix = in_process_load(cur)
+    load_seconds = time.perf_counter() - started
+    
+    numpy_samples, numpy_rows = timed(lambda q: top_k_indices(matrix, q, TOP_K)[0].tolist(), queries)
+    numpy_ids = [[row + 1 for row in result] for result in numpy_rows]
+    
+    print(f'  server exact   {percentiles(exact_samples)}')
+    print(f'  server HNSW    {percentiles(hnsw_samples)}  recall@{TOP_K}={recall(exact_ids, hnsw_ids):.3f}')
+    print(f'  numpy (warm)   {percentiles(numpy_samples)}  recall@{TOP_K}={recall(exact_ids, numpy_ids):.3f} (i8 storage)')
+    print(f'  numpy cold load {load_seconds * 1000:.0f}ms, matrix {matrix.nbytes / 2**20:.1f} MB')
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    
+    for rows in sizes:
+        run(conn, rows)
+    
+    conn.close()
+
+if __name__ == '__main__':
+    main()
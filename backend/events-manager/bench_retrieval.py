@@ -0,0 +1,318 @@
+'''
+Benchmark: latency and quality of knowledge retrieval on synthetic events
+
+Usage: python bench_retrieval.py [rows ...]                          in-process (default: 100 1000 10000 100000)
+       DATABASE_URL=postgres://... python bench_retrieval.py --db [rows ...]
+--db runs search_knowledge_multi end to end against a disposable Postgres with the
+db_migrations applied: a synthetic event is created and deleted afterwards.
+
+Corpora are program items / pain points / style snippets built from topic vocabularies;
+embeddings are topic + subtopic centroids plus noise, so a query of topic T is relevant
+to rows of T and closest to rows of its subtopic.
+Reported per strategy: p50/p95 latency, memory of the structures it needs, recall@k
+against exact cosine top-k, and topic precision@k (share of results on the query's topic).
+'''
+
+import os
+import sys
+import time
+import json
+import tracemalloc
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+import rag_module
+from ann_index import IVFIndex
+from dim_reduction import ReducedIndex
+from embedding_providers import get_embedding_provider
+from lexical_index import BM25Index
+from rag_module import (
+    EMBEDDING_CODEC, QUERY_EMBEDDING_CACHE, build_embedding_matrix, bump_index_version, pack_embedding,
+    score_items_exact, score_items_hybrid, score_items_vectorized, search_knowledge_multi, vector_column_values
+)
+
+DIM = int(os.environ.get('BENCH_DIM', '1536'))
+QUERIES = 50
+EXACT_QUERIES = 5
+EXACT_MAX_ROWS = 5000
+TOP_K = 10
+SUBTOPICS = 16
+ITEM_TYPE_SHARES = (('program_item', 0.6), ('pain_point', 0.25), ('style_snippet', 0.15))
+
+TOPICS = [
+    ('найм', ['вакансия', 'кандидат', 'рекрутер', 'собеседование', 'оффер', 'воронка', 'источник', 'скрининг']),
+    ('адаптация', ['онбординг', 'новичок', 'наставник', 'испытательный', 'чек-лист', 'buddy', 'вхождение', 'знакомство']),
+    ('удержание', ['текучесть', 'увольнение', 'лояльность', 'выгорание', 'exit-интервью', 'отток', 'удержание', 'стаж']),
+    ('обучение', ['курс', 'тренинг', 'компетенция', 'развитие', 'LMS', 'микрообучение', 'навык', 'программа']),
+    ('оценка', ['performance', 'review', 'KPI', 'OKR', 'калибровка', 'обратная', 'грейд', 'аттестация']),
+    ('компенсации', ['зарплата', 'бонус', 'вилка', 'бенчмарк', 'премия', 'льготы', 'опцион', 'пересмотр']),
+    ('культура', ['ценности', 'вовлеченность', 'миссия', 'ритуалы', 'доверие', 'команда', 'коммуникация', 'климат']),
+    ('аналитика', ['дашборд', 'метрика', 'people', 'analytics', 'прогноз', 'данные', 'отчет', 'когорта']),
+    ('бренд', ['employer', 'branding', 'карьерный', 'сайт', 'отзывы', 'амбассадор', 'репутация', 'EVP']),
+    ('лидерство', ['руководитель', 'менеджер', 'лидер', 'делегирование', 'коучинг', 'one-to-one', 'команда', 'решения']),
+    ('гибрид', ['удаленка', 'офис', 'гибридный', 'распределенная', 'асинхронный', 'часовой', 'пояс', 'коворкинг']),
+    ('автоматизация', ['HRIS', 'ATS', 'бот', 'интеграция', 'workflow', 'автоматизация', 'ИИ', 'скоринг']),
+    ('благополучие', ['wellbeing', 'здоровье', 'стресс', 'психолог', 'баланс', 'спорт', 'ДМС', 'отпуск']),
+    ('право', ['трудовой', 'кодекс', 'договор', 'ГПХ', 'самозанятый', 'проверка', 'документ', 'ЭДО']),
+    ('массовый', ['линейный', 'персонал', 'смена', 'склад', 'курьер', 'ритейл', 'массовый', 'подбор']),
+    ('IT-рынок', ['разработчик', 'тимлид', 'стек', 'релокация', 'джун', 'сеньор', 'рынок', 'дефицит']),
+    ('разнообразие', ['инклюзия', 'diversity', 'равенство', 'поколения', 'зумеры', 'возраст', 'доступность', 'гендер']),
+    ('изменения', ['трансформация', 'реорганизация', 'сопротивление', 'изменения', 'агент', 'коммуникация', 'план', 'кризис']),
+    ('внутренние', ['коммуникации', 'портал', 'рассылка', 'дайджест', 'чат', 'новости', 'опрос', 'пульс']),
+    ('преемственность', ['кадровый', 'резерв', 'преемник', 'ротация', 'талант', 'HiPo', 'карьера', 'трек']),
+]
+FILLER = ['как', 'почему', 'что', 'делать', 'практика', 'кейс', 'опыт', 'компании', 'подход', 'ошибки', 'инструменты', 'год']
+TEMPLATES = {
+    'program_item': 'Доклад: {a} и {b} — {c} {d} {e}. Спикер расскажет про {f} {g}',
+    'pain_point': 'Боль: {a} {b}, {c} не работает, {d} {e} {f}',
+    'style_snippet': 'Привет! Сегодня про {a}: {b}, {c} и немного {d} {e}',
+}
+
+def make_centers(seed: int = 0) -> np.ndarray:
+    '''
+    (topics, SUBTOPICS + 1, DIM): row 0 is the topic centroid, the rest are subtopic offsets
+    '''
+    
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(len(TOPICS), SUBTOPICS + 1, DIM)).astype(np.float32)
+    centers[:, 1:] *= 0.8
+    return centers
+
+def sample_vectors(centers: np.ndarray, topics: np.ndarray, rng, noise: float) -> np.ndarray:
+    subtopics = rng.integers(1, SUBTOPICS + 1, size=topics.shape[0])
+    vectors = centers[topics, 0] + centers[topics, subtopics]
+    return build_embedding_matrix(vectors + noise * rng.normal(size=vectors.shape).astype(np.float32))
+
+def make_corpus(rows: int, item_type: str, centers: np.ndarray, seed: int):
+    '''
+    Synthetic rows of one item_type: (items, normalized matrix, topic per row)
+    '''
+    
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(len(TOPICS), size=rows)
+    
+    items = []
+    for i, topic in enumerate(topics.tolist()):
+        words = rng.choice(TOPICS[topic][1], 5).tolist() + rng.choice(FILLER, 2).tolist()
+        rng.shuffle(words)
+        content = TEMPLATES[item_type].format(**dict(zip('abcdefg', words)))
+        items.append({'id': i + 1, 'content': content, 'metadata': {'topic': TOPICS[topic][0], 'n': i}})
+    
+    return items, sample_vectors(centers, topics, rng, 0.6), topics
+
+def make_queries(count: int, centers: np.ndarray, seed: int):
+    '''
+    Queries: two topic words + a subtopic vector with less noise than the rows
+    '''
+    
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(len(TOPICS), size=count)
+    texts = [' '.join(rng.choice(TOPICS[topic][1], 2, replace=False).tolist()) for topic in topics.tolist()]
+    return texts, sample_vectors(centers, topics, rng, 0.4), topics
+
+def measured(build):
+    '''
+    (result, seconds, peak MB allocated) of one index build
+    '''
+    
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f'p50={np.percentile(ms, 50):8.2f}ms  p95={np.percentile(ms, 95):8.2f}ms'
+
+def quality(results, exact_ids, query_topics, item_topics):
+    '''
+    (recall@k vs exact top-k, topic precision@k)
+    '''
+    
+    recall = np.mean([len({r['id'] for r in got} & exact) / max(len(exact), 1) for got, exact in zip(results, exact_ids)])
+    precision = np.mean([
+        np.mean([item_topics[r['id'] - 1] == topic for r in got]) if got else 0.0
+        for got, topic in zip(results, query_topics)
+    ])
+    return f'recall@{TOP_K}={recall:.3f}  topic-p@{TOP_K}={precision:.3f}'
+
+def run_strategy(label, search, texts, embeddings, exact_ids, query_topics, item_topics, memory_mb):
+    samples, results = [], []
+    for text, embedding in zip(texts, embeddings):
+        started = time.perf_counter()
+        results.append(search(text, embedding))
+        samples.append(time.perf_counter() - started)
+    
+    print(f'  {label:<12} {percentiles(samples)}  {memory_mb:8.1f} MB  {quality(results, exact_ids, query_topics, item_topics)}')
+
+def run_in_process(rows: int):
+    print(f'\n== {rows} program items, dim {DIM}, in-process ==')
+    
+    centers = make_centers()
+    items, matrix, item_topics = make_corpus(rows, 'program_item', centers, seed=rows)
+    texts, embeddings, query_topics = make_queries(QUERIES, centers, seed=7)
+    
+    exact_ids = [set(np.argpartition(-(matrix @ q), min(TOP_K, rows) - 1)[:TOP_K] + 1) for q in embeddings]
+    
+    if rows <= EXACT_MAX_ROWS:
+        for item, row in zip(items, matrix):
+            item['embedding'] = row.tolist()
+        run_strategy(
+            'exact', lambda text, q: score_items_exact(q.tolist(), items, 'program_item', TOP_K),
+            texts[:EXACT_QUERIES], embeddings[:EXACT_QUERIES], exact_ids, query_topics, item_topics, 0.0
+        )
+        for item in items:
+            del item['embedding']
+    else:
+        print(f'  exact        skipped above {EXACT_MAX_ROWS} rows (pure-Python reference)')
+    
+    matrix_mb = matrix.nbytes / 2**20
+    run_strategy(
+        'vectorized', lambda text, q: score_items_vectorized(q, items, matrix, 'program_item', TOP_K),
+        texts, embeddings, exact_ids, query_topics, item_topics, matrix_mb
+    )
+    
+    ivf, seconds, peak = measured(lambda: IVFIndex.build(matrix))
+    print(f'  (IVF build {seconds:.2f}s, peak {peak:.1f} MB)')
+    run_strategy(
+        'ann (ivf)', lambda text, q: score_items_vectorized(q, items, matrix, 'program_item', TOP_K, ivf),
+        texts, embeddings, exact_ids, query_topics, item_topics,
+        matrix_mb + (ivf.centroids.nbytes + ivf.assignments.nbytes + ivf.order.nbytes) / 2**20
+    )
+    
+    reduced, seconds, peak = measured(lambda: ReducedIndex.build(matrix, min(256, DIM // 2), 'truncate'))
+    run_strategy(
+        'reduced-256', lambda text, q: score_items_vectorized(q, items, matrix, 'program_item', TOP_K, reduced),
+        texts, embeddings, exact_ids, query_topics, item_topics, matrix_mb + reduced.reduced.nbytes / 2**20
+    )
+    
+    bm25, seconds, peak = measured(lambda: BM25Index([item['content'] for item in items]))
+    print(f'  (BM25 build {seconds:.2f}s, peak {peak:.1f} MB)')
+    run_strategy(
+        'hybrid', lambda text, q: score_items_hybrid(text, q, items, matrix, bm25, 'program_item', TOP_K),
+        texts, embeddings, exact_ids, query_topics, item_topics, matrix_mb + peak
+    )
+
+def create_event(conn, rows: int, provider_model: str, centers: np.ndarray):
+    '''
+    Synthetic event with all three item types; returns (event_id, {item_type: (items, matrix, topics)})
+    '''
+    
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO t_p22819116_event_schedule_app.events (name, description)
+        VALUES (%s, %s) RETURNING id
+    ''', (f'bench_retrieval {rows}', 'Synthetic event, safe to delete'))
+    event_id = cur.fetchone()[0]
+    
+    corpora = {}
+    for offset, (item_type, share) in enumerate(ITEM_TYPE_SHARES):
+        count = max(1, int(rows * share))
+        items, matrix, topics = make_corpus(count, item_type, centers, seed=rows + offset)
+        vector_columns, _ = vector_column_values(conn, matrix[0].tolist())
+        
+        psycopg2.extras.execute_values(cur, '''
+            INSERT INTO t_p22819116_event_schedule_app.knowledge_store
+            (event_id, item_type, content, metadata, embedding_packed, embedding_codec,
+             embedding_model, embedding_dim, content_hash''' + ''.join(', ' + column for column in vector_columns) + ''')
+            VALUES %s
+        ''', [
+            (
+                event_id, item_type, item['content'], json.dumps(item['metadata']),
+                psycopg2.Binary(pack_embedding(row)), EMBEDDING_CODEC, provider_model, DIM, f'bench-{item_type}-{item["id"]}'
+            ) + vector_column_values(conn, row.tolist())[1]
+            for item, row in zip(items, matrix)
+        ], template='(%s, %s, %s, %s, %s, %s, %s, %s, %s' + ', %s::vector' * len(vector_columns) + ')',
+           page_size=500)
+        
+        bump_index_version(cur, event_id, item_type)
+        corpora[item_type] = (items, matrix, topics)
+    
+    conn.commit()
+    return event_id, corpora
+
+def drop_event(conn, event_id: int):
+    conn.rollback()
+    cur = conn.cursor()
+    for table in ('knowledge_store', 'knowledge_index_versions', 'knowledge_ann_indexes'):
+        cur.execute(f'DELETE FROM t_p22819116_event_schedule_app.{table} WHERE event_id = %s', (event_id,))
+    cur.execute('DELETE FROM t_p22819116_event_schedule_app.events WHERE id = %s', (event_id,))
+    conn.commit()
+
+def run_db(conn, rows: int):
+    print(f'\n== {rows} rows across item types, dim {DIM}, search_knowledge_multi on Postgres ==')
+    
+    provider = get_embedding_provider('bench')
+    centers = make_centers()
+    texts, embeddings, query_topics = make_queries(QUERIES, centers, seed=7)
+    
+    for text, embedding in zip(texts, embeddings):
+        QUERY_EMBEDDING_CACHE.put((provider.model, text), embedding.tolist())
+    
+    started = time.perf_counter()
+    event_id, corpora = create_event(conn, rows, provider.model, centers)
+    print(f'  loaded in {time.perf_counter() - started:.1f}s (event {event_id})')
+    
+    try:
+        _, matrix, item_topics = corpora['program_item']
+        row_ids = sorted_ids(conn, event_id, 'program_item')
+        exact_ids = [{row_ids[i] for i in np.argpartition(-(matrix @ q), min(TOP_K, matrix.shape[0]) - 1)[:TOP_K]} for q in embeddings]
+        topic_by_id = {row_id: topic for row_id, topic in zip(row_ids, item_topics)}
+        
+        strategies = [('vector', 'off', False), ('hybrid', 'off', False), ('vector', 'on', False), ('hybrid', 'on', False), ('hybrid', 'off', True)]
+        for mode, server_knn, mmr in strategies:
+            rag_module.RAG_SERVER_KNN = server_knn
+            rag_module.MATRIX_CACHE.invalidate(event_id)
+            
+            samples, results = [], []
+            for text in texts:
+                started = time.perf_counter()
+                results.append(search_knowledge_multi(conn, event_id, [(text, 'program_item', TOP_K)], 'bench', mode=mode, mmr=mmr)[0])
+                samples.append(time.perf_counter() - started)
+                conn.commit()
+            
+            recall = np.mean([len({r['id'] for r in got} & exact) / len(exact) for got, exact in zip(results, exact_ids)])
+            precision = np.mean([np.mean([topic_by_id[r['id']] == t for r in got]) if got else 0.0 for got, t in zip(results, query_topics)])
+            label = f'{mode}{" server" if server_knn == "on" else ""}{" +mmr" if mmr else ""}'
+            print(
+                f'  {label:<14} cold={samples[0] * 1000:8.1f}ms  warm {percentiles(samples[1:])}'
+                f'  recall@{TOP_K}={recall:.3f}  topic-p@{TOP_K}={precision:.3f}'
+            )
+        
+        specs = [(texts[0], item_type, TOP_K) for item_type, _ in ITEM_TYPE_SHARES]
+        started = time.perf_counter()
+        search_knowledge_multi(conn, event_id, specs, 'bench', mode='hybrid', mmr=True)
+        print(f'  3 item types, hybrid +mmr, warm: {(time.perf_counter() - started) * 1000:.1f}ms')
+    finally:
+        drop_event(conn, event_id)
+
+def sorted_ids(conn, event_id: int, item_type: str):
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT id FROM t_p22819116_event_schedule_app.knowledge_store
+        WHERE event_id = %s AND item_type = %s
+        ORDER BY id
+    ''', (event_id, item_type))
+    return [row[0] for row in cur.fetchall()]
+
+def main():
+    args = sys.argv[1:]
+    use_db = '--db' in args
+    sizes = [int(arg) for arg in args if arg != '--db'] or [100, 1000, 10000, 100000]
+    
+    if not use_db:
+        for rows in sizes:
+            run_in_process(rows)
+        return
+    
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    for rows in sizes:
+        run_db(conn, rows)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
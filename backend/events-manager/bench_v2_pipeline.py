@@ -0,0 +1,67 @@
+'''
+Benchmark: wall clock of a V2 content plan generated email by email vs through the
+stage pipeline of generate_emails_v2_batch(), with simulated stage latencies (no DB / LLM).
+As in the batch, prefetch runs on the calling thread, overlaps the passes of earlier emails
+and stays at most V2_MAX_AHEAD emails ahead of the results.
+
+Usage: python bench_v2_pipeline.py [emails]
+       V2_PASS1_CONCURRENCY=1 V2_PASS2_CONCURRENCY=1 python bench_v2_pipeline.py   Pass1/Pass2 overlap only
+       V2_MAX_AHEAD=0 python bench_v2_pipeline.py                                 unbounded prefetch
+'''
+
+import sys
+import time
+
+from v2_pipeline import (
+    V2_MAX_AHEAD, V2_PASS1_CONCURRENCY, V2_PASS2_CONCURRENCY,
+    run_stage_pipeline, stage_timing_report
+)
+
+# Typical per-email latencies: retrieval + template queries, Pass1 plan, Pass2 slots
+STAGE_SECONDS = (('prefetch', 0.15), ('pass1', 1.2), ('pass2', 1.8))
+
+def simulated(seconds: float):
+    def run(job):
+        time.sleep(seconds)
+        return job
+    return run
+
+def make_jobs(emails: int):
+    return [{'content_plan_id': i, 'error': None, 'timings': {}} for i in range(emails)]
+
+def main():
+    emails = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    concurrency = {'pass1': V2_PASS1_CONCURRENCY, 'pass2': V2_PASS2_CONCURRENCY}
+    print(f'{emails} emails, stages {dict(STAGE_SECONDS)}s, concurrency {concurrency}')
+    
+    jobs = make_jobs(emails)
+    started = time.monotonic()
+    for job in jobs:
+        for name, seconds in STAGE_SECONDS:
+            simulated(seconds)(job)
+    sequential = time.monotonic() - started
+    
+    jobs = make_jobs(emails)
+    prefetch = simulated(dict(STAGE_SECONDS)['prefetch'])
+    
+    def prefetched_jobs():
+        for job in jobs:
+            prefetch_started = time.monotonic()
+            prefetch(job)
+            job['timings']['prefetch'] = time.monotonic() - prefetch_started
+            yield job
+    
+    stages = [(name, simulated(seconds), concurrency[name]) for name, seconds in STAGE_SECONDS if name != 'prefetch']
+    started = time.monotonic()
+    first_result = None
+    for _ in run_stage_pipeline(prefetched_jobs(), stages, max_ahead=V2_MAX_AHEAD):
+        first_result = first_result or time.monotonic() - started
+    report = stage_timing_report(jobs, time.monotonic() - started)
+    
+    print(f'  sequential  {sequential:8.2f}s')
+    print(f'  pipelined   {report["wall_clock_seconds"]:8.2f}s  (x{sequential / report["wall_clock_seconds"]:.1f}), first result after {first_result:.2f}s')
+    for name, stage in report['stages'].items():
+        print(f'    {name:<9} total={stage["total_seconds"]:7.2f}s  max={stage["max_seconds"]:.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+'''
+Prompt context packing for the v1 prompts: program lines and pain point paragraphs
+are ranked by BM25 relevance to the email title and packed greedily into a per-model token
+budget, instead of sending the first N characters of each document
+'''
+
+import os
+import re
+import json
+import threading
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+from lexical_index import BM25Index
+
+# Context tokens per prompt (program + pains + style examples), the rest of the window is instructions and the answer
+PROMPT_CONTEXT_DEFAULT_BUDGET = int(os.environ.get('PROMPT_CONTEXT_BUDGET', '2500'))
+# {"gpt-4o": 4000, "anthropic/claude-3.5-sonnet": 6000}; keys match the model id or its part after "/"
+PROMPT_CONTEXT_BUDGETS = json.loads(os.environ.get('PROMPT_CONTEXT_BUDGETS', '{}'))
+
+# Share of the budget per section; what a section does not use goes to the next ones
+SECTION_SHARES = (('program', 0.5), ('pain', 0.35), ('examples', 0.15))
+
+PARAGRAPH_BREAK_RE = re.compile(r'\n[ \t]*\n\s*')
+
+# Encoding files shipped with the function (see tiktoken_cache/README.md), so a cold start does not download them
+TIKTOKEN_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiktoken_cache')
+# Seconds the first prompt of a container waits for the encoding before packing with the character estimate
+TOKENIZER_LOAD_TIMEOUT = float(os.environ.get('TOKENIZER_LOAD_TIMEOUT', '2'))
+
+TOKENIZER_STATE = {}
+TOKENIZER_LOCK = threading.Lock()
+
+def load_encoding(model: str):
+    '''
+    tiktoken encoding for the model (o200k_base for unknown ids), None when tiktoken
+    or its encoding files are unavailable
+    '''
+    
+    try:
+        import tiktoken
+        
+        try:
+            return tiktoken.encoding_for_model(model.split('/')[-1])
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception:
+        return None
+
+def get_encoding(model: str):
+    '''
+    Encoding for the model, loaded once per warm container in a background thread.
+    tiktoken reads the files from TIKTOKEN_CACHE_DIR (the shipped tiktoken_cache/ unless set)
+    and downloads them without a timeout when they are missing there, so the first call waits
+    at most TOKENIZER_LOAD_TIMEOUT seconds and later calls do not wait; until the encoding is
+    loaded this is None and count_tokens() falls back to its character estimate
+    '''
+    
+    with TOKENIZER_LOCK:
+        state = TOKENIZER_STATE.get(model)
+        started = state is None
+        
+        if started:
+            state = {'encoding': None, 'ready': threading.Event()}
+            TOKENIZER_STATE[model] = state
+            os.environ.setdefault('TIKTOKEN_CACHE_DIR', TIKTOKEN_CACHE_DIR)
+            
+            def load():
+                state['encoding'] = load_encoding(model)
+                state['ready'].set()
+            
+            threading.Thread(target=load, daemon=True).start()
+    
+    state['ready'].wait(TOKENIZER_LOAD_TIMEOUT if started else 0)
+    return state['encoding']
+
+def count_tokens(text: str, model: str) -> int:
+    '''
+    Token count with the model's tokenizer, or ~3 characters per token for mixed ru/en text:
+    o200k_base averages more characters per token than that on English and Russian, so
+    the fallback packs a little less rather than overflowing the budget
+    '''
+    
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max(0, max_tokens - 1) * 3]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def context_budget(model: str) -> int:
+    for key in (model, model.split('/')[-1]):
+        if key in PROMPT_CONTEXT_BUDGETS:
+            return int(PROMPT_CONTEXT_BUDGETS[key])
+    return PROMPT_CONTEXT_DEFAULT_BUDGET
+
+class Section:
+    '''
+    Non-empty lines (or paragraphs, with paragraphs=True) of one document with token
+    counts and a BM25 index, built once and packed for many titles (content plan rows
+    share the same program / pains)
+    '''
+    
+    def __init__(self, text: str, model: str, rank: bool = True, paragraphs: bool = False):
+        text = (text or '').replace('\r\n', '\n')
+        self.model = model
+        
+        # A document without blank lines has no paragraphs: its lines are the units
+        if paragraphs and PARAGRAPH_BREAK_RE.search(text):
+            self.separator = '\n\n'
+            self.lines = [paragraph.strip() for paragraph in PARAGRAPH_BREAK_RE.split(text) if paragraph.strip()]
+        else:
+            self.separator = '\n'
+            self.lines = [line.rstrip() for line in text.split('\n') if line.strip()]
+        
+        self.tokens = np.array([count_tokens(line, model) + 1 for line in self.lines], dtype=np.int64)
+        self.index = BM25Index(self.lines) if rank and self.lines else None
+        # Sheets exported as TSV: the header row names the columns, keep it with any selection
+        self.pinned = 1 if self.lines and '\t' in self.lines[0] else 0
+    
+    def pack(self, query: str, budget: int) -> Tuple[str, int]:
+        '''
+        Ranked: lines in document order, the pinned header first, then the most relevant
+        lines that fit (ties and unmatched lines in document order), skipping lines larger
+        than what is left. Unranked: the longest prefix, the last line cut to the budget.
+        
+        Returns:
+            (packed text, tokens used)
+        '''
+        
+        if not self.lines or budget <= 0:
+            return '', 0
+        
+        if int(self.tokens.sum()) <= budget:
+            return self.separator.join(self.lines), int(self.tokens.sum())
+        
+        order = np.arange(len(self.lines))
+        if self.index is not None and query:
+            scores = self.index.scores(query)
+            scores[:self.pinned] = np.inf
+            order = np.argsort(-scores, kind='stable')
+        
+        selected = []
+        used = 0
+        for i in order.tolist():
+            if used + self.tokens[i] <= budget:
+                selected.append(i)
+                used += int(self.tokens[i])
+            elif self.index is None:
+                cut = truncate_to_tokens(self.lines[i], budget - used - 1, self.model)
+                if cut:
+                    return self.separator.join(self.lines[:i] + [cut]), used + count_tokens(cut, self.model) + 1
+                break
+        
+        return self.separator.join(self.lines[i] for i in sorted(selected)), used
+
+class ContextPacker:
+    '''
+    Packs program, pain points and style examples for one model:
+        
+        packer = ContextPacker(ai_model, program=program_text, pain=pain_text)
+        context = packer.pack(title)  # {'program': ..., 'pain': ..., 'examples': ...}
+    '''
+    
+    def __init__(self, model: str, program: str = '', pain: str = '', examples: str = '', budget: Optional[int] = None):
+        self.model = model
+        self.budget = context_budget(model) if budget is None else budget
+        self.sections = {
+            'program': Section(program, model),
+            # Pain points are written as paragraphs: keep each one whole
+            'pain': Section(pain, model, paragraphs=True),
+            # Style examples are whole emails: a prefix by lines, not a relevance pick
+            'examples': Section(examples, model, rank=False)
+        }
+    
+    def pack(self, query: str) -> Dict[str, str]:
+        packed = {}
+        used = {}
+        remaining = self.budget
+        share_left = 1.0
+        
+        for position, (name, share) in enumerate(SECTION_SHARES):
+            last = position == len(SECTION_SHARES) - 1
+            allowance = remaining if last else int(remaining * share / share_left)
+            packed[name], used[name] = self.sections[name].pack(query, allowance)
+            remaining -= used[name]
+            share_left -= share
+        
+        # Budget left by short sections goes back to the ones that were cut
+        for name, _ in SECTION_SHARES:
+            section = self.sections[name]
+            if remaining <= 0:
+                break
+            if used[name] < int(section.tokens.sum()):
+                packed[name], extended = section.pack(query, used[name] + remaining)
+                remaining -= extended - used[name]
+                used[name] = extended
+        
+        total = sum(int(section.tokens.sum()) for section in self.sections.values())
+        print(f'[CONTEXT] "{query[:60]}": {self.budget - remaining}/{self.budget} tokens packed of {total} ({self.model})')
+        return packed
+
+def pack_prompt_context(model: str, query: str, program: str = '', pain: str = '', examples: str = '') -> Dict[str, str]:
+    return ContextPacker(model, program=program, pain=pain, examples=examples).pack(query)
@@ -0,0 +1,136 @@
+'''
+Dimension-reduced first-stage search: Matryoshka truncation or PCA, exact rerank on full vectors
+'''
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple, Optional
+import numpy as np
+
+RAG_REDUCED_DIM = int(os.environ.get('RAG_REDUCED_DIM', '0'))
+RAG_REDUCED_METHOD = os.environ.get('RAG_REDUCED_METHOD', 'truncate')
+RAG_RERANK_FACTOR = int(os.environ.get('RAG_RERANK_FACTOR', '4'))
+REDUCTION_METHODS = ('truncate', 'pca')
+PCA_FIT_SAMPLE = 2000
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+class ReducedIndex:
+    '''
+    Reduced copy of a normalized embedding matrix. search() has the same
+    signature as ann_index.IVFIndex.search, so top_k_indices can use either.
+    
+    truncate: first `dim` components, renormalized (text-embedding-3 models
+              are trained so that prefixes keep most of the signal)
+    pca:      projection on the top `dim` principal components of the event's rows
+    '''
+    
+    def __init__(self, reduced: np.ndarray, method: str, mean: np.ndarray = None, components: np.ndarray = None, rerank_factor: int = RAG_RERANK_FACTOR):
+        self.reduced = reduced
+        self.method = method
+        self.mean = mean
+        self.components = components
+        self.rerank_factor = rerank_factor
+    
+    @property
+    def dim(self) -> int:
+        return self.reduced.shape[1]
+    
+    @classmethod
+    def build(cls, matrix: np.ndarray, dim: int, method: str = RAG_REDUCED_METHOD, rerank_factor: int = RAG_RERANK_FACTOR, seed: int = 0) -> 'ReducedIndex':
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f'Unknown reduction method: {method}')
+        
+        if method == 'truncate':
+            return cls(normalize_rows(matrix[:, :dim]), method, rerank_factor=rerank_factor)
+        
+        sample = matrix
+        if matrix.shape[0] > PCA_FIT_SAMPLE:
+            rng = np.random.default_rng(seed)
+            sample = matrix[rng.choice(matrix.shape[0], PCA_FIT_SAMPLE, replace=False)]
+        
+        mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        components = vt[:dim].astype(np.float32)
+        
+        return cls(normalize_rows((matrix - mean) @ components.T), method, mean.astype(np.float32), components, rerank_factor)
+    
+    def project(self, query: np.ndarray) -> np.ndarray:
+        '''
+        Reduce a normalized full-dimension query the same way as the rows
+        '''
+        
+        if self.method == 'truncate':
+            return normalize_rows(query[:self.dim])
+        
+        return normalize_rows((query - self.mean) @ self.components.T)
+    
+    def candidates(self, query: np.ndarray, count: int) -> np.ndarray:
+        '''
+        Row indices of the best `count` rows by reduced-dimension cosine (unordered)
+        '''
+        
+        scores = self.reduced @ self.project(query)
+        count = min(count, scores.shape[0])
+        
+        if count < scores.shape[0]:
+            return np.argpartition(-scores, count - 1)[:count]
+        
+        return np.arange(scores.shape[0])
+    
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Reduced first stage for top_k * rerank_factor rows, exact rerank on the full matrix
+        
+        Returns:
+            (row indices sorted by full-dimension score desc, their scores)
+        '''
+        
+        if top_k <= 0 or matrix.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        candidates = self.candidates(query, top_k * self.rerank_factor)
+        scores = matrix[candidates] @ query
+        
+        k = min(top_k, scores.shape[0])
+        best = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[0] else np.arange(scores.shape[0])
+        best = best[np.argsort(-scores[best], kind='stable')]
+        
+        return candidates[best], scores[best]
+
+REDUCED_CACHE = OrderedDict()
+REDUCED_CACHE_LOCK = threading.Lock()
+REDUCED_CACHE_MAX_ENTRIES = 32
+
+def get_reduced_index(key: Tuple[int, str, int], matrix: np.ndarray, dim: int = None, method: str = None) -> Optional[ReducedIndex]:
+    '''
+    ReducedIndex for (event_id, item_type, index_version), or None when
+    RAG_REDUCED_DIM is off or not smaller than the stored dimension
+    '''
+    
+    dim = RAG_REDUCED_DIM if dim is None else dim
+    method = method or RAG_REDUCED_METHOD
+    
+    if dim <= 0 or matrix.shape[0] == 0 or dim >= matrix.shape[1]:
+        return None
+    
+    cache_key = key + (dim, method)
+    
+    with REDUCED_CACHE_LOCK:
+        index = REDUCED_CACHE.get(cache_key)
+        if index is not None:
+            REDUCED_CACHE.move_to_end(cache_key)
+            return index
+    
+    index = ReducedIndex.build(matrix, dim, method)
+    
+    with REDUCED_CACHE_LOCK:
+        REDUCED_CACHE[cache_key] = index
+        while len(REDUCED_CACHE) > REDUCED_CACHE_MAX_ENTRIES:
+            REDUCED_CACHE.popitem(last=False)
+    
+    return index
@@ -0,0 +1,80 @@
+'''
+Embedding providers and the model tag each one writes to knowledge_store.embedding_model
+and embedding_cache.model, plus the local hashed n-gram vectorizer. index-knowledge
+(indexing), events-manager and generate-drafts-v2 (queries) share this file, so rows
+and queries always carry the same tag and local vectors are comparable.
+
+Source: backend/shared/embedding_models.py, copied into the functions by backend/shared/sync.py.
+'''
+
+import os
+import re
+import math
+import hashlib
+import unicodedata
+from typing import List, Optional
+
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai')
+LOCAL_EMBEDDING_DIM = int(os.environ.get('LOCAL_EMBEDDING_DIM', '1536'))
+LOCAL_NGRAM_RANGE = (3, 5)
+SENTENCE_TRANSFORMER_MODEL = os.environ.get('SENTENCE_TRANSFORMER_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
+
+EMBEDDING_PROVIDERS = ('openai', 'local', 'sentence-transformers')
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def local_model_name(dim: int = LOCAL_EMBEDDING_DIM) -> str:
+    return f'local-hash-ngram-{dim}'
+
+def sentence_transformer_model_name(model_name: str = SENTENCE_TRANSFORMER_MODEL) -> str:
+    return f'st:{model_name}'
+
+def embedding_model_name(provider: Optional[str] = None) -> str:
+    '''
+    Model tag for a provider name (EMBEDDING_PROVIDER by default); ValueError for unknown names
+    '''
+    
+    provider = provider or EMBEDDING_PROVIDER
+    
+    if provider == 'openai':
+        return OPENAI_EMBEDDING_MODEL
+    
+    if provider == 'local':
+        return local_model_name()
+    
+    if provider == 'sentence-transformers':
+        return sentence_transformer_model_name()
+    
+    raise ValueError(f'Unknown embedding provider: {provider} (expected one of {", ".join(EMBEDDING_PROVIDERS)})')
+
+def hashed_ngram_embedding(text: str, dim: int = LOCAL_EMBEDDING_DIM) -> List[float]:
+    '''
+    Deterministic offline embedding: word tokens and character 3-5-grams hashed
+    (blake2b, signed) into dim buckets, sublinear tf, L2-normalized
+    '''
+    
+    normalized = unicodedata.normalize('NFC', text or '').lower().replace('ё', 'е')
+    
+    counts = {}
+    for word in WORD_RE.findall(normalized):
+        counts['w:' + word] = counts.get('w:' + word, 0) + 1
+        
+        padded = f' {word} '
+        for n in range(LOCAL_NGRAM_RANGE[0], LOCAL_NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                gram = 'c:' + padded[i:i + n]
+                counts[gram] = counts.get(gram, 0) + 1
+    
+    vector = [0.0] * dim
+    for feature, count in counts.items():
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign * (1.0 + math.log(count))
+    
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm > 0:
+        vector = [x / norm for x in vector]
+    
+    return vector
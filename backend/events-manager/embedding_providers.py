@@ -0,0 +1,122 @@
+'''
+Embedding providers for RAG: remote OpenAI API or local deterministic backends
+'''
+
+import json
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import http_pool
+from embedding_models import (
+    EMBEDDING_PROVIDER, EMBEDDING_PROVIDERS, LOCAL_EMBEDDING_DIM, OPENAI_EMBEDDING_MODEL, SENTENCE_TRANSFORMER_MODEL,
+    hashed_ngram_embedding, local_model_name, sentence_transformer_model_name
+)
+
+class EmbeddingProvider(ABC):
+    '''
+    Interface: model is the cache/storage key (embedding_cache.model,
+    knowledge_store.embedding_model), embed() maps one batch of texts to vectors
+    '''
+    
+    model = ''
+    requires_api_key = False
+    
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        pass
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    '''
+    text-embedding-3-small over the OpenAI embeddings API, 1536 dims
+    '''
+    
+    model = OPENAI_EMBEDDING_MODEL
+    requires_api_key = True
+    url = 'https://api.openai.com/v1/embeddings'
+    
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        payload = {
+            'model': self.model,
+            'input': texts
+        }
+        
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {self.api_key}'
+            }
+        )
+        
+        with http_pool.urlopen(req, timeout=60, idempotent=True) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        
+        embeddings = [None] * len(texts)
+        for entry in result['data']:
+            embeddings[entry['index']] = entry['embedding']
+        
+        return embeddings
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    '''
+    Deterministic offline embeddings: word tokens and character 3-5-grams hashed
+    (blake2b, signed) into a fixed number of buckets, sublinear tf, L2-normalized.
+    No network, no model files; identical output in every process, so vectors
+    written by index-knowledge match queries embedded here.
+    '''
+    
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM):
+        self.dim = dim
+        self.model = local_model_name(dim)
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [hashed_ngram_embedding(text, self.dim) for text in texts]
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    '''
+    Local CPU sentence-transformers model (optional dependency, loaded lazily)
+    '''
+    
+    _models = {}
+    
+    def __init__(self, model_name: str = SENTENCE_TRANSFORMER_MODEL):
+        self.model_name = model_name
+        self.model = sentence_transformer_model_name(model_name)
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        encoder = self._models.get(self.model_name)
+        
+        if encoder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise ValueError('EMBEDDING_PROVIDER=sentence-transformers requires the sentence-transformers package')
+            
+            encoder = SentenceTransformer(self.model_name, device='cpu')
+            self._models[self.model_name] = encoder
+        
+        return encoder.encode(texts, normalize_embeddings=True).tolist()
+
+def get_embedding_provider(api_key: Optional[str] = None, name: Optional[str] = None) -> EmbeddingProvider:
+    '''
+    Provider selected by EMBEDDING_PROVIDER: 'openai' (default), 'local'
+    (hashed n-grams) or 'sentence-transformers'
+    '''
+    
+    name = name or EMBEDDING_PROVIDER
+    
+    if name == 'openai':
+        return OpenAIEmbeddingProvider(api_key)
+    
+    if name == 'local':
+        return HashingEmbeddingProvider()
+    
+    if name == 'sentence-transformers':
+        return SentenceTransformerProvider()
+    
+    raise ValueError(f'Unknown embedding provider: {name} (expected one of {", ".join(EMBEDDING_PROVIDERS)})')
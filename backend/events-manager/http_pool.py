@@ -0,0 +1,379 @@
+'''
+Pooled HTTP client for LLM and embedding APIs: keep-alive connections per host,
+so a warm container pays the TCP + TLS handshake once instead of on every call.
+HTTP/2 is used through httpx when it (with h2) is installed; connect and read
+timeouts come from env.
+
+Source: backend/shared/http_pool.py. Functions are deployed separately, so
+backend/shared/sync.py copies it into every function that calls these APIs; the
+copies are committed (sync.py --check fails when one drifts), edit only the shared file.
+'''
+
+import io
+import os
+import ssl
+import json
+import select
+import socket
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '60'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '8'))
+HTTP_HTTP2 = os.environ.get('HTTP_HTTP2', 'auto')  # auto | off
+
+# Errors of a reused connection that the server already closed
+STALE_CONNECTION_ERRORS = (ConnectionError, http.client.BadStatusLine)
+# Methods that may be resent when a reused connection fails before the request was fully sent
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+# Errors of a reused connection that the server closed after reading the request without answering
+# (http.client.RemoteDisconnected is one); only requests marked idempotent are sent again
+DISCONNECT_ERRORS = (ConnectionResetError,)
+
+class PooledResponse:
+    '''
+    Fully read response. Supports what call sites used from urlopen()
+    (context manager, read(), status/getcode()) plus text / json()
+    '''
+    
+    def __init__(self, url: str, status: int, reason: str, headers, body: bytes):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+    
+    def __enter__(self) -> 'PooledResponse':
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def read(self) -> bytes:
+        return self.body
+    
+    def getcode(self) -> int:
+        return self.status
+    
+    @property
+    def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+    
+    def json(self) -> Any:
+        return json.loads(self.body.decode('utf-8'))
+
+class ConnectionPool:
+    '''
+    Idle keep-alive connections per (scheme, host, port), reused LIFO.
+    A connection is owned by one thread between acquire() and release().
+    '''
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.ssl_context = ssl.create_default_context()
+        self.created = 0
+        self.reused = 0
+        self.dropped = 0
+    
+    def acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                conn = idle.pop() if idle else None
+                if conn is None:
+                    self.created += 1
+                    break
+            
+            if connection_dropped(conn):
+                conn.close()
+                with self.lock:
+                    self.dropped += 1
+                continue
+            
+            with self.lock:
+                self.reused += 1
+            return conn, True
+        
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=HTTP_CONNECT_TIMEOUT, context=self.ssl_context), False
+        
+        return http.client.HTTPConnection(host, port, timeout=HTTP_CONNECT_TIMEOUT), False
+    
+    def release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        
+        conn.close()
+    
+    def clear(self):
+        with self.lock:
+            connections = [conn for idle in self.idle.values() for conn in idle]
+            self.idle = {}
+        
+        for conn in connections:
+            conn.close()
+    
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'dropped': self.dropped,
+                'idle': sum(len(idle) for idle in self.idle.values())
+            }
+
+def connection_dropped(conn: http.client.HTTPConnection) -> bool:
+    '''
+    An idle keep-alive socket has nothing to read: readable means the server closed it
+    '''
+    
+    if conn.sock is None:
+        return True
+    
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    
+    return bool(readable)
+
+POOL = ConnectionPool(HTTP_POOL_MAXSIZE)
+
+HTTP2_STATE = {}
+
+def http2_client():
+    '''
+    Shared httpx.Client(http2=True), or None when HTTP_HTTP2=off or httpx/h2 are not installed
+    '''
+    
+    if HTTP_HTTP2 == 'off':
+        return None
+    
+    if 'client' not in HTTP2_STATE:
+        try:
+            import httpx
+            import h2  # noqa: F401 - httpx needs it for http2=True
+            
+            HTTP2_STATE['httpx'] = httpx
+            HTTP2_STATE['client'] = httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_keepalive_connections=HTTP_POOL_MAXSIZE)
+            )
+        except ImportError:
+            HTTP2_STATE['client'] = None
+    
+    return HTTP2_STATE['client']
+
+def request_http2(client, method: str, url: str, body: Optional[bytes], headers: Dict[str, str], timeout: float) -> PooledResponse:
+    httpx = HTTP2_STATE['httpx']
+    
+    try:
+        response = client.request(
+            method, url, content=body, headers=headers,
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+        )
+    except httpx.TransportError as e:
+        raise urllib.error.URLError(e)
+    
+    return PooledResponse(url, response.status_code, response.reason_phrase, response.headers, response.content)
+
+def send(
+    method: str,
+    url: str,
+    body: Optional[bytes],
+    headers: Dict[str, str],
+    timeout: float,
+    idempotent: Optional[bool] = None
+) -> Tuple[Tuple[str, str, int], http.client.HTTPConnection, http.client.HTTPResponse]:
+    '''
+    Send the request on a pooled connection and read the status line and headers.
+    A reused connection that fails is replaced once, only when repeating the request
+    is safe: idempotent (GET/PUT/... by default; embedding POSTs pass True) and either
+    not fully sent yet or disconnected by the server without an answer. A non-idempotent
+    request that may have reached the server (an LLM call may be billed) raises instead.
+    
+    Returns:
+        (pool key, connection, response with the body not read yet)
+    '''
+    
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    repeatable = method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent
+    
+    for attempt in range(2):
+        conn, reused = POOL.acquire(key)
+        sent = False
+        
+        try:
+            if conn.sock is None:
+                conn.connect()
+                conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.sock.settimeout(timeout)
+            
+            conn.request(method, path, body=body, headers=headers)
+            sent = True
+            return key, conn, conn.getresponse()
+        except STALE_CONNECTION_ERRORS as e:
+            conn.close()
+            if reused and attempt == 0 and repeatable and (not sent or isinstance(e, DISCONNECT_ERRORS)):
+                continue
+            raise urllib.error.URLError(e)
+        except OSError as e:
+            conn.close()
+            raise urllib.error.URLError(e)
+        except Exception:
+            conn.close()
+            raise
+
+def request(
+    method: str,
+    url: str,
+    body: Optional[bytes] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    idempotent: Optional[bool] = None
+) -> PooledResponse:
+    '''
+    Send one request over a pooled connection and read the whole response.
+    Any status is returned; network errors and timeouts raise urllib.error.URLError.
+    
+    Args:
+        timeout: read timeout in seconds (HTTP_READ_TIMEOUT by default);
+                 connecting is bounded by HTTP_CONNECT_TIMEOUT
+        idempotent: safe to send twice (see send()); by default only for GET/PUT/DELETE/...
+    '''
+    
+    timeout = HTTP_READ_TIMEOUT if timeout is None else timeout
+    headers = dict(headers or {})
+    
+    client = http2_client()
+    if client is not None:
+        return request_http2(client, method, url, body, headers, timeout)
+    
+    key, conn, response = send(method, url, body, headers, timeout, idempotent)
+    
+    try:
+        data = response.read()
+    except OSError as e:
+        conn.close()
+        raise urllib.error.URLError(e)
+    except Exception:
+        conn.close()
+        raise
+    
+    if response.will_close:
+        conn.close()
+    else:
+        POOL.release(key, conn)
+    
+    return PooledResponse(url, response.status, response.reason, response.headers, data)
+
+def urlopen(req, timeout: Optional[float] = None, idempotent: Optional[bool] = None) -> PooledResponse:
+    '''
+    Drop-in for urllib.request.urlopen(urllib.request.Request(...)):
+    raises urllib.error.HTTPError for 4xx/5xx, with the body readable via e.read()
+    '''
+    
+    response = request(req.get_method(), req.full_url, req.data, dict(req.header_items()), timeout, idempotent)
+    
+    if response.status >= 400:
+        raise urllib.error.HTTPError(req.full_url, response.status, response.reason, response.headers, io.BytesIO(response.body))
+    
+    return response
+
+def post_json(
+    url: str,
+    payload: Any,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    idempotent: Optional[bool] = None
+) -> Any:
+    '''
+    POST a JSON body and decode the JSON response; 4xx/5xx raise urllib.error.HTTPError
+    '''
+    
+    response = request(
+        'POST', url, json.dumps(payload).encode('utf-8'),
+        {'Content-Type': 'application/json', **(headers or {})}, timeout, idempotent
+    )
+    
+    if response.status >= 400:
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.body))
+    
+    return response.json()
+
+def stream_lines(
+    method: str,
+    url: str,
+    body: Optional[bytes] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None
+) -> Iterator[str]:
+    '''
+    Send one request and yield the response body line by line as it arrives
+    (server-sent events). 4xx/5xx raise urllib.error.HTTPError before the first line;
+    the connection goes back to the pool only when the body was read to the end.
+    
+    Args:
+        timeout: max seconds between two reads, not for the whole body
+    '''
+    
+    timeout = HTTP_READ_TIMEOUT if timeout is None else timeout
+    headers = dict(headers or {})
+    
+    client = http2_client()
+    if client is not None:
+        yield from stream_lines_http2(client, method, url, body, headers, timeout)
+        return
+    
+    key, conn, response = send(method, url, body, headers, timeout)
+    
+    if response.status >= 400:
+        data = response.read()
+        conn.close()
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(data))
+    
+    completed = False
+    try:
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            yield line.decode('utf-8').rstrip('\r\n')
+        completed = True
+    except OSError as e:
+        raise urllib.error.URLError(e)
+    finally:
+        if completed and not response.will_close:
+            POOL.release(key, conn)
+        else:
+            conn.close()
+
+def stream_lines_http2(client, method: str, url: str, body: Optional[bytes], headers: Dict[str, str], timeout: float) -> Iterator[str]:
+    httpx = HTTP2_STATE['httpx']
+    
+    try:
+        with client.stream(
+            method, url, content=body, headers=headers,
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+        ) as response:
+            if response.status_code >= 400:
+                data = response.read()
+                raise urllib.error.HTTPError(url, response.status_code, response.reason_phrase, response.headers, io.BytesIO(data))
+            
+            yield from response.iter_lines()
+    except httpx.TransportError as e:
+        raise urllib.error.URLError(e)
@@ -1,12 +1,21 @@
 import json
 import os
-from typing import Dict, Any
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import urllib.request
 import urllib.parse
 import csv
 from io import StringIO
+from context_packer import ContextPacker, pack_prompt_context
+from llm_cache import LLM_RESPONSE_CACHE, cached_chat_completion
+from llm_client import chat_completion, current_deadline, start_invocation
+from rag_module import QUERY_EMBEDDING_CACHE, MATRIX_CACHE
+from stream_progress import open_progress, read_progress
 
 def extract_meta_from_csv(csv_content: str) -> Dict[str, str]:
     """Извлекает метаданные из CSV в формате A (ключ) -> B (значение)"""
@@ -73,12 +82,97 @@ def read_google_doc(url: str, sheet_name: str = '') -> Any:
         print(f'[ERROR] Failed to read Google doc: {str(e)}')
         return ''
 
+CONTENT_PLAN_MAX_CONCURRENCY = int(os.environ.get('CONTENT_PLAN_MAX_CONCURRENCY', '4'))
+
+EMBEDDED_JSON_RE = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', re.DOTALL)
+
+def response_text(response: Dict[str, Any]) -> str:
+    return response['choices'][0]['message']['content']
+
+def parse_embedded_json(content: str) -> Optional[Dict[str, Any]]:
+    '''
+    First JSON object (one level of nesting) inside free text, None when there is none
+    '''
+    
+    json_match = EMBEDDED_JSON_RE.search(content)
+    return json.loads(json_match.group()) if json_match else None
+
+def parse_email_json(content: str) -> Dict[str, Any]:
+    '''
+    {"subject", "html", ...} from a completion: strips ``` fences and, if the JSON
+    does not parse, retries without stray backslashes. Raises when it still fails.
+    '''
+    
+    content = content.strip()
+    if content.startswith('```json'):
+        content = content[7:]
+    if content.startswith('```'):
+        content = content[3:]
+    if content.endswith('```'):
+        content = content[:-3]
+    content = content.strip()
+    
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return json.loads(re.sub(r'\\(?![ntr"\\])', '', content))
+
+def request_email_json(api_url: str, api_key: str, model: str, system_prompt: str, prompt: str, title: str) -> Optional[Dict[str, Any]]:
+    '''
+    One chat completion for a content-plan row, parsed as {"subject", "html"}.
+    Runs in a worker thread: no DB access here, errors are logged and give None.
+    '''
+    
+    try:
+        request_payload = {
+            'model': model,
+            'messages': [
+                {
+                    'role': 'system', 
+                    'content': system_prompt
+                },
+                {
+                    'role': 'user', 
+                    'content': prompt
+                }
+            ],
+            'temperature': 0.8,
+            'max_tokens': 4000
+        }
+        
+        print(f'[AI] Generating for title: {title} (model={model}, temp=0.8, max_tokens=4000)')
+        
+        result = chat_completion(api_url, api_key, request_payload, timeout=60)
+        
+        content = result['choices'][0]['message']['content']
+        
+        try:
+            email_data = parse_email_json(content)
+        except json.JSONDecodeError as json_err:
+            print(f'[ERROR] JSON parse failed for "{title}" even after cleanup: {str(json_err)}')
+            print(f'[ERROR] Content preview: {content.strip()[:500]}')
+            return None
+        
+        print(f'[AI] Generated subject: {email_data.get("subject", title)}')
+        return email_data
+    
+    except urllib.error.HTTPError as e:
+        error_body = e.read().decode('utf-8') if hasattr(e, 'read') else str(e)
+        print(f'[ERROR] API HTTP Error for "{title}": {e.code} - {error_body[:500]}')
+    except urllib.error.URLError as e:
+        print(f'[ERROR] API timeout/network error for "{title}": {str(e)}')
+    except Exception as e:
+        print(f'[ERROR] AI generation failed for "{title}": {type(e).__name__} - {str(e)[:500]}')
+    
+    return None
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление мероприятиями - CRUD операций, связь с UniSender списками, UTM правила
     Args: event - dict с httpMethod, body (action, параметры мероприятия)
     Returns: HTTP response с данными
     '''
+    start_invocation(context)
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -291,6 +385,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'rows': rows, 'total': len(rows)})
                 }
             
+            elif action == 'rag_stats':
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'query_embedding_cache': QUERY_EMBEDDING_CACHE.stats(),
+                        'llm_response_cache': LLM_RESPONSE_CACHE.stats(),
+                        'matrix_cache': {
+                            'entries': len(MATRIX_CACHE.entries),
+                            'bytes': MATRIX_CACHE.current_bytes,
+                            'max_bytes': MATRIX_CACHE.max_bytes
+                        }
+                    })
+                }
+            
+            elif action == 'generation_progress':
+                stream_id = params.get('stream_id', '')
+                
+                if not stream_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'stream_id required'})
+                    }
+                
+                progress = read_progress(cur, stream_id)
+                
+                return {
+                    'statusCode': 200 if progress else 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(progress or {'error': 'Stream not found'}, ensure_ascii=False)
+                }
+            
             else:
                 return {
                     'statusCode': 400,
@@ -665,6 +792,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'generate_drafts':
                 list_id = body_data.get('list_id')
+                force_fresh = bool(body_data.get('force_fresh', False))
                 
                 if not list_id:
                     return {
@@ -800,13 +928,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 НЕ пиши HTML, НЕ добавляй лишнего текста — только JSON."""
                     
                     try:
-                        ai_response = requests.post(
+                        ai_response = cached_chat_completion(
+                            conn,
                             api_url,
-                            headers={
-                                'Authorization': f'Bearer {api_key}',
-                                'Content-Type': 'application/json'
-                            },
-                            json={
+                            api_key,
+                            {
                                 'model': 'gpt-4o-mini',
                                 'messages': [
                                     {'role': 'system', 'content': 'Ты эксперт по email-маркетингу. Возвращаешь ТОЛЬКО валидный JSON, без комментариев.'},
@@ -815,20 +941,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                                 'temperature': 0.9,
                                 'max_tokens': 1500
                             },
-                            timeout=60
+                            timeout=60,
+                            force_fresh=force_fresh,
+                            validate=lambda response: parse_embedded_json(response_text(response))
                         )
                         
-                        if ai_response.status_code != 200:
-                            print(f'[ERROR] AI API error: {ai_response.status_code} - {ai_response.text}')
-                            continue
-                        
-                        ai_content = ai_response.json()['choices'][0]['message']['content']
+                        ai_content = response_text(ai_response)
                         
                         # Парсим JSON из ответа AI
-                        import re
-                        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', ai_content, re.DOTALL)
-                        if json_match:
-                            result = json.loads(json_match.group())
+                        result = parse_embedded_json(ai_content)
+                        if result is not None:
                             ai_subject = result.get('subject', template_name)
                             ai_pain_points = result.get('pain_points', '')
                             ai_program_topics = result.get('program_topics', '')
@@ -1064,8 +1186,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 print(f'[AI] Using provider={provider}, model={ai_model}, api_url={api_url}')
                 
+                context_packer = ContextPacker(ai_model, program=program_text, pain=pain_points_text, examples=email_template_examples)
+                
                 generated_count = 0
                 skipped_count = 0
+                row_results = []
+                jobs = []
                 
                 for row in rows:
                     title = row['title']
@@ -1081,6 +1207,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     if existing and existing['count'] > 0:
                         print(f'[SKIP] Email with subject "{title}" already exists')
                         skipped_count += 1
+                        row_results.append({'title': title, 'status': 'skipped'})
                         continue
                     
                     cur.execute('''
@@ -1093,6 +1220,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     template_row = cur.fetchone()
                     if not template_row:
                         print(f'[WARN] No template for content_type_id={content_type_id}')
+                        row_results.append({'title': title, 'status': 'no_template'})
                         continue
                     
                     instructions = template_row['instructions'] or ''
@@ -1132,6 +1260,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         if event_venue:
                             date_info += f'\nМесто: {event_venue}'
                     
+                    prompt_context = context_packer.pack(title)
+                    
                     prompt = f"""Ты - эксперт по email-маркетингу. Твоя задача - создать эффективное письмо для рассылки.
 
 КОНТЕКСТ МЕРОПРИЯТИЯ:
@@ -1139,17 +1269,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 Тон общения: {tone_desc}
 
 ПРОГРАММА МЕРОПРИЯТИЯ:
-{program_text[:3000]}
+{prompt_context['program']}
 
 БОЛИ ЦЕЛЕВОЙ АУДИТОРИИ:
-{pain_points_text[:2000]}
+{prompt_context['pain']}
 
 ЗАДАНИЕ НА ПИСЬМО:
 Тема/заголовок: {title}
 Тип контента: {instructions}
 
 ПРИМЕРЫ СТИЛЯ ПИСЕМ (если есть):
-{email_template_examples[:1000] if email_template_examples else 'Используй профессиональный стиль email-маркетинга'}
+{prompt_context['examples'] or 'Используй профессиональный стиль email-маркетинга'}
 
 ТРЕБОВАНИЯ:
 1. Изучи программу мероприятия и выбери темы, максимально соответствующие заголовку "{title}"
@@ -1170,188 +1300,165 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 Верни ТОЛЬКО JSON, без дополнительных комментариев."""
                     
-                    print(f'[AI] Generating for title: {title}')
+                    # Получаем UTM параметры для всех ссылок
+                    cur.execute('''
+                        SELECT utm_source, utm_medium, utm_campaign
+                        FROM t_p22819116_event_schedule_app.event_mailing_lists
+                        WHERE id = %s
+                    ''', (event_list_id,))
+                    utm_data = cur.fetchone()
                     
-                    try:
-                        request_payload = {
-                            'model': ai_model,
-                            'messages': [
-                                {
-                                    'role': 'system', 
-                                    'content': f'Ты профессиональный email-маркетолог. Стиль общения: {tone_desc}. Отвечаешь строго в формате JSON.'
-                                },
-                                {
-                                    'role': 'user', 
-                                    'content': prompt
-                                }
-                            ],
-                            'temperature': 0.8,
-                            'max_tokens': 4000
-                        }
+                    utm_params = []
+                    if utm_data and utm_data.get('utm_source'):
+                        utm_params.append(f"utm_source={urllib.parse.quote(utm_data['utm_source'])}")
+                    if utm_data and utm_data.get('utm_medium'):
+                        utm_params.append(f"utm_medium={urllib.parse.quote(utm_data['utm_medium'])}")
+                    if utm_data and utm_data.get('utm_campaign'):
+                        utm_params.append(f"utm_campaign={urllib.parse.quote(utm_data['utm_campaign'])}")
+                    
+                    # Добавляем utm_content = название типа контента
+                    cur.execute('SELECT name, cta_urls FROM t_p22819116_event_schedule_app.content_types WHERE id = %s', (content_type_id,))
+                    ct_row = cur.fetchone()
+                    if ct_row:
+                        utm_params.append(f"utm_content={urllib.parse.quote(ct_row['name'])}")
+                    
+                    # Добавляем utm_term = тема письма (заголовок)
+                    utm_params.append(f"utm_term={urllib.parse.quote(title)}")
+                    
+                    result = {'title': title, 'status': 'failed'}
+                    row_results.append(result)
+                    jobs.append({
+                        'title': title,
+                        'content_type_id': content_type_id,
+                        'system_prompt': f'Ты профессиональный email-маркетолог. Стиль общения: {tone_desc}. Отвечаешь строго в формате JSON.',
+                        'prompt': prompt,
+                        'utm_params': utm_params,
+                        'ct_row': ct_row,
+                        'result': result
+                    })
+                
+                print(f'[AI] Generating {len(jobs)} emails, up to {CONTENT_PLAN_MAX_CONCURRENCY} in flight')
+                
+                # LLM-запросы идут параллельно, а запись в БД — в этом потоке и в порядке контент-плана.
+                # Новые строки отправляются, только пока не истёк бюджет вызова (current_deadline);
+                # оставшиеся получают статус 'deadline' и могут быть сгенерированы повторным запросом
+                deadline = current_deadline()
+                workers = max(1, min(CONTENT_PLAN_MAX_CONCURRENCY, len(jobs)))
+                deadline_count = 0
+                
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {}
+                    submitted = 0
+                    
+                    for index, job in enumerate(jobs):
+                        while submitted < len(jobs) and submitted < index + workers:
+                            if deadline is not None and time.monotonic() >= deadline:
+                                break
+                            
+                            next_job = jobs[submitted]
+                            futures[submitted] = executor.submit(
+                                request_email_json, api_url, api_key, ai_model, next_job['system_prompt'], next_job['prompt'], next_job['title']
+                            )
+                            submitted += 1
                         
-                        print(f'[AI] Request payload: model={ai_model}, temp=0.8, max_tokens=4000')
+                        if index not in futures:
+                            job['result']['status'] = 'deadline'
+                            deadline_count += 1
+                            continue
                         
-                        req = urllib.request.Request(
-                            api_url,
-                            data=json.dumps(request_payload).encode('utf-8'),
-                            headers={
-                                'Content-Type': 'application/json',
-                                'Authorization': f'Bearer {api_key}'
-                            }
-                        )
+                        email_data = futures.pop(index).result()
+                        if email_data is None:
+                            continue
                         
-                        with urllib.request.urlopen(req, timeout=60) as response:
-                            result = json.loads(response.read().decode('utf-8'))
-                            content = result['choices'][0]['message']['content']
-                            
-                            content = content.strip()
-                            if content.startswith('```json'):
-                                content = content[7:]
-                            if content.startswith('```'):
-                                content = content[3:]
-                            if content.endswith('```'):
-                                content = content[:-3]
-                            content = content.strip()
-                            
-                            try:
-                                email_data = json.loads(content)
-                            except json.JSONDecodeError as json_err:
-                                print(f'[ERROR] JSON parse failed for "{title}": {str(json_err)}')
-                                print(f'[ERROR] Content preview: {content[:500]}')
-                                
-                                # Пробуем исправить проблемные escape-последовательности
-                                try:
-                                    import re
-                                    # Убираем одинарные обратные слэши перед буквами (не \n, \t, \", \\)
-                                    fixed_content = re.sub(r'\\(?![ntr"\\])', '', content)
-                                    email_data = json.loads(fixed_content)
-                                    print(f'[AI] Fixed JSON parsing with regex cleanup')
-                                except Exception as e2:
-                                    print(f'[ERROR] Even after cleanup failed: {str(e2)}')
-                                    continue
-                            final_subject = email_data.get('subject', title)
-                            final_html = email_data.get('html', '')
-                            
-                            print(f'[AI] Generated subject: {final_subject}')
-                            
-                            # Получаем UTM параметры для всех ссылок
-                            cur.execute('''
-                                SELECT utm_source, utm_medium, utm_campaign
-                                FROM t_p22819116_event_schedule_app.event_mailing_lists
-                                WHERE id = %s
-                            ''', (event_list_id,))
-                            utm_data = cur.fetchone()
-                            
-                            utm_params = []
-                            if utm_data and utm_data.get('utm_source'):
-                                utm_params.append(f"utm_source={urllib.parse.quote(utm_data['utm_source'])}")
-                            if utm_data and utm_data.get('utm_medium'):
-                                utm_params.append(f"utm_medium={urllib.parse.quote(utm_data['utm_medium'])}")
-                            if utm_data and utm_data.get('utm_campaign'):
-                                utm_params.append(f"utm_campaign={urllib.parse.quote(utm_data['utm_campaign'])}")
-                            
-                            # Добавляем utm_content = название типа контента
-                            cur.execute('SELECT name, cta_urls FROM t_p22819116_event_schedule_app.content_types WHERE id = %s', (content_type_id,))
-                            ct_row = cur.fetchone()
-                            if ct_row:
-                                utm_params.append(f"utm_content={urllib.parse.quote(ct_row['name'])}")
-                            
-                            # Добавляем utm_term = тема письма (заголовок)
-                            utm_params.append(f"utm_term={urllib.parse.quote(title)}")
+                        title = job['title']
+                        content_type_id = job['content_type_id']
+                        utm_params = job['utm_params']
+                        ct_row = job['ct_row']
+                        final_subject = email_data.get('subject', title)
+                        final_html = email_data.get('html', '')
+                        
+                        # Заменяем CTA ссылки из типа контента
+                        if ct_row and ct_row.get('cta_urls'):
+                            cta_urls_list = ct_row['cta_urls'] if isinstance(ct_row['cta_urls'], list) else json.loads(ct_row['cta_urls']) if ct_row['cta_urls'] else []
                             
-                            # Заменяем CTA ссылки из типа контента
-                            if ct_row and ct_row.get('cta_urls'):
-                                import re
-                                cta_urls_list = ct_row['cta_urls'] if isinstance(ct_row['cta_urls'], list) else json.loads(ct_row['cta_urls']) if ct_row['cta_urls'] else []
-                                
-                                for idx, cta in enumerate(cta_urls_list):
-                                    if cta.get('url'):
-                                        base_url = cta['url']
-                                        separator = '&' if '?' in base_url else '?'
-                                        full_url = f"{base_url}{separator}{'&'.join(utm_params)}"
+                            for idx, cta in enumerate(cta_urls_list):
+                                if cta.get('url'):
+                                    base_url = cta['url']
+                                    separator = '&' if '?' in base_url else '?'
+                                    full_url = f"{base_url}{separator}{'&'.join(utm_params)}"
+                                    
+                                    # 1. Заменяем {{CTA_URL_0}}, {{CTA_URL_1}} и т.д.
+                                    final_html = final_html.replace(f'{{{{CTA_URL_{idx}}}}}', full_url)
+                                    
+                                    # 2. Умная замена по тексту кнопки
+                                    if cta.get('label'):
+                                        label = cta['label']
                                         
-                                        # 1. Заменяем {{CTA_URL_0}}, {{CTA_URL_1}} и т.д.
-                                        final_html = final_html.replace(f'{{{{CTA_URL_{idx}}}}}', full_url)
+                                        # Ищем все <a> теги с этим текстом
+                                        # Паттерн: <a href="любая_ссылка">текст_кнопки</a>
+                                        # Поддерживает вариации: с пробелами, переносами строк, атрибутами
+                                        patterns = [
+                                            # Точное совпадение текста кнопки
+                                            (rf'(<a[^>]*href=["\'])([^"\']*?)(["\'][^>]*>)\s*{re.escape(label)}\s*(</a>)', 1, 2, 3, 4),
+                                            # Текст внутри <span>, <strong>, <b> внутри <a>
+                                            (rf'(<a[^>]*href=["\'])([^"\']*?)(["\'][^>]*>)([^<]*<[^>]+>)*\s*{re.escape(label)}\s*([^<]*</[^>]+>)*(</a>)', 1, 2, 3, None, None),
+                                        ]
                                         
-                                        # 2. Умная замена по тексту кнопки
-                                        if cta.get('label'):
-                                            label = cta['label']
-                                            
-                                            # Ищем все <a> теги с этим текстом
-                                            # Паттерн: <a href="любая_ссылка">текст_кнопки</a>
-                                            # Поддерживает вариации: с пробелами, переносами строк, атрибутами
-                                            patterns = [
-                                                # Точное совпадение текста кнопки
-                                                (rf'(<a[^>]*href=["\'])([^"\']*?)(["\'][^>]*>)\s*{re.escape(label)}\s*(</a>)', 1, 2, 3, 4),
-                                                # Текст внутри <span>, <strong>, <b> внутри <a>
-                                                (rf'(<a[^>]*href=["\'])([^"\']*?)(["\'][^>]*>)([^<]*<[^>]+>)*\s*{re.escape(label)}\s*([^<]*</[^>]+>)*(</a>)', 1, 2, 3, None, None),
-                                            ]
+                                        for pattern_tuple in patterns:
+                                            pattern = pattern_tuple[0]
+                                            matches = re.finditer(pattern, final_html, re.IGNORECASE | re.DOTALL)
                                             
-                                            for pattern_tuple in patterns:
-                                                pattern = pattern_tuple[0]
-                                                matches = re.finditer(pattern, final_html, re.IGNORECASE | re.DOTALL)
+                                            for match in matches:
+                                                old_href = match.group(2)
+                                                # Пропускаем, если это уже наша ссылка или плейсхолдер
+                                                if old_href.startswith('http') and 'utm_source=' in old_href:
+                                                    continue
+                                                if '{{CTA_URL' in old_href:
+                                                    continue
                                                 
-                                                for match in matches:
-                                                    old_href = match.group(2)
-                                                    # Пропускаем, если это уже наша ссылка или плейсхолдер
-                                                    if old_href.startswith('http') and 'utm_source=' in old_href:
-                                                        continue
-                                                    if '{{CTA_URL' in old_href:
-                                                        continue
-                                                    
-                                                    # Заменяем старую ссылку на новую с UTM
-                                                    old_tag = match.group(0)
-                                                    new_tag = old_tag.replace(old_href, full_url, 1)
-                                                    final_html = final_html.replace(old_tag, new_tag, 1)
-                                                    print(f'[SMART_CTA] Replaced link for button "{label}" -> {base_url}')
-                                        
-                                        print(f'[UTM] Processed CTA_{idx}: {cta.get("label", "")} -> {base_url}')
-                                
-                                # Также заменяем {{CTA_URL}} на первую ссылку для обратной совместимости
-                                if cta_urls_list and cta_urls_list[0].get('url'):
-                                    base_url = cta_urls_list[0]['url']
-                                    separator = '&' if '?' in base_url else '?'
-                                    full_url = f"{base_url}{separator}{'&'.join(utm_params)}"
-                                    final_html = final_html.replace('{{CTA_URL}}', full_url)
+                                                # Заменяем старую ссылку на новую с UTM
+                                                old_tag = match.group(0)
+                                                new_tag = old_tag.replace(old_href, full_url, 1)
+                                                final_html = final_html.replace(old_tag, new_tag, 1)
+                                                print(f'[SMART_CTA] Replaced link for button "{label}" -> {base_url}')
+                                    
+                                    print(f'[UTM] Processed CTA_{idx}: {cta.get("label", "")} -> {base_url}')
                             
-                            # Fallback на базовую CTA ссылку из настроек события
-                            elif evt.get('cta_base_url'):
-                                base_url = evt.get('cta_base_url')
+                            # Также заменяем {{CTA_URL}} на первую ссылку для обратной совместимости
+                            if cta_urls_list and cta_urls_list[0].get('url'):
+                                base_url = cta_urls_list[0]['url']
                                 separator = '&' if '?' in base_url else '?'
                                 full_url = f"{base_url}{separator}{'&'.join(utm_params)}"
                                 final_html = final_html.replace('{{CTA_URL}}', full_url)
-                                print(f'[UTM] Used fallback cta_base_url from event settings')
-                            
-                            cur.execute('''
-                                INSERT INTO t_p22819116_event_schedule_app.generated_emails (
-                                    event_list_id,
-                                    content_type_id,
-                                    subject,
-                                    html_content,
-                                    status
-                                ) VALUES (%s, %s, %s, %s, %s)
-                            ''', (
+                        
+                        # Fallback на базовую CTA ссылку из настроек события
+                        elif evt.get('cta_base_url'):
+                            base_url = evt.get('cta_base_url')
+                            separator = '&' if '?' in base_url else '?'
+                            full_url = f"{base_url}{separator}{'&'.join(utm_params)}"
+                            final_html = final_html.replace('{{CTA_URL}}', full_url)
+                            print(f'[UTM] Used fallback cta_base_url from event settings')
+                        
+                        cur.execute('''
+                            INSERT INTO t_p22819116_event_schedule_app.generated_emails (
                                 event_list_id,
                                 content_type_id,
-                                final_subject,
-                                final_html,
-                                'draft'
-                            ))
-                            generated_count += 1
-                            
-                    except urllib.error.HTTPError as e:
-                        error_body = e.read().decode('utf-8') if hasattr(e, 'read') else str(e)
-                        print(f'[ERROR] API HTTP Error for "{title}": {e.code} - {error_body[:500]}')
-                        continue
-                    except urllib.error.URLError as e:
-                        print(f'[ERROR] API timeout/network error for "{title}": {str(e)}')
-                        continue
-                    except Exception as e:
-                        print(f'[ERROR] AI generation failed for "{title}": {type(e).__name__} - {str(e)[:500]}')
-                        continue
+                                subject,
+                                html_content,
+                                status
+                            ) VALUES (%s, %s, %s, %s, %s)
+                        ''', (
+                            event_list_id,
+                            content_type_id,
+                            final_subject,
+                            final_html,
+                            'draft'
+                        ))
+                        generated_count += 1
+                        job['result'].update({'status': 'generated', 'subject': final_subject})
                 
                 conn.commit()
-                print(f'[CONTENT_PLAN] Generated {generated_count} emails, skipped {skipped_count} duplicates')
+                print(f'[CONTENT_PLAN] Generated {generated_count} emails, skipped {skipped_count} duplicates, {deadline_count} not started before the deadline')
                 
                 return {
                     'statusCode': 200,
@@ -1359,7 +1466,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({
                         'generated_count': generated_count,
                         'skipped_count': skipped_count,
+                        'deadline_count': deadline_count,
+                        'results': row_results,
                         'message': f'Создано {generated_count} писем' + (f', пропущено дублей: {skipped_count}' if skipped_count > 0 else '')
+                            + (f', не успели сгенерировать: {deadline_count}' if deadline_count > 0 else '')
                     })
                 }
             
@@ -1368,6 +1478,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 event_list_id = body_data.get('event_list_id')
                 title = body_data.get('title', '')
                 content_type_name = body_data.get('content_type', '')
+                force_fresh = bool(body_data.get('force_fresh', False))
+                # stream: partial subject/HTML are published for GET ?action=generation_progress&stream_id=...
+                stream = bool(body_data.get('stream', False))
+                stream_id = str(body_data.get('stream_id') or uuid.uuid4().hex) if stream else None
                 
                 if not event_id or not event_list_id or not title or not content_type_name:
                     return {
@@ -1504,6 +1618,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     knowledge_by_type[item_type].append(item['content'])
                 
                 # Если есть manual_variables, используем их для заполнения
+                prompt_context = pack_prompt_context(ai_model, title, program=program_text, pain=pain_text)
+                
                 if manual_variables and isinstance(manual_variables, list) and len(manual_variables) > 0:
                     print(f'[MANUAL_VARS] Found {len(manual_variables)} variables')
                     
@@ -1526,10 +1642,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 {json.dumps(knowledge_by_type, ensure_ascii=False, indent=2)[:5000]}
 
 Программа мероприятия:
-{program_text[:3000]}
+{prompt_context['program']}
 
 Боли аудитории:
-{pain_text[:2000]}
+{prompt_context['pain']}
 
 Дата мероприятия: {event_date if event_date else 'не указана'}
 Место: {event_venue if event_venue else 'не указано'}
@@ -1548,20 +1664,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         }
                         
                         try:
-                            var_req = urllib.request.Request(
-                                api_url,
-                                data=json.dumps(var_payload).encode('utf-8'),
-                                headers={
-                                    'Content-Type': 'application/json',
-                                    'Authorization': f'Bearer {api_key}'
-                                }
-                            )
-                            
-                            with urllib.request.urlopen(var_req, timeout=30) as var_response:
-                                var_result = json.loads(var_response.read().decode('utf-8'))
-                                var_content = var_result['choices'][0]['message']['content'].strip()
-                                filled_variables[var_name] = var_content
-                                print(f'[VAR] Filled {var_name}: {var_content[:100]}...')
+                            var_result = cached_chat_completion(conn, api_url, api_key, var_payload, timeout=30, force_fresh=force_fresh)
+                            var_content = var_result['choices'][0]['message']['content'].strip()
+                            filled_variables[var_name] = var_content
+                            print(f'[VAR] Filled {var_name}: {var_content[:100]}...')
                         except Exception as var_err:
                             print(f'[VAR_ERROR] Failed to fill {var_name}: {var_err}')
                             filled_variables[var_name] = var.get('content', '[ПУСТО]')
@@ -1633,10 +1739,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 Инструкции для генерации: {instructions}{date_info}
 
 Программа мероприятия:
-{program_text[:3000]}
+{prompt_context['program']}
 
 Боли целевой аудитории:
-{pain_text[:2000]}
+{prompt_context['pain']}
 
 Шаблон HTML:
 {html_template[:1000]}{logo_instruction}
@@ -1660,84 +1766,70 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'max_tokens': 4000
                     }
                 
+                progress = open_progress(stream_id) if stream else None
+                
                 try:
-                    req = urllib.request.Request(
-                        api_url,
-                        data=json.dumps(request_payload).encode('utf-8'),
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': f'Bearer {api_key}'
-                        }
+                    result = cached_chat_completion(
+                        conn, api_url, api_key, request_payload, timeout=60, force_fresh=force_fresh, on_text=progress,
+                        validate=lambda response: parse_email_json(response_text(response))
                     )
+                    email_data = parse_email_json(response_text(result))
                     
-                    with urllib.request.urlopen(req, timeout=60) as response:
-                        result = json.loads(response.read().decode('utf-8'))
-                        content = result['choices'][0]['message']['content']
-                        
-                        content = content.strip()
-                        if content.startswith('```json'):
-                            content = content[7:]
-                        if content.startswith('```'):
-                            content = content[3:]
-                        if content.endswith('```'):
-                            content = content[:-3]
-                        content = content.strip()
-                        
-                        try:
-                            email_data = json.loads(content)
-                        except json.JSONDecodeError as json_err:
-                            import re
-                            fixed_content = re.sub(r'\\(?![ntr"\\])', '', content)
-                            email_data = json.loads(fixed_content)
-                        
-                        final_subject = email_data.get('subject', title)
-                        final_html = email_data.get('html', '')
-                        marketing_score = email_data.get('marketing_score', None)
-                        notes = email_data.get('notes', '')
-                        
-                        # Логируем маркетинговую оценку
-                        if marketing_score:
-                            print(f'[MARKETING] Score: {marketing_score}/10, Notes: {notes}')
-                        
-                        cur.execute('''
-                            INSERT INTO t_p22819116_event_schedule_app.generated_emails (
-                                event_list_id,
-                                content_type_id,
-                                subject,
-                                html_content,
-                                status
-                            ) VALUES (%s, %s, %s, %s, %s)
-                            RETURNING id
-                        ''', (
+                    final_subject = email_data.get('subject', title)
+                    final_html = email_data.get('html', '')
+                    marketing_score = email_data.get('marketing_score', None)
+                    notes = email_data.get('notes', '')
+                    
+                    # Логируем маркетинговую оценку
+                    if marketing_score:
+                        print(f'[MARKETING] Score: {marketing_score}/10, Notes: {notes}')
+                    
+                    cur.execute('''
+                        INSERT INTO t_p22819116_event_schedule_app.generated_emails (
                             event_list_id,
                             content_type_id,
-                            final_subject,
-                            final_html,
-                            'draft'
-                        ))
-                        
-                        email_id = cur.fetchone()['id']
-                        conn.commit()
-                        
-                        response_body = {
-                            'success': True, 
-                            'email_id': email_id, 
-                            'subject': final_subject
-                        }
-                        
-                        if marketing_score:
-                            response_body['marketing_score'] = marketing_score
-                            response_body['marketing_notes'] = notes
-                        
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps(response_body)
-                        }
+                            subject,
+                            html_content,
+                            status
+                        ) VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
+                    ''', (
+                        event_list_id,
+                        content_type_id,
+                        final_subject,
+                        final_html,
+                        'draft'
+                    ))
+                    
+                    email_id = cur.fetchone()['id']
+                    conn.commit()
+                    
+                    response_body = {
+                        'success': True, 
+                        'email_id': email_id, 
+                        'subject': final_subject
+                    }
+                    
+                    if marketing_score:
+                        response_body['marketing_score'] = marketing_score
+                        response_body['marketing_notes'] = notes
+                    
+                    if progress:
+                        progress.finish('done', email_id=email_id, subject=final_subject)
+                    if stream:
+                        response_body['stream_id'] = stream_id
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps(response_body)
+                    }
                 
                 except Exception as e:
                     conn.rollback()
                     print(f'[ERROR] Single email generation failed: {type(e).__name__} - {str(e)[:500]}')
+                    if progress:
+                        progress.finish('failed', error=str(e)[:500])
                     return {
                         'statusCode': 500,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -1884,6 +1976,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'generate_drafts':
                 list_id = body_data.get('list_id')
+                force_fresh = bool(body_data.get('force_fresh', False))
                 
                 if not list_id:
                     return {
@@ -1967,6 +2060,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
                 tone_desc = tone_descriptions.get(default_tone, default_tone)
                 
+                context_packer = ContextPacker(ai_model, program=program_text, pain=pain_points_text, examples=email_template_examples)
                 created_count = 0
                 
                 for content_type_id in content_type_ids:
@@ -1996,6 +2090,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         if event_venue:
                             date_info += f'\nМесто: {event_venue}'
                     
+                    prompt_context = context_packer.pack(f'{content_type_name} {instructions}')
+                    
                     prompt = f"""Ты - эксперт по email-маркетингу. Твоя задача - создать эффективное письмо для рассылки.
 
 КОНТЕКСТ МЕРОПРИЯТИЯ:
@@ -2003,17 +2099,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 Тон общения: {tone_desc}
 
 ПРОГРАММА МЕРОПРИЯТИЯ:
-{program_text[:3000]}
+{prompt_context['program']}
 
 БОЛИ ЦЕЛЕВОЙ АУДИТОРИИ:
-{pain_points_text[:2000]}
+{prompt_context['pain']}
 
 ЗАДАНИЕ НА ПИСЬМО:
 Тип контента: {content_type_name}
 Инструкции: {instructions}
 
 ПРИМЕРЫ СТИЛЯ ПИСЕМ (если есть):
-{email_template_examples[:1000] if email_template_examples else 'Используй профессиональный стиль email-маркетинга'}
+{prompt_context['examples'] or 'Используй профессиональный стиль email-маркетинга'}
 
 ТРЕБОВАНИЯ:
 1. Изучи программу мероприятия и выбери темы, максимально соответствующие типу письма "{content_type_name}"
@@ -2053,51 +2149,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'max_tokens': 4000
                         }
                         
-                        req = urllib.request.Request(
-                            api_url,
-                            data=json.dumps(request_payload).encode('utf-8'),
-                            headers={
-                                'Content-Type': 'application/json',
-                                'Authorization': f'Bearer {api_key}'
-                            }
+                        result = cached_chat_completion(
+                            conn, api_url, api_key, request_payload, timeout=60, force_fresh=force_fresh,
+                            validate=lambda response: parse_email_json(response_text(response))
                         )
+                        email_data = parse_email_json(response_text(result))
                         
-                        with urllib.request.urlopen(req, timeout=60) as response:
-                            result = json.loads(response.read().decode('utf-8'))
-                            content = result['choices'][0]['message']['content']
-                            
-                            content = content.strip()
-                            if content.startswith('```json'):
-                                content = content[7:]
-                            if content.startswith('```'):
-                                content = content[3:]
-                            if content.endswith('```'):
-                                content = content[:-3]
-                            content = content.strip()
-                            
-                            try:
-                                email_data = json.loads(content)
-                            except json.JSONDecodeError:
-                                import re
-                                fixed_content = re.sub(r'\\(?![ntr"\\])', '', content)
-                                email_data = json.loads(fixed_content)
-                            
-                            generated_subject = email_data.get('subject', f'Письмо: {content_type_name}')
-                            generated_html = email_data.get('html', '<p>Ошибка генерации</p>')
-                            
-                            cur.execute('''
-                                INSERT INTO t_p22819116_event_schedule_app.generated_emails 
-                                (event_list_id, content_type_id, subject, html_body, status)
-                                VALUES (%s, %s, %s, %s, %s)
-                            ''', (
-                                list_id,
-                                content_type_id,
-                                generated_subject,
-                                generated_html,
-                                'draft'
-                            ))
-                            created_count += 1
-                            print(f'[SUCCESS] Generated email for {content_type_name}')
+                        generated_subject = email_data.get('subject', f'Письмо: {content_type_name}')
+                        generated_html = email_data.get('html', '<p>Ошибка генерации</p>')
+                        
+                        cur.execute('''
+                            INSERT INTO t_p22819116_event_schedule_app.generated_emails 
+                            (event_list_id, content_type_id, subject, html_body, status)
+                            VALUES (%s, %s, %s, %s, %s)
+                        ''', (
+                            list_id,
+                            content_type_id,
+                            generated_subject,
+                            generated_html,
+                            'draft'
+                        ))
+                        created_count += 1
+                        print(f'[SUCCESS] Generated email for {content_type_name}')
                     
                     except Exception as gen_error:
                         print(f'[ERROR] Failed to generate for {content_type_name}: {gen_error}')
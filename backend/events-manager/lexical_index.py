@@ -0,0 +1,158 @@
+'''
+Lexical retrieval for knowledge_store: tokenizer with light stemming, BM25 index, rank fusion
+'''
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = {
+    'и', 'в', 'во', 'не', 'на', 'с', 'со', 'по', 'к', 'ко', 'о', 'об', 'от', 'до', 'за', 'из', 'у', 'же',
+    'для', 'как', 'что', 'это', 'или', 'но', 'а', 'то', 'бы', 'ли', 'при', 'так', 'мы', 'вы', 'он', 'она',
+    'the', 'a', 'an', 'and', 'or', 'of', 'in', 'on', 'to', 'for', 'with', 'by', 'at', 'is', 'are'
+}
+
+RU_SUFFIXES = (
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ость', 'ости',
+    'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ую', 'юю', 'ов', 'ев',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ей', 'ия', 'ию', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'
+)
+
+EN_SUFFIXES = ('ing', 'ed', 'es', 's')
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+def stem(token: str) -> str:
+    '''
+    Light suffix stripping so that "аналитика/аналитики/аналитикой" share a stem
+    '''
+    
+    suffixes = EN_SUFFIXES if token.isascii() else RU_SUFFIXES
+    
+    for suffix in suffixes:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    
+    return token
+
+def tokenize(text: str) -> List[str]:
+    '''
+    Lowercase, split on word characters, drop stopwords/1-char tokens, stem
+    '''
+    
+    tokens = TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+    
+    return [stem(token) for token in tokens if len(token) > 1 and token not in STOPWORDS]
+
+class BM25Index:
+    '''
+    Okapi BM25 over a list of short documents (program rows, pain points)
+    '''
+    
+    def __init__(self, documents: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        
+        doc_tokens = [tokenize(doc) for doc in documents]
+        self.doc_lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if self.size and self.doc_lengths.sum() > 0 else 1.0
+        
+        postings = {}
+        for doc_idx, tokens in enumerate(doc_tokens):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_idx, tf))
+        
+        self.postings = {}
+        for token, entries in postings.items():
+            docs = np.array([doc for doc, _ in entries], dtype=np.int64)
+            tfs = np.array([tf for _, tf in entries], dtype=np.float32)
+            idf = np.log(1.0 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[token] = (docs, tfs, float(idf))
+    
+    def scores(self, query: str) -> np.ndarray:
+        '''
+        BM25 score of every document for the query
+        '''
+        
+        scores = np.zeros(self.size, dtype=np.float32)
+        
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            
+            docs, tfs, idf = posting
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        
+        return scores
+    
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Top-k documents with a positive BM25 score
+        
+        Returns:
+            (document indices sorted by score desc, their scores)
+        '''
+        
+        scores = self.scores(query)
+        matched = np.nonzero(scores > 0)[0]
+        
+        if matched.shape[0] == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        k = min(top_k, matched.shape[0])
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]] if k < matched.shape[0] else matched
+        best = best[np.argsort(-scores[best], kind='stable')]
+        
+        return best, scores[best]
+
+def rrf_fuse(rankings: List[np.ndarray], top_k: int, k: int = RRF_K) -> List[Tuple[int, float]]:
+    '''
+    Reciprocal rank fusion of several rankings (arrays of document indices, best first)
+    
+    Returns:
+        [(document index, fused score)] sorted by fused score desc
+    '''
+    
+    fused = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking.tolist()):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank + 1)
+    
+    return sorted(fused.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+
+LEXICAL_CACHE = OrderedDict()
+LEXICAL_CACHE_LOCK = threading.Lock()
+LEXICAL_CACHE_MAX_ENTRIES = 64
+
+def get_lexical_index(key: Tuple[int, str, int], items: List[Dict[str, Any]]) -> BM25Index:
+    '''
+    BM25 index for (event_id, item_type, index_version), built once per warm container
+    '''
+    
+    with LEXICAL_CACHE_LOCK:
+        index = LEXICAL_CACHE.get(key)
+        if index is not None:
+            LEXICAL_CACHE.move_to_end(key)
+            return index
+    
+    index = BM25Index([item['content'] or '' for item in items])
+    
+    with LEXICAL_CACHE_LOCK:
+        LEXICAL_CACHE[key] = index
+        while len(LEXICAL_CACHE) > LEXICAL_CACHE_MAX_ENTRIES:
+            LEXICAL_CACHE.popitem(last=False)
+    
+    return index
@@ -0,0 +1,253 @@
+'''
+Content-addressed cache of chat completion responses: the key is a hash of the
+canonical request (provider, model, messages, sampling params), so regenerating
+the same draft is served from a warm-container LRU or from llm_response_cache
+in Postgres instead of another LLM round trip. Only responses the caller's
+validate() accepts are stored, so a broken draft is never replayed.
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from llm_client import chat_completion, provider_for_url, stream_chat_completion
+
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+LLM_CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', '256'))
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'on') != 'off'
+
+class ResponseCache:
+    '''
+    LRU of responses keyed by request hash; entries carry their creation time
+    (wall clock) so rows loaded from Postgres keep their original TTL
+    '''
+    
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            
+            if entry is None or time.time() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    del self.entries[key]
+                return None
+            
+            self.entries.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key: str, response: Dict[str, Any], created_at: Optional[float] = None):
+        with self.lock:
+            self.entries[key] = (response, time.time() if created_at is None else created_at)
+            self.entries.move_to_end(key)
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def discard(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def count(self, outcome: str):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.hits + self.db_hits + self.misses
+            return {
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'rejected': self.rejected,
+                'hit_rate': (self.hits + self.db_hits) / total if total else 0.0,
+                'size': len(self.entries),
+                'ttl_seconds': self.ttl_seconds
+            }
+
+LLM_RESPONSE_CACHE = ResponseCache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+
+CACHE_TABLE_STATE = {}
+
+def cache_table_available(conn) -> bool:
+    '''
+    Whether llm_response_cache (V0035) exists; checked once per warm container
+    '''
+    
+    if 'available' not in CACHE_TABLE_STATE:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = 't_p22819116_event_schedule_app' AND table_name = 'llm_response_cache'
+        ''')
+        CACHE_TABLE_STATE['available'] = cur.fetchone() is not None
+    
+    return CACHE_TABLE_STATE['available']
+
+def request_hash(api_url: str, payload: Dict[str, Any]) -> str:
+    '''
+    sha256 of the canonical request: provider + payload with sorted keys and compact separators
+    '''
+    
+    canonical = json.dumps(
+        {'provider': provider_for_url(api_url), 'payload': payload},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_cached_response(conn, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT response, EXTRACT(EPOCH FROM (NOW() - created_at))
+        FROM t_p22819116_event_schedule_app.llm_response_cache
+        WHERE request_hash = %s AND created_at > NOW() - make_interval(secs => %s)
+    ''', (key, LLM_CACHE_TTL))
+    row = cur.fetchone()
+    
+    if row is None:
+        return None
+    
+    response, age = row
+    return response, time.time() - float(age)
+
+def store_cached_response(conn, key: str, model: str, response: Dict[str, Any]):
+    '''
+    Upsert the row and drop expired ones; committed together with the caller's transaction
+    '''
+    
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO t_p22819116_event_schedule_app.llm_response_cache (request_hash, model, response)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (request_hash) DO UPDATE
+        SET model = EXCLUDED.model, response = EXCLUDED.response, created_at = CURRENT_TIMESTAMP
+    ''', (key, model, json.dumps(response, ensure_ascii=False)))
+    cur.execute('''
+        DELETE FROM t_p22819116_event_schedule_app.llm_response_cache
+        WHERE created_at < NOW() - make_interval(secs => %s)
+    ''', (LLM_CACHE_TTL,))
+
+def drop_cached_response(conn, key: str):
+    cur = conn.cursor()
+    cur.execute(
+        'DELETE FROM t_p22819116_event_schedule_app.llm_response_cache WHERE request_hash = %s',
+        (key,)
+    )
+
+def has_content(response: Dict[str, Any]) -> bool:
+    '''
+    Minimal check applied to every response: a non-empty completion text
+    '''
+    
+    try:
+        content = response['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return False
+    
+    return isinstance(content, str) and bool(content.strip())
+
+def accepted(response: Dict[str, Any], validate: Optional[Callable[[Dict[str, Any]], Any]]) -> bool:
+    '''
+    has_content() and validate(response) is truthy; an exception in validate counts as a rejection
+    '''
+    
+    if not has_content(response):
+        return False
+    
+    if validate is None:
+        return True
+    
+    try:
+        return bool(validate(response))
+    except Exception as e:
+        print(f'[LLM_CACHE] validate rejected the response: {type(e).__name__} - {str(e)[:200]}')
+        return False
+
+def complete(api_url: str, api_key: str, payload: Dict[str, Any], timeout: float, on_text: Optional[Callable[[str], None]]) -> Dict[str, Any]:
+    if on_text is None:
+        return chat_completion(api_url, api_key, payload, timeout=timeout)
+    return stream_chat_completion(api_url, api_key, payload, on_text, timeout=timeout)
+
+def report_cached(response: Dict[str, Any], on_text: Optional[Callable[[str], None]]):
+    if on_text is not None:
+        on_text(response['choices'][0]['message']['content'])
+
+def cached_chat_completion(
+    conn,
+    api_url: str,
+    api_key: str,
+    payload: Dict[str, Any],
+    timeout: float = 60,
+    force_fresh: bool = False,
+    on_text: Optional[Callable[[str], None]] = None,
+    validate: Optional[Callable[[Dict[str, Any]], Any]] = None
+) -> Dict[str, Any]:
+    '''
+    chat_completion() behind the response cache
+    
+    Args:
+        conn: psycopg2 connection for the Postgres tier, or None for the in-process LRU only
+        force_fresh: skip the lookup and call the model; the fresh response replaces the cached one
+        on_text: stream the completion and report the text so far (a cache hit reports it once)
+        validate: the caller's check that the response is usable (e.g. its JSON parses);
+                  a fresh response is stored only when it returns a truthy value, and a
+                  cached entry it rejects is dropped and requested again. Empty completions
+                  are never stored.
+    
+    Returns:
+        Decoded JSON response, as chat_completion(); a rejected fresh response is
+        still returned so the caller can report or repair it
+    '''
+    
+    if not LLM_CACHE_ENABLED:
+        return complete(api_url, api_key, payload, timeout, on_text)
+    
+    key = request_hash(api_url, payload)
+    use_db = conn is not None and cache_table_available(conn)
+    
+    if not force_fresh:
+        response = LLM_RESPONSE_CACHE.get(key)
+        if response is not None and accepted(response, validate):
+            LLM_RESPONSE_CACHE.count('hits')
+            print(f'[LLM_CACHE] hit {key[:12]} (memory)')
+            report_cached(response, on_text)
+            return response
+        
+        cached = load_cached_response(conn, key) if use_db and response is None else None
+        if cached is not None and accepted(cached[0], validate):
+            LLM_RESPONSE_CACHE.put(key, cached[0], cached[1])
+            LLM_RESPONSE_CACHE.count('db_hits')
+            print(f'[LLM_CACHE] hit {key[:12]} (postgres)')
+            report_cached(cached[0], on_text)
+            return cached[0]
+        
+        if response is not None or cached is not None:
+            print(f'[LLM_CACHE] dropping rejected entry {key[:12]}')
+            LLM_RESPONSE_CACHE.discard(key)
+            if use_db:
+                drop_cached_response(conn, key)
+    
+    LLM_RESPONSE_CACHE.count('misses')
+    response = complete(api_url, api_key, payload, timeout, on_text)
+    
+    if not accepted(response, validate):
+        LLM_RESPONSE_CACHE.count('rejected')
+        return response
+    
+    LLM_RESPONSE_CACHE.put(key, response)
+    if use_db:
+        store_cached_response(conn, key, payload.get('model', ''), response)
+    
+    return response
@@ -0,0 +1,343 @@
+'''
+Chat completion calls with provider-aware rate limiting and retries:
+token buckets per (provider, model) for requests/min and tokens/min, jittered
+exponential backoff that honours Retry-After, and an invocation deadline that
+no wait or retry may run past
+'''
+
+import os
+import json
+import time
+import random
+import threading
+import urllib.error
+import urllib.parse
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import http_pool
+
+LLM_DEFAULT_RPM = float(os.environ.get('LLM_DEFAULT_RPM', '60'))
+LLM_DEFAULT_TPM = float(os.environ.get('LLM_DEFAULT_TPM', '200000'))
+# {"openrouter:openai/gpt-4o-mini": {"rpm": 500, "tpm": 400000}, "openai": {"rpm": 100}}
+LLM_RATE_LIMITS = json.loads(os.environ.get('LLM_RATE_LIMITS', '{}'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '4'))
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', '1.0'))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', '20'))
+FUNCTION_TIME_BUDGET = float(os.environ.get('FUNCTION_TIME_BUDGET', '120'))  # function.yaml timeout
+DEADLINE_MARGIN_SECONDS = 5.0  # left for DB writes and the response after the last LLM call
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class DeadlineExceeded(Exception):
+    '''
+    Waiting for the rate limit or a retry would run past the invocation deadline
+    '''
+
+class TokenBucket:
+    '''
+    Refills at per_minute / 60 per second up to capacity (one minute of budget).
+    take() may go negative: the debt delays the next callers.
+    '''
+    
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+    
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+    
+    def take(self, amount: float):
+        self.tokens -= amount
+    
+    def block(self, seconds: float, now: float):
+        '''
+        Empty the bucket so that it stays empty for `seconds` (after a 429)
+        '''
+        
+        self.refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class RateLimiter:
+    '''
+    Request and token buckets per (provider, model), shared by all threads of a warm container
+    '''
+    
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    def limits(self, provider: str, model: str) -> Dict[str, float]:
+        configured = LLM_RATE_LIMITS.get(f'{provider}:{model}') or LLM_RATE_LIMITS.get(provider) or {}
+        return {
+            'rpm': float(configured.get('rpm', LLM_DEFAULT_RPM)),
+            'tpm': float(configured.get('tpm', LLM_DEFAULT_TPM))
+        }
+    
+    def get_buckets(self, provider: str, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        key = (provider, model)
+        if key not in self.buckets:
+            limits = self.limits(provider, model)
+            self.buckets[key] = (TokenBucket(limits['rpm']), TokenBucket(limits['tpm']))
+        return self.buckets[key]
+    
+    def acquire(self, provider: str, model: str, tokens: int, deadline: Optional[float] = None):
+        '''
+        Block until one request and `tokens` tokens are available.
+        Raises DeadlineExceeded instead of waiting past the deadline.
+        '''
+        
+        while True:
+            with self.lock:
+                requests_bucket, tokens_bucket = self.get_buckets(provider, model)
+                now = time.monotonic()
+                wait = max(requests_bucket.wait_time(1, now), tokens_bucket.wait_time(tokens, now))
+                
+                if wait <= 0:
+                    requests_bucket.take(1)
+                    tokens_bucket.take(tokens)
+                    return
+            
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded(f'{provider}/{model} rate limit needs {wait:.1f}s, past the deadline')
+            
+            time.sleep(wait)
+    
+    def settle(self, provider: str, model: str, estimated: int, actual: int):
+        '''
+        Correct the token bucket with the usage reported by the provider
+        '''
+        
+        with self.lock:
+            self.get_buckets(provider, model)[1].take(actual - estimated)
+    
+    def block(self, provider: str, model: str, seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            for bucket in self.get_buckets(provider, model):
+                bucket.block(seconds, now)
+
+LIMITER = RateLimiter()
+
+DEADLINE_STATE = {'deadline': None}
+
+def start_invocation(context: Any = None) -> float:
+    '''
+    Set the deadline of the current invocation (time.monotonic() based) from
+    context.get_remaining_time_in_millis() when the runtime provides it,
+    otherwise from FUNCTION_TIME_BUDGET
+    '''
+    
+    remaining = FUNCTION_TIME_BUDGET
+    
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        try:
+            remaining = context.get_remaining_time_in_millis() / 1000.0
+        except Exception:
+            pass
+    
+    DEADLINE_STATE['deadline'] = time.monotonic() + remaining - DEADLINE_MARGIN_SECONDS
+    return DEADLINE_STATE['deadline']
+
+def current_deadline() -> Optional[float]:
+    return DEADLINE_STATE['deadline']
+
+def provider_for_url(api_url: str) -> str:
+    host = urllib.parse.urlsplit(api_url).hostname or ''
+    if host.endswith('openrouter.ai'):
+        return 'openrouter'
+    if host.endswith('openai.com'):
+        return 'openai'
+    return host
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    '''
+    Prompt tokens (~3 characters per token for mixed Russian/English) plus the completion budget
+    '''
+    
+    prompt_chars = len(json.dumps(payload.get('messages', []), ensure_ascii=False))
+    return prompt_chars // 3 + int(payload.get('max_tokens') or 1000)
+
+def retry_after_seconds(error: urllib.error.HTTPError) -> Optional[float]:
+    '''
+    Retry-After header as seconds (delta-seconds or HTTP-date), None when absent or malformed
+    '''
+    
+    value = error.headers.get('Retry-After') if error.headers else None
+    if not value:
+        return None
+    
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    '''
+    Full-jitter exponential backoff: uniform(0, min(LLM_BACKOFF_MAX, base * 2^attempt))
+    '''
+    
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def call_with_retries(
+    api_url: str,
+    payload: Dict[str, Any],
+    send: Callable[[float], Dict[str, Any]],
+    timeout: float,
+    deadline: Optional[float]
+) -> Dict[str, Any]:
+    '''
+    Run send(call_timeout) through the rate limiter, retrying 429/5xx and network errors
+    with backoff; no wait or retry may pass the deadline
+    '''
+    
+    provider = provider_for_url(api_url)
+    model = payload.get('model', '')
+    deadline = current_deadline() if deadline is None else deadline
+    estimated = estimate_tokens(payload)
+    
+    attempt = 0
+    while True:
+        LIMITER.acquire(provider, model, estimated, deadline)
+        
+        call_timeout = timeout
+        if deadline is not None:
+            call_timeout = min(timeout, deadline - time.monotonic())
+            if call_timeout <= 0:
+                raise DeadlineExceeded(f'{provider}/{model}: no time left for the call')
+        
+        try:
+            result = send(call_timeout)
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRYABLE_STATUSES or attempt >= LLM_MAX_RETRIES:
+                raise
+            error = e
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if e.code == 429:
+                LIMITER.block(provider, model, delay)
+        except urllib.error.URLError as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            error = e
+            delay = backoff_delay(attempt)
+        else:
+            usage = (result.get('usage') or {}).get('total_tokens')
+            if usage:
+                LIMITER.settle(provider, model, estimated, int(usage))
+            return result
+        
+        if deadline is not None and time.monotonic() + delay > deadline:
+            print(f'[LLM] {provider}/{model}: {error}, no retry: {delay:.1f}s backoff would pass the deadline')
+            raise error
+        
+        attempt += 1
+        print(f'[LLM] {provider}/{model}: {error}, retry {attempt}/{LLM_MAX_RETRIES} in {delay:.1f}s')
+        time.sleep(delay)
+
+def chat_completion(
+    api_url: str,
+    api_key: str,
+    payload: Dict[str, Any],
+    timeout: float = 60,
+    deadline: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    '''
+    POST a chat completion through the rate limiter, retrying 429/5xx and network errors
+    
+    Args:
+        timeout: per-attempt read timeout, shortened to the time left before the deadline
+        deadline: time.monotonic() limit; defaults to the one set by start_invocation()
+    
+    Returns:
+        Decoded JSON response
+    
+    Raises:
+        urllib.error.HTTPError / URLError when retries are exhausted or not allowed,
+        DeadlineExceeded when waiting for the rate limit would pass the deadline
+    '''
+    
+    request_headers = {'Authorization': f'Bearer {api_key}', **(headers or {})}
+    
+    return call_with_retries(
+        api_url, payload,
+        lambda call_timeout: http_pool.post_json(api_url, payload, request_headers, call_timeout),
+        timeout, deadline
+    )
+
+def read_sse_completion(
+    api_url: str,
+    payload: Dict[str, Any],
+    headers: Dict[str, str],
+    timeout: float,
+    on_text: Callable[[str], None]
+) -> Dict[str, Any]:
+    '''
+    Send the request with stream=true and assemble the SSE deltas; on_text gets the whole
+    text received so far after every delta. Returns the same shape as a non-streamed response.
+    '''
+    
+    body = json.dumps({**payload, 'stream': True, 'stream_options': {'include_usage': True}}).encode('utf-8')
+    text = ''
+    usage = None
+    
+    for line in http_pool.stream_lines('POST', api_url, body, {'Content-Type': 'application/json', **headers}, timeout):
+        # Blank separators and ": keep-alive" comments carry no data
+        if not line.startswith('data:'):
+            continue
+        
+        data = line[5:].strip()
+        if data == '[DONE]':
+            continue
+        
+        chunk = json.loads(data)
+        if chunk.get('error'):
+            raise urllib.error.URLError(f'stream error: {chunk["error"]}')
+        
+        usage = chunk.get('usage') or usage
+        for choice in chunk.get('choices') or []:
+            delta = (choice.get('delta') or {}).get('content')
+            if delta:
+                text += delta
+                on_text(text)
+    
+    return {'choices': [{'message': {'role': 'assistant', 'content': text}}], 'usage': usage}
+
+def stream_chat_completion(
+    api_url: str,
+    api_key: str,
+    payload: Dict[str, Any],
+    on_text: Callable[[str], None],
+    timeout: float = 60,
+    deadline: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    '''
+    chat_completion() over the provider's SSE stream. on_text(text_so_far) is called as
+    deltas arrive; after a retried failure it starts again from the beginning of the text.
+    
+    Args:
+        timeout: max seconds without a delta (not for the whole completion)
+    '''
+    
+    request_headers = {'Authorization': f'Bearer {api_key}', 'Accept': 'text/event-stream', **(headers or {})}
+    
+    return call_with_retries(
+        api_url, payload,
+        lambda call_timeout: read_sse_completion(api_url, payload, request_headers, call_timeout, on_text),
+        timeout, deadline
+    )
@@ -0,0 +1,70 @@
+'''
+Incremental reading of an LLM JSON envelope while it is still streaming:
+current values of top-level string fields ("subject", "html") from a prefix
+that is not valid JSON yet
+'''
+
+import re
+from typing import Dict, Iterable, Tuple
+
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+def read_partial_string(text: str, start: int) -> Tuple[str, bool]:
+    '''
+    Decode a JSON string body starting after its opening quote.
+    Returns (value so far, closed); an escape cut off at the end is left out.
+    '''
+    
+    chunks = []
+    i = start
+    length = len(text)
+    
+    while i < length:
+        char = text[i]
+        
+        if char == '"':
+            return ''.join(chunks), True
+        
+        if char != '\\':
+            end = i
+            while end < length and text[end] not in '"\\':
+                end += 1
+            chunks.append(text[i:end])
+            i = end
+            continue
+        
+        if i + 1 >= length:
+            break
+        
+        code = text[i + 1]
+        if code == 'u':
+            digits = text[i + 2:i + 6]
+            if len(digits) < 4:
+                break
+            try:
+                chunks.append(chr(int(digits, 16)))
+            except ValueError:
+                pass
+            i += 6
+            continue
+        
+        # Unknown escapes (\d, \. from models) are kept as the bare character, like the regex cleanup does
+        chunks.append(ESCAPES.get(code, code))
+        i += 2
+    
+    return ''.join(chunks), False
+
+def partial_string_fields(text: str, keys: Iterable[str]) -> Dict[str, Tuple[str, bool]]:
+    '''
+    {key: (value so far, complete)} for each key whose string value has started in `text`;
+    a ```json fence and text before the first "{" are ignored
+    '''
+    
+    fields = {}
+    
+    for key in keys:
+        match = re.search(r'"' + re.escape(key) + r'"\s*:\s*"', text)
+        if match:
+            fields[key] = read_partial_string(text, match.end())
+    
+    return fields
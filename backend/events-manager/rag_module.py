@@ -6,32 +6,200 @@ import os
 import json
 import psycopg2
 import psycopg2.extras
+import threading
+import time
 import urllib.request
-from typing import List, Dict, Any, Tuple
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+
+from ann_index import get_ann_index, in_savepoint
+from dim_reduction import RAG_REDUCED_DIM, RAG_RERANK_FACTOR, get_reduced_index
+from embedding_providers import EmbeddingProvider, get_embedding_provider
+from knowledge_codec import (
+    EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_SIZE, EMBEDDING_CODEC, EMBEDDING_INPUT_MAX_CHARS,
+    SHORT_VECTOR_DIM, VECTOR_COLUMN_DIM, knowledge_column_available, pack_embedding, short_vector_literal,
+    split_embedding_batches, text_hash, vector_literal
+)
+from lexical_index import get_lexical_index, rrf_fuse
+from query_embedding_cache import QUERY_EMBEDDING_CACHE
+
+class EmbeddingMatrixCache:
+    '''
+    Warm-container LRU cache of normalized embedding matrices.
+    Keyed by (event_id, item_type, index_version), bounded by total bytes.
+    '''
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: Tuple[int, str, int]) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+    
+    def put(self, key: Tuple[int, str, int], items: List[Dict[str, Any]], matrix: np.ndarray):
+        size = matrix.nbytes + sum(len(item['content'] or '') for item in items)
+        
+        if size > self.max_bytes:
+            return
+        
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[2]
+            
+            self.entries[key] = (items, matrix, size)
+            self.current_bytes += size
+            
+            while self.current_bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted[2]
+    
+    def invalidate(self, event_id: int, item_type: str = None):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if key[0] == event_id and (item_type is None or key[1] == item_type):
+                    self.current_bytes -= self.entries.pop(key)[2]
+
+MATRIX_CACHE = EmbeddingMatrixCache(int(os.environ.get('RAG_MATRIX_CACHE_MB', '64')) * 1024 * 1024)
+
+RETRIEVAL_MODES = ('vector', 'hybrid', 'lexical')
+# 'hybrid' (BM25 fused with vector ranking) is opt-in
+RAG_RETRIEVAL_MODE = os.environ.get('RAG_RETRIEVAL_MODE', 'vector')
+HYBRID_CANDIDATE_FACTOR = 4
+HYBRID_MIN_CANDIDATES = 20
+MMR_CANDIDATE_FACTOR = 3
+MMR_DEFAULT_LAMBDA = 0.7
+MMR_LAMBDAS = {
+    'program_item': 0.5,
+    'pain_point': 0.7,
+    'style_snippet': 0.8
+}
+# Postgres KNN is opt-in ('auto'); by default search runs in-process on the cached embedding matrix
+RAG_SERVER_KNN = os.environ.get('RAG_SERVER_KNN', 'off')
+RAG_HNSW_EF_SEARCH = int(os.environ.get('RAG_HNSW_EF_SEARCH', '100'))
+KNOWLEDGE_INSERT_PAGE_SIZE = int(os.environ.get('KNOWLEDGE_INSERT_PAGE_SIZE', '200'))
 
 def get_embedding(text: str, api_key: str) -> List[float]:
     '''
-    Get OpenAI text embedding (text-embedding-3-small, 1536 dims)
+    Get OpenAI text embedding (text-embedding-3-small, 1536 dims).
+    Repeated query texts are served from QUERY_EMBEDDING_CACHE.
+    '''
+    return get_query_embeddings([text], api_key)[0]
+
+def get_query_embeddings(texts: List[str], api_key: str) -> List[List[float]]:
+    '''
+    Query embeddings through QUERY_EMBEDDING_CACHE; all misses go out in one batched request
     '''
-    url = 'https://api.openai.com/v1/embeddings'
     
-    payload = {
-        'model': 'text-embedding-3-small',
-        'input': text[:8000]
-    }
+    provider = get_embedding_provider(api_key)
+    keys = [(provider.model, text[:EMBEDDING_INPUT_MAX_CHARS]) for text in texts]
+    embeddings = [QUERY_EMBEDDING_CACHE.get(key) for key in keys]
     
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-    )
+    missing = list(OrderedDict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+    
+    if missing:
+        fresh = dict(zip(missing, get_embeddings([key[1] for key in missing], api_key, provider=provider)))
+        
+        for key, embedding in fresh.items():
+            QUERY_EMBEDDING_CACHE.put(key, embedding)
+        
+        embeddings = [embedding if embedding is not None else fresh[key] for key, embedding in zip(keys, embeddings)]
+    
+    return embeddings
+
+def get_embeddings(
+    texts: List[str],
+    api_key: str,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    provider: EmbeddingProvider = None
+) -> List[List[float]]:
+    '''
+    Batched embeddings: many inputs per provider call (one HTTP request for OpenAI)
+    
+    Args:
+        texts: texts to embed
+        api_key: OpenAI API key (unused by local providers)
+        batch_size: max inputs per request
+        max_tokens: max estimated tokens per request
+        provider: embedding provider, EMBEDDING_PROVIDER by default
     
-    with urllib.request.urlopen(req, timeout=30) as response:
-        result = json.loads(response.read().decode('utf-8'))
-        return result['data'][0]['embedding']
+    Returns:
+        Embeddings in the same order as texts
+    '''
+    
+    provider = provider or get_embedding_provider(api_key)
+    
+    inputs = [text[:EMBEDDING_INPUT_MAX_CHARS] for text in texts]
+    embeddings = [None] * len(inputs)
+    batches = split_embedding_batches(inputs, batch_size, max_tokens)
+    
+    for batch in batches:
+        for i, embedding in zip(batch, provider.embed([inputs[i] for i in batch])):
+            embeddings[i] = embedding
+    
+    if len(inputs) > 1:
+        print(f'[RAG] Embedded {len(inputs)} texts in {len(batches)} {provider.model} calls')
+    
+    return embeddings
+
+def get_embeddings_cached(conn, texts: List[str], api_key: str) -> List[List[float]]:
+    '''
+    Batched embeddings backed by the persistent embedding_cache table.
+    Only texts whose (model, sha256) is not cached are sent to the API.
+    
+    Args:
+        conn: psycopg2 connection
+        texts: texts to embed
+        api_key: OpenAI API key
+    
+    Returns:
+        Embeddings in the same order as texts
+    '''
+    
+    if not texts:
+        return []
+    
+    provider = get_embedding_provider(api_key)
+    hashes = [text_hash(text) for text in texts]
+    
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT text_hash, embedding
+        FROM t_p22819116_event_schedule_app.embedding_cache
+        WHERE model = %s AND text_hash = ANY(%s)
+    ''', (provider.model, list(set(hashes))))
+    
+    cached = {row[0]: row[1] for row in cur.fetchall()}
+    
+    missing = {}
+    for text, h in zip(texts, hashes):
+        if h not in cached and h not in missing:
+            missing[h] = text
+    
+    if missing:
+        missing_hashes = list(missing.keys())
+        fresh = get_embeddings([missing[h] for h in missing_hashes], api_key, provider=provider)
+        
+        for h, embedding in zip(missing_hashes, fresh):
+            cached[h] = embedding
+        
+        psycopg2.extras.execute_values(cur, '''
+            INSERT INTO t_p22819116_event_schedule_app.embedding_cache (model, text_hash, embedding)
+            VALUES %s
+            ON CONFLICT (model, text_hash) DO NOTHING
+        ''', [(provider.model, h, embedding) for h, embedding in zip(missing_hashes, fresh)], page_size=KNOWLEDGE_INSERT_PAGE_SIZE)
+    
+    print(f'[RAG] Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses')
+    
+    return [cached[h] for h in hashes]
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     '''
@@ -69,29 +237,832 @@ def search_knowledge(
         List of knowledge items with metadata and scores
     '''
     
+    return search_knowledge_multi(conn, event_id, [(query, item_type, top_k)], api_key)[0]
+
+def search_knowledge_multi(
+    conn,
+    event_id: int,
+    specs: List[Tuple[str, str, int]],
+    api_key: str = None,
+    mode: str = None,
+    mmr: bool = False,
+    mmr_lambdas: Dict[str, float] = None
+) -> List[List[Dict[str, Any]]]:
+    '''
+    Several searches in one round trip: all queries are embedded in one
+    batched request and all needed item types are loaded with one SQL query
+    
+    Args:
+        conn: psycopg2 connection
+        event_id: event ID
+        specs: list of (query, item_type, top_k)
+        api_key: OpenAI API key for embeddings
+        mode: 'vector', 'hybrid' (BM25 + vector, fused) or 'lexical';
+              defaults to RAG_RETRIEVAL_MODE ('vector'). Without an API key only
+              'lexical' is possible and is used as the fallback.
+              With server_knn_enabled() the vector ranking of 'vector' and
+              'hybrid' is a KNN query in Postgres (BM25 of 'hybrid' runs on
+              the cached row texts); otherwise both run in-process. Specs the
+              server returns no rows for are searched in-process.
+        mmr: rerank top_k * MMR_CANDIDATE_FACTOR candidates with maximal marginal
+             relevance so near-duplicate rows do not fill all slots
+        mmr_lambdas: item_type -> relevance/diversity trade-off, MMR_LAMBDAS by default
+    
+    Returns:
+        One result list per spec, in spec order
+    '''
+    
+    mode = mode or RAG_RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f'Unknown retrieval mode: {mode}')
+    
     if not api_key:
         api_key = os.environ.get('OPENAI_API_KEY')
     
-    if not api_key:
-        print('[RAG] No API key for embeddings, returning empty results')
-        return []
+    provider = get_embedding_provider(api_key)
+    
+    if not api_key and provider.requires_api_key and mode != 'lexical':
+        print('[RAG] No API key for embeddings, falling back to lexical (BM25) search')
+        mode = 'lexical'
+    
+    if mode == 'lexical':
+        query_embeddings = [None] * len(specs)
+    else:
+        query_embeddings = get_query_embeddings([query for query, _, _ in specs], api_key)
     
-    query_embedding = get_embedding(query, api_key)
+    # embedding is vector(1536): other models are stored packed only and searched in-process
+    server_knn = mode != 'lexical' and server_knn_enabled(conn) and all(len(e) == VECTOR_COLUMN_DIM for e in query_embeddings)
+    
+    results = [[] for _ in specs]
+    pending = list(range(len(specs)))
+    
+    if server_knn:
+        try:
+            results = in_savepoint(conn, 'rag_server_knn', lambda cur: search_knowledge_server(
+                conn, event_id, specs, query_embeddings, provider.model, mode, mmr, mmr_lambdas
+            ))
+        except psycopg2.Error as e:
+            print(f'[RAG] Server KNN failed, using in-process search from now on: {e}')
+            SERVER_KNN_STATE['available'] = False
+            results = [[] for _ in specs]
+        
+        # Only the specs that came back empty (e.g. style_snippet, which index-knowledge never indexes) fall back
+        pending = [i for i, result in enumerate(results) if not result]
+        if not pending:
+            return results
+        print(f'[RAG] Server KNN returned no {", ".join(OrderedDict.fromkeys(specs[i][1] for i in pending))} rows for event {event_id}, using in-process search for them')
+    
+    item_types = list(OrderedDict.fromkeys(specs[i][1] for i in pending))
+    versions = get_index_versions(conn, event_id, item_types)
+    matrices = get_embedding_matrices(conn, event_id, versions, provider.model)
+    
+    for i in pending:
+        (query, item_type, top_k), query_embedding = specs[i], query_embeddings[i]
+        items, matrix = matrices[item_type]
+        
+        if not items:
+            print(f'[RAG] No {item_type} embeddings found for event {event_id}')
+            continue
+        
+        key = (event_id, item_type, versions[item_type])
+        depth = top_k * MMR_CANDIDATE_FACTOR if mmr else top_k
+        
+        if mode == 'lexical':
+            candidates = score_items_lexical(query, items, get_lexical_index(key, items), item_type, depth)
+        else:
+            ann_index = get_ann_index(conn, event_id, item_type, versions[item_type], items, matrix)
+            if ann_index is None:
+                ann_index = get_reduced_index(key, matrix)
+            
+            if mode == 'vector':
+                candidates = score_items_vectorized(query_embedding, items, matrix, item_type, depth, ann_index)
+            else:
+                candidates = score_items_hybrid(
+                    query, query_embedding, items, matrix, get_lexical_index(key, items), item_type, depth, ann_index
+                )
+        
+        if mmr:
+            lambdas = mmr_lambdas or MMR_LAMBDAS
+            candidates = mmr_rerank(candidates, items, matrix, top_k, lambdas.get(item_type, MMR_DEFAULT_LAMBDA))
+        
+        results[i] = candidates
+    
+    return results
+
+def short_vector_enabled(conn) -> bool:
+    '''
+    Server-side first stage on embedding_vec_short (V0034) when RAG_REDUCED_DIM matches it
+    '''
+    return RAG_REDUCED_DIM == SHORT_VECTOR_DIM and knowledge_column_available(conn.cursor(), 'embedding_vec_short')
+
+SERVER_KNN_STATE = {}
+
+def server_knn_enabled(conn) -> bool:
+    '''
+    RAG_SERVER_KNN: 'off' (default) keeps search in-process, 'auto' opts into Postgres KNN
+    on knowledge_store.embedding (pgvector, HNSW index since V0033) when the vector
+    extension is installed and embedding is a vector column. Probed once per warm
+    container; a failed probe or KNN query marks server KNN unavailable.
+    '''
+    
+    if RAG_SERVER_KNN == 'off':
+        return False
+    
+    if 'available' not in SERVER_KNN_STATE:
+        def probe(cur):
+            cur.execute('''
+                SELECT e.extversion
+                FROM pg_extension e
+                JOIN information_schema.columns c
+                  ON c.table_schema = 't_p22819116_event_schedule_app' AND c.table_name = 'knowledge_store'
+                 AND c.column_name = 'embedding' AND c.udt_name = 'vector'
+                WHERE e.extname = 'vector'
+            ''')
+            return cur.fetchone()
+        
+        try:
+            row = in_savepoint(conn, 'rag_server_knn_probe', probe)
+        except psycopg2.Error as e:
+            print(f'[RAG] pgvector probe failed: {e}')
+            row = None
+        
+        SERVER_KNN_STATE['available'] = row is not None
+        SERVER_KNN_STATE['iterative_scan'] = row is not None and pgvector_version(row[0]) >= (0, 8)
+        print(f'[RAG] Server KNN {"available, pgvector " + row[0] if row else "unavailable"}')
+    
+    return SERVER_KNN_STATE['available']
+
+def pgvector_version(extversion: str) -> Tuple[int, ...]:
+    '''
+    '0.8.0' -> (0, 8, 0); unparsable versions compare lowest
+    '''
+    
+    try:
+        return tuple(int(part) for part in extversion.split('.'))
+    except ValueError:
+        return (0,)
+
+def vector_column_values(conn, embedding: List[float]) -> Tuple[List[str], Tuple]:
+    '''
+    Optional pgvector columns for an inserted row: (column names, values)
+    '''
+    
+    columns, values = ['embedding'], [vector_literal(embedding) if len(embedding) == VECTOR_COLUMN_DIM else None]
+    
+    if knowledge_column_available(conn.cursor(), 'embedding_vec_short'):
+        columns.append('embedding_vec_short')
+        values.append(short_vector_literal(embedding) if len(embedding) == VECTOR_COLUMN_DIM else None)
+    
+    return columns, tuple(values)
+
+def knn_search_server(
+    conn,
+    event_id: int,
+    item_type: str,
+    query_embedding: List[float],
+    top_k: int,
+    model: str
+) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    '''
+    Top-k by cosine distance in Postgres (ORDER BY embedding <=> query).
+    Only the k result rows leave the database. With short vectors enabled the
+    first stage runs on embedding_vec_short for top_k * RAG_RERANK_FACTOR rows,
+    which are then reranked on their full vectors.
+    
+    The HNSW index covers all events and filters by event_id after the scan, so
+    it can return fewer than k rows of a small event. It is used only with
+    pgvector >= 0.8 iterative scans, and an exact scan of the event's rows (a
+    MATERIALIZED CTE over the (event_id, item_type) index) runs otherwise and
+    whenever the HNSW query comes back short.
+    
+    Returns:
+        (scored items, normalized matrix of their embeddings for reranking)
+    '''
     
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
+    if short_vector_enabled(conn):
+        column, query, limit = 'embedding_vec_short', short_vector_literal(query_embedding), top_k * RAG_RERANK_FACTOR
+    else:
+        column, query, limit = 'embedding', vector_literal(query_embedding), top_k
+    
+    rows = []
+    if SERVER_KNN_STATE.get('iterative_scan'):
+        cur.execute("SET LOCAL hnsw.iterative_scan = 'relaxed_order'")
+        cur.execute('SET LOCAL hnsw.ef_search = %s', (max(RAG_HNSW_EF_SEARCH, limit),))
+        cur.execute('''
+            SELECT id, content, metadata, embedding_packed, embedding_codec,
+                   CASE WHEN embedding_packed IS NULL THEN embedding::text END AS embedding
+            FROM t_p22819116_event_schedule_app.knowledge_store
+            WHERE event_id = %s AND item_type = %s AND embedding_model = %s AND ''' + column + ''' IS NOT NULL
+            ORDER BY ''' + column + ''' <=> %s::vector
+            LIMIT %s
+        ''', (event_id, item_type, model, query, limit))
+        rows = cur.fetchall()
+    
+    if len(rows) < limit:
+        cur.execute('''
+            WITH event_rows AS MATERIALIZED (
+                SELECT id, content, metadata, embedding_packed, embedding_codec,
+                       CASE WHEN embedding_packed IS NULL THEN embedding::text END AS embedding,
+                       ''' + column + ''' AS knn_vector
+                FROM t_p22819116_event_schedule_app.knowledge_store
+                WHERE event_id = %s AND item_type = %s AND embedding_model = %s AND ''' + column + ''' IS NOT NULL
+            )
+            SELECT id, content, metadata, embedding_packed, embedding_codec, embedding
+            FROM event_rows
+            ORDER BY knn_vector <=> %s::vector
+            LIMIT %s
+        ''', (event_id, item_type, model, query, limit))
+        rows = cur.fetchall()
+    
+    rows = decoded_rows(rows)
+    
+    matrix = build_embedding_matrix(decode_embedding_rows(rows))
+    indices, scores = top_k_indices(matrix, query_embedding, top_k)
+    
+    results = [
+        {
+            'id': rows[i]['id'],
+            'content': rows[i]['content'],
+            'metadata': rows[i]['metadata'],
+            'score': float(score),
+            'type': item_type
+        }
+        for i, score in zip(indices.tolist(), scores.tolist())
+    ]
+    
+    return results, matrix[indices] if indices.shape[0] else matrix
+
+def hybrid_search_server(
+    conn,
+    event_id: int,
+    item_type: str,
+    query: str,
+    query_embedding: List[float],
+    items: List[Dict[str, Any]],
+    lexical_index,
+    top_k: int,
+    model: str
+) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    '''
+    score_items_hybrid with the vector ranking from knn_search_server: BM25 runs
+    over the cached row texts, and only the embeddings of fused rows the KNN
+    did not return are fetched
+    
+    Returns:
+        (scored items, normalized matrix of their embeddings for reranking)
+    '''
+    
+    depth = max(top_k * HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+    
+    vector_results, vector_matrix = knn_search_server(conn, event_id, item_type, query_embedding, depth, model)
+    lexical_indices, lexical_scores = lexical_index.search(query, depth)
+    lexical_ids = [items[i]['id'] for i in lexical_indices.tolist()]
+    lexical_by_id = dict(zip(lexical_ids, lexical_scores.tolist()))
+    
+    fused = rrf_fuse([
+        np.array([result['id'] for result in vector_results], dtype=np.int64),
+        np.array(lexical_ids, dtype=np.int64)
+    ], top_k)
+    if not fused:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    
+    vectors = {result['id']: vector_matrix[i] for i, result in enumerate(vector_results)}
+    missing = [row_id for row_id, _ in fused if row_id not in vectors]
+    if missing:
+        vectors.update(load_embeddings_by_id(conn, missing))
+    
+    rows = {item['id']: item for item in items}
+    rows.update((result['id'], result) for result in vector_results)
+    
+    ids = [row_id for row_id, _ in fused if row_id in vectors]
+    matrix = np.stack([vectors[row_id] for row_id in ids]) if ids else np.zeros((0, 0), dtype=np.float32)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query_vector)
+    cosine = matrix @ (query_vector / query_norm) if query_norm > 0 and ids else np.zeros(len(ids), dtype=np.float32)
+    
+    results = [
+        {
+            'id': row_id,
+            'content': rows[row_id]['content'],
+            'metadata': rows[row_id]['metadata'],
+            'score': float(score),
+            'lexical_score': float(lexical_by_id.get(row_id, 0.0)),
+            'type': item_type
+        }
+        for row_id, score in zip(ids, cosine.tolist())
+    ]
+    
+    return results, matrix
+
+def load_embeddings_by_id(conn, ids: List[int]) -> Dict[int, np.ndarray]:
+    '''
+    Normalized embeddings of a few knowledge_store rows, by id
+    '''
+    
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     cur.execute('''
-        SELECT id, content, metadata, embedding
+        SELECT id, embedding_packed, embedding_codec,
+               CASE WHEN embedding_packed IS NULL THEN embedding::text END AS embedding
         FROM t_p22819116_event_schedule_app.knowledge_store
-        WHERE event_id = %s AND item_type = %s AND embedding IS NOT NULL
+        WHERE id = ANY(%s)
+    ''', (list(ids),))
+    
+    rows = decoded_rows(cur.fetchall())
+    matrix = build_embedding_matrix(decode_embedding_rows(rows))
+    
+    return {row['id']: matrix[i] for i, row in enumerate(rows)}
+
+KNOWLEDGE_TEXT_CACHE = OrderedDict()
+KNOWLEDGE_TEXT_CACHE_LOCK = threading.Lock()
+KNOWLEDGE_TEXT_CACHE_MAX_ENTRIES = 64
+
+def get_knowledge_items(conn, event_id: int, versions: Dict[str, int], model: str) -> Dict[str, List[Dict[str, Any]]]:
+    '''
+    Rows (id, content, metadata) without embeddings, cached per index version: what the
+    BM25 side of the server-side hybrid search needs. Same rows and order as
+    load_embedding_matrices, so both share the lexical index of a version.
+    '''
+    
+    result = {}
+    missing = []
+    
+    with KNOWLEDGE_TEXT_CACHE_LOCK:
+        for item_type, version in versions.items():
+            key = (event_id, item_type, version)
+            if key in KNOWLEDGE_TEXT_CACHE:
+                KNOWLEDGE_TEXT_CACHE.move_to_end(key)
+                result[item_type] = KNOWLEDGE_TEXT_CACHE[key]
+            else:
+                missing.append(item_type)
+    
+    if missing:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute('''
+            SELECT id, item_type, content, metadata
+            FROM t_p22819116_event_schedule_app.knowledge_store
+            WHERE event_id = %s AND item_type = ANY(%s) AND embedding_model = %s
+              AND (embedding_packed IS NOT NULL OR embedding IS NOT NULL)
+            ORDER BY item_type, id
+        ''', (event_id, missing, model))
+        
+        loaded = {item_type: [] for item_type in missing}
+        for row in cur.fetchall():
+            loaded[row['item_type']].append({'id': row['id'], 'content': row['content'], 'metadata': row['metadata']})
+        
+        with KNOWLEDGE_TEXT_CACHE_LOCK:
+            for item_type, items in loaded.items():
+                KNOWLEDGE_TEXT_CACHE[(event_id, item_type, versions[item_type])] = items
+                result[item_type] = items
+            while len(KNOWLEDGE_TEXT_CACHE) > KNOWLEDGE_TEXT_CACHE_MAX_ENTRIES:
+                KNOWLEDGE_TEXT_CACHE.popitem(last=False)
+    
+    return result
+
+def search_knowledge_server(
+    conn,
+    event_id: int,
+    specs: List[Tuple[str, str, int]],
+    query_embeddings: List[List[float]],
+    model: str,
+    mode: str = 'vector',
+    mmr: bool = False,
+    mmr_lambdas: Dict[str, float] = None
+) -> List[List[Dict[str, Any]]]:
+    '''
+    search_knowledge_multi for mode='vector' or 'hybrid' on top of server-side KNN: no
+    embedding matrix is loaded into the container; MMR reranks the fetched candidates
+    '''
+    
+    if mode == 'hybrid':
+        item_types = list(OrderedDict.fromkeys(item_type for _, item_type, _ in specs))
+        versions = get_index_versions(conn, event_id, item_types)
+        items_by_type = get_knowledge_items(conn, event_id, versions, model)
+    
+    results = []
+    for (query, item_type, top_k), query_embedding in zip(specs, query_embeddings):
+        depth = top_k * MMR_CANDIDATE_FACTOR if mmr else top_k
+        
+        if mode == 'hybrid':
+            items = items_by_type[item_type]
+            if not items:
+                results.append([])
+                continue
+            
+            lexical_index = get_lexical_index((event_id, item_type, versions[item_type]), items)
+            candidates, matrix = hybrid_search_server(
+                conn, event_id, item_type, query, query_embedding, items, lexical_index, depth, model
+            )
+        else:
+            candidates, matrix = knn_search_server(conn, event_id, item_type, query_embedding, depth, model)
+        
+        if mmr:
+            lambdas = mmr_lambdas or MMR_LAMBDAS
+            candidates = mmr_rerank(candidates, candidates, matrix, top_k, lambdas.get(item_type, MMR_DEFAULT_LAMBDA))
+        
+        results.append(candidates)
+    
+    return results
+
+def get_index_version(conn, event_id: int, item_type: str) -> int:
+    '''
+    Current knowledge_store index version for (event_id, item_type), 0 if never indexed
+    '''
+    return get_index_versions(conn, event_id, [item_type])[item_type]
+
+def get_index_versions(conn, event_id: int, item_types: List[str]) -> Dict[str, int]:
+    '''
+    Index versions for several item types of one event in a single query
+    '''
+    
+    cur = conn.cursor()
+    
+    cur.execute('''
+        SELECT item_type, version FROM t_p22819116_event_schedule_app.knowledge_index_versions
+        WHERE event_id = %s AND item_type = ANY(%s)
+    ''', (event_id, list(item_types)))
+    
+    versions = {item_type: 0 for item_type in item_types}
+    for item_type, version in cur.fetchall():
+        versions[item_type] = version
+    
+    return versions
+
+def bump_index_version(cur, event_id: int, item_type: str):
+    '''
+    Mark (event_id, item_type) as re-indexed so warm containers drop cached matrices
+    '''
+    
+    cur.execute('''
+        INSERT INTO t_p22819116_event_schedule_app.knowledge_index_versions (event_id, item_type, version)
+        VALUES (%s, %s, 1)
+        ON CONFLICT (event_id, item_type)
+        DO UPDATE SET version = knowledge_index_versions.version + 1, updated_at = CURRENT_TIMESTAMP
     ''', (event_id, item_type))
     
-    items = cur.fetchall()
+    MATRIX_CACHE.invalidate(event_id, item_type)
+
+def get_embedding_matrix(conn, event_id: int, item_type: str, version: int = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    '''
+    Cached load_embedding_matrix: reuses the matrix while the index version is unchanged
+    '''
+    
+    if version is None:
+        version = get_index_version(conn, event_id, item_type)
+    
+    return get_embedding_matrices(conn, event_id, {item_type: version})[item_type]
+
+def get_embedding_matrices(conn, event_id: int, versions: Dict[str, int], model: str = None) -> Dict[str, Tuple[List[Dict[str, Any]], np.ndarray]]:
+    '''
+    Cached matrices for several item types; cache misses are loaded with one SQL query
     
-    if not items:
-        print(f'[RAG] No {item_type} embeddings found for event {event_id}')
+    Args:
+        versions: item_type -> index version (see get_index_versions)
+        model: embedding model of the rows to load, active provider's by default
+               (EMBEDDING_PROVIDER is fixed per deployment, so it is not part of the cache key)
+    '''
+    
+    result = {}
+    missing = []
+    
+    for item_type, version in versions.items():
+        cached = MATRIX_CACHE.get((event_id, item_type, version))
+        if cached is not None:
+            result[item_type] = cached
+        else:
+            missing.append(item_type)
+    
+    if missing:
+        loaded = load_embedding_matrices(conn, event_id, missing, model)
+        
+        for item_type, (items, matrix) in loaded.items():
+            MATRIX_CACHE.put((event_id, item_type, versions[item_type]), items, matrix)
+            result[item_type] = (items, matrix)
+            print(f'[RAG] Cached {len(items)} {item_type} embeddings for event {event_id} (version {versions[item_type]})')
+    
+    return result
+
+def load_embedding_matrix(conn, event_id: int, item_type: str, model: str = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    '''
+    Load knowledge rows of one item_type and stack their embeddings
+    
+    Returns:
+        (items without embeddings, normalized float32 matrix with one row per item)
+    '''
+    return load_embedding_matrices(conn, event_id, [item_type], model)[item_type]
+
+def load_embedding_matrices(conn, event_id: int, item_types: List[str], model: str = None) -> Dict[str, Tuple[List[Dict[str, Any]], np.ndarray]]:
+    '''
+    Load knowledge rows of several item types in one query and stack embeddings per type.
+    Only rows embedded with `model` are loaded: vectors of different models are not comparable.
+    
+    Returns:
+        item_type -> (items without embeddings, normalized float32 matrix ordered by id)
+    '''
+    
+    model = model or get_embedding_provider().model
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
+    cur.execute('''
+        SELECT id, item_type, content, metadata, embedding_packed, embedding_codec,
+               CASE WHEN embedding_packed IS NULL THEN embedding::text END AS embedding
+        FROM t_p22819116_event_schedule_app.knowledge_store
+        WHERE event_id = %s AND item_type = ANY(%s) AND embedding_model = %s
+          AND (embedding_packed IS NOT NULL OR embedding IS NOT NULL)
+        ORDER BY item_type, id
+    ''', (event_id, list(item_types), model))
+    
+    items_by_type = {item_type: [] for item_type in item_types}
+    rows_by_type = {item_type: [] for item_type in item_types}
+    
+    for row in decoded_rows(cur.fetchall()):
+        items_by_type[row['item_type']].append({
+            'id': row['id'],
+            'content': row['content'],
+            'metadata': row['metadata']
+        })
+        rows_by_type[row['item_type']].append(row)
+    
+    return {
+        item_type: (items_by_type[item_type], build_embedding_matrix(decode_embedding_rows(rows_by_type[item_type])))
+        for item_type in item_types
+    }
+
+def unpack_embeddings(blobs: List[bytes], codec: str) -> np.ndarray:
+    '''
+    Decode same-codec, same-dim packed embeddings into a float32 matrix with one frombuffer
+    '''
+    
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+    
+    data = np.frombuffer(b''.join(bytes(blob) for blob in blobs), dtype=np.uint8).reshape(len(blobs), -1)
+    
+    if codec == 'f16':
+        return data.view('<f2').astype(np.float32)
+    
+    if codec == 'i8':
+        scales = data[:, :4].copy().view('<f4').astype(np.float32)
+        return data[:, 4:].view(np.int8).astype(np.float32) * scales
+    
+    raise ValueError(f'Unknown embedding codec: {codec}')
+
+def decoded_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    knowledge_store rows with a usable embedding. Unpacked rows select the pgvector
+    column as embedding::text ('[0.1,0.2,...]'), parsed here into a list.
+    '''
+    
+    result = []
+    for row in rows:
+        if row['embedding_packed'] is None:
+            if not row['embedding']:
+                continue
+            row['embedding'] = json.loads(row['embedding'])
+        result.append(row)
+    
+    return result
+
+def decode_embedding_rows(rows: List[Dict[str, Any]]) -> np.ndarray:
+    '''
+    Float32 matrix (not normalized) from knowledge_store rows: packed rows are
+    decoded per codec, rows indexed before packing fall back to the embedding array
+    '''
+    
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    
+    positions = {}
+    for i, row in enumerate(rows):
+        codec = row['embedding_codec'] if row['embedding_packed'] is not None else None
+        positions.setdefault(codec, []).append(i)
+    
+    matrix = None
+    for codec, indices in positions.items():
+        if codec is None:
+            block = np.asarray([rows[i]['embedding'] for i in indices], dtype=np.float32)
+        else:
+            block = unpack_embeddings([rows[i]['embedding_packed'] for i in indices], codec)
+        
+        if matrix is None:
+            matrix = np.zeros((len(rows), block.shape[1]), dtype=np.float32)
+        matrix[indices] = block
+    
+    return matrix
+
+def build_embedding_matrix(embeddings: List[List[float]]) -> np.ndarray:
+    '''
+    Stack embeddings into an L2-normalized float32 matrix (zero vectors stay zero)
+    '''
+    
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    
+    return matrix / norms
+
+def top_k_indices(matrix: np.ndarray, query_embedding: List[float], top_k: int, ann_index=None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Cosine top-k over a normalized matrix: one matrix-vector product + argpartition.
+    With ann_index (ann_index.IVFIndex) only the probed clusters are scored;
+    with a dim_reduction.ReducedIndex the reduced first stage is reranked on full vectors.
+    
+    Returns:
+        (row indices sorted by score desc, their scores)
+    '''
+    
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    
+    if matrix.shape[0] == 0 or top_k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    
+    if ann_index is not None and query_norm > 0:
+        return ann_index.search(matrix, query / query_norm, top_k)
+    
+    if query_norm == 0:
+        scores = np.zeros(matrix.shape[0], dtype=np.float32)
+    else:
+        scores = matrix @ (query / query_norm)
+    
+    k = min(top_k, scores.shape[0])
+    
+    if k < scores.shape[0]:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(scores.shape[0])
+    
+    indices = indices[np.argsort(-scores[indices], kind='stable')]
+    
+    return indices, scores[indices]
+
+def score_items_vectorized(
+    query_embedding: List[float],
+    items: List[Dict[str, Any]],
+    matrix: np.ndarray,
+    item_type: str,
+    top_k: int,
+    ann_index=None
+) -> List[Dict[str, Any]]:
+    '''
+    Rank items by cosine similarity using the precomputed embedding matrix
+    '''
+    
+    indices, scores = top_k_indices(matrix, query_embedding, top_k, ann_index)
+    
+    return [
+        {
+            'id': items[i]['id'],
+            'content': items[i]['content'],
+            'metadata': items[i]['metadata'],
+            'score': float(score),
+            'type': item_type
+        }
+        for i, score in zip(indices.tolist(), scores.tolist())
+    ]
+
+def score_items_lexical(
+    query: str,
+    items: List[Dict[str, Any]],
+    lexical_index,
+    item_type: str,
+    top_k: int
+) -> List[Dict[str, Any]]:
+    '''
+    Rank items by BM25 only (no embeddings needed); score is BM25 scaled to [0, 1]
+    '''
+    
+    indices, scores = lexical_index.search(query, top_k)
+    max_score = float(scores[0]) if scores.shape[0] else 1.0
+    
+    return [
+        {
+            'id': items[i]['id'],
+            'content': items[i]['content'],
+            'metadata': items[i]['metadata'],
+            'score': float(score) / max_score,
+            'lexical_score': float(score),
+            'type': item_type
+        }
+        for i, score in zip(indices.tolist(), scores.tolist())
+    ]
+
+def score_items_hybrid(
+    query: str,
+    query_embedding: List[float],
+    items: List[Dict[str, Any]],
+    matrix: np.ndarray,
+    lexical_index,
+    item_type: str,
+    top_k: int,
+    ann_index=None
+) -> List[Dict[str, Any]]:
+    '''
+    Fuse the vector and BM25 rankings with reciprocal rank fusion, so exact
+    names/terms missed by the embedding still reach the top-k.
+    score stays the cosine similarity; the order follows the fused rank.
+    '''
+    
+    depth = max(top_k * HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+    
+    vector_indices, _ = top_k_indices(matrix, query_embedding, depth, ann_index)
+    lexical_indices, lexical_scores = lexical_index.search(query, depth)
+    lexical_by_row = dict(zip(lexical_indices.tolist(), lexical_scores.tolist()))
+    
+    fused = rrf_fuse([vector_indices, lexical_indices], top_k)
+    if not fused:
+        return []
+    
+    rows = np.array([i for i, _ in fused], dtype=np.int64)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    cosine = matrix[rows] @ (query / query_norm) if query_norm > 0 else np.zeros(rows.shape[0], dtype=np.float32)
+    
+    return [
+        {
+            'id': items[i]['id'],
+            'content': items[i]['content'],
+            'metadata': items[i]['metadata'],
+            'score': float(score),
+            'lexical_score': float(lexical_by_row.get(i, 0.0)),
+            'type': item_type
+        }
+        for i, score in zip(rows.tolist(), cosine.tolist())
+    ]
+
+def mmr_select(vectors: np.ndarray, relevance: np.ndarray, top_k: int, lambda_: float) -> List[int]:
+    '''
+    Maximal marginal relevance over a small candidate set: greedily pick the row
+    maximizing lambda * relevance - (1 - lambda) * max similarity to rows already picked
+    
+    Args:
+        vectors: normalized candidate embeddings, one row per candidate
+        relevance: candidate relevance to the query (higher is better)
+        top_k: number of rows to pick
+        lambda_: 1.0 = pure relevance order, 0.0 = pure diversity
+    
+    Returns:
+        Picked candidate positions in selection order
+    '''
+    
+    count = vectors.shape[0]
+    k = min(top_k, count)
+    if k <= 0:
         return []
     
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    
+    picked = []
+    for _ in range(k):
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    
+    return picked
+
+def mmr_rerank(
+    candidates: List[Dict[str, Any]],
+    items: List[Dict[str, Any]],
+    matrix: np.ndarray,
+    top_k: int,
+    lambda_: float
+) -> List[Dict[str, Any]]:
+    '''
+    Rerank scored candidates (output of the score_items_* functions) with MMR,
+    using their rows of the event's embedding matrix for redundancy
+    '''
+    
+    if len(candidates) <= 1 or matrix.shape[0] == 0:
+        return candidates[:top_k]
+    
+    row_by_id = {item['id']: i for i, item in enumerate(items)}
+    rows = np.array([row_by_id[candidate['id']] for candidate in candidates], dtype=np.int64)
+    relevance = np.array([candidate['score'] for candidate in candidates], dtype=np.float32)
+    
+    return [candidates[i] for i in mmr_select(matrix[rows], relevance, top_k, lambda_)]
+
+def score_items_exact(
+    query_embedding: List[float],
+    items: List[Dict[str, Any]],
+    item_type: str,
+    top_k: int
+) -> List[Dict[str, Any]]:
+    '''
+    Reference pure-Python ranking (items carry raw 'embedding' lists).
+    Kept to check score_items_vectorized results for equality.
+    '''
+    
     scored_items = []
     for item in items:
         embedding = item['embedding']
@@ -113,7 +1084,153 @@ def search_knowledge(
     
     return scored_items[:top_k]
 
-def index_program_items(conn, event_id: int, program_data: List[Dict[str, Any]], api_key: str):
+def diff_knowledge_rows(
+    existing: List[Dict[str, Any]],
+    entries: List[Tuple[str, Dict[str, Any]]]
+) -> Dict[str, Any]:
+    '''
+    Match existing knowledge_store rows to fresh entries by content hash
+    
+    Returns:
+        {
+            'desired': OrderedDict hash -> (content, metadata), first occurrence wins,
+            'kept': hash -> existing row to keep,
+            'stale_ids': ids of vanished or duplicate rows,
+            'new_hashes': hashes that need inserting, in entry order
+        }
+    '''
+    
+    desired = OrderedDict()
+    for content, metadata in entries:
+        h = text_hash(content)
+        if h not in desired:
+            desired[h] = (content, metadata)
+    
+    kept = {}
+    stale_ids = []
+    for row in existing:
+        h = row.get('content_hash') or text_hash(row.get('content') or '')
+        if h in desired and h not in kept:
+            kept[h] = row
+        else:
+            stale_ids.append(row['id'])
+    
+    return {
+        'desired': desired,
+        'kept': kept,
+        'stale_ids': stale_ids,
+        'new_hashes': [h for h in desired if h not in kept]
+    }
+
+def sync_knowledge_items(
+    conn,
+    event_id: int,
+    item_type: str,
+    entries: List[Tuple[str, Dict[str, Any]]],
+    api_key: str,
+    mode: str = 'diff'
+) -> Dict[str, int]:
+    '''
+    Write (content, metadata) entries of one item_type into knowledge_store
+    
+    mode='diff' compares entries with existing rows by content hash: inserts only
+    new rows, deletes only vanished ones and updates content/metadata in place,
+    so ids referenced from generated_emails.rag_sources stay stable.
+    mode='full' deletes all rows of the item_type and re-inserts everything.
+    
+    Returns:
+        {'inserted': int, 'deleted': int, 'updated': int, 'unchanged': int}
+    '''
+    
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
+    deleted = 0
+    existing = []
+    
+    if mode == 'full':
+        cur.execute('''
+            DELETE FROM t_p22819116_event_schedule_app.knowledge_store
+            WHERE event_id = %s AND item_type = %s
+        ''', (event_id, item_type))
+        deleted = cur.rowcount
+    else:
+        cur.execute('''
+            SELECT id, content, content_hash, metadata, embedding_model
+            FROM t_p22819116_event_schedule_app.knowledge_store
+            WHERE event_id = %s AND item_type = %s
+        ''', (event_id, item_type))
+        existing = cur.fetchall()
+    
+    provider = get_embedding_provider(api_key)
+    current = [row for row in existing if row['embedding_model'] == provider.model]
+    
+    diff = diff_knowledge_rows(current, entries)
+    desired = diff['desired']
+    kept = diff['kept']
+    stale_ids = diff['stale_ids'] + [row['id'] for row in existing if row['embedding_model'] != provider.model]
+    
+    updated = 0
+    for h, row in kept.items():
+        content, metadata = desired[h]
+        old_metadata = row['metadata']
+        if isinstance(old_metadata, str):
+            old_metadata = json.loads(old_metadata)
+        
+        changed = row['content'] != content or (old_metadata or {}) != json.loads(json.dumps(metadata))
+        
+        if changed or row['content_hash'] != h:
+            cur.execute('''
+                UPDATE t_p22819116_event_schedule_app.knowledge_store
+                SET content = %s, metadata = %s, content_hash = %s
+                WHERE id = %s
+            ''', (content, json.dumps(metadata), h, row['id']))
+        
+        if changed:
+            updated += 1
+    
+    if stale_ids:
+        cur.execute('''
+            DELETE FROM t_p22819116_event_schedule_app.knowledge_store
+            WHERE id = ANY(%s)
+        ''', (stale_ids,))
+        deleted += len(stale_ids)
+    
+    new_hashes = diff['new_hashes']
+    embeddings = get_embeddings_cached(conn, [desired[h][0] for h in new_hashes], api_key)
+    
+    if new_hashes:
+        vector_columns, _ = vector_column_values(conn, embeddings[0])
+        
+        psycopg2.extras.execute_values(cur, '''
+            INSERT INTO t_p22819116_event_schedule_app.knowledge_store
+            (event_id, item_type, content, metadata, embedding_packed, embedding_codec,
+             embedding_model, embedding_dim, content_hash''' + ''.join(', ' + column for column in vector_columns) + ''')
+            VALUES %s
+        ''', [
+            (
+                event_id, item_type, desired[h][0], json.dumps(desired[h][1]),
+                psycopg2.Binary(pack_embedding(embedding)), EMBEDDING_CODEC,
+                provider.model, len(embedding), h
+            ) + vector_column_values(conn, embedding)[1]
+            for h, embedding in zip(new_hashes, embeddings)
+        ], template='(%s, %s, %s, %s, %s, %s, %s, %s, %s' + ', %s::vector' * len(vector_columns) + ')',
+           page_size=KNOWLEDGE_INSERT_PAGE_SIZE)
+    
+    stats = {
+        'inserted': len(new_hashes),
+        'deleted': deleted,
+        'updated': updated,
+        'unchanged': len(kept) - updated
+    }
+    
+    if stats['inserted'] or stats['deleted'] or stats['updated']:
+        bump_index_version(cur, event_id, item_type)
+    
+    conn.commit()
+    
+    return stats
+
+def index_program_items(conn, event_id: int, program_data: List[Dict[str, Any]], api_key: str, mode: str = 'diff') -> Dict[str, int]:
     '''
     Index program items (from Google Sheets) into knowledge_store
     
@@ -122,15 +1239,13 @@ def index_program_items(conn, event_id: int, program_data: List[Dict[str, Any]],
         event_id: event ID
         program_data: list of program items (title, speaker, time, track, abstract, tags)
         api_key: OpenAI API key
-    '''
-    
-    cur = conn.cursor()
+        mode: 'diff' (incremental, keeps row ids) or 'full' (delete and re-insert)
     
-    cur.execute('''
-        DELETE FROM t_p22819116_event_schedule_app.knowledge_store
-        WHERE event_id = %s AND item_type = 'program_item'
-    ''', (event_id,))
+    Returns:
+        sync_knowledge_items stats
+    '''
     
+    entries = []
     for item in program_data:
         content = f"{item.get('title', '')} | {item.get('speaker', '')} | {item.get('abstract', '')}"
         
@@ -143,18 +1258,14 @@ def index_program_items(conn, event_id: int, program_data: List[Dict[str, Any]],
             'tags': item.get('tags', [])
         }
         
-        embedding = get_embedding(content, api_key)
-        
-        cur.execute('''
-            INSERT INTO t_p22819116_event_schedule_app.knowledge_store
-            (event_id, item_type, content, metadata, embedding)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (event_id, 'program_item', content, json.dumps(metadata), embedding))
+        entries.append((content, metadata))
     
-    conn.commit()
-    print(f'[RAG] Indexed {len(program_data)} program items')
+    stats = sync_knowledge_items(conn, event_id, 'program_item', entries, api_key, mode)
+    print(f'[RAG] Indexed {len(program_data)} program items: {stats}')
+    
+    return stats
 
-def index_pain_points(conn, event_id: int, pain_points: List[str], api_key: str):
+def index_pain_points(conn, event_id: int, pain_points: List[str], api_key: str, mode: str = 'diff') -> Dict[str, int]:
     '''
     Index pain points into knowledge_store
     
@@ -163,31 +1274,17 @@ def index_pain_points(conn, event_id: int, pain_points: List[str], api_key: str)
         event_id: event ID
         pain_points: list of pain point texts
         api_key: OpenAI API key
+        mode: 'diff' or 'full', see sync_knowledge_items
     '''
     
-    cur = conn.cursor()
-    
-    cur.execute('''
-        DELETE FROM t_p22819116_event_schedule_app.knowledge_store
-        WHERE event_id = %s AND item_type = 'pain_point'
-    ''', (event_id,))
+    entries = [(pain, {}) for pain in pain_points if pain.strip()]
     
-    for pain in pain_points:
-        if not pain.strip():
-            continue
-        
-        embedding = get_embedding(pain, api_key)
-        
-        cur.execute('''
-            INSERT INTO t_p22819116_event_schedule_app.knowledge_store
-            (event_id, item_type, content, metadata, embedding)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (event_id, 'pain_point', pain, json.dumps({}), embedding))
+    stats = sync_knowledge_items(conn, event_id, 'pain_point', entries, api_key, mode)
+    print(f'[RAG] Indexed {len(entries)} pain points: {stats}')
     
-    conn.commit()
-    print(f'[RAG] Indexed {len(pain_points)} pain points')
+    return stats
 
-def index_style_snippets(conn, event_id: int, snippets: List[str], api_key: str):
+def index_style_snippets(conn, event_id: int, snippets: List[str], api_key: str, mode: str = 'diff') -> Dict[str, int]:
     '''
     Index style snippets into knowledge_store
     
@@ -196,26 +1293,12 @@ def index_style_snippets(conn, event_id: int, snippets: List[str], api_key: str)
         event_id: event ID
         snippets: list of email style examples
         api_key: OpenAI API key
+        mode: 'diff' or 'full', see sync_knowledge_items
     '''
     
-    cur = conn.cursor()
-    
-    cur.execute('''
-        DELETE FROM t_p22819116_event_schedule_app.knowledge_store
-        WHERE event_id = %s AND item_type = 'style_snippet'
-    ''', (event_id,))
+    entries = [(snippet, {}) for snippet in snippets if snippet.strip()]
     
-    for snippet in snippets:
-        if not snippet.strip():
-            continue
-        
-        embedding = get_embedding(snippet, api_key)
-        
-        cur.execute('''
-            INSERT INTO t_p22819116_event_schedule_app.knowledge_store
-            (event_id, item_type, content, metadata, embedding)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (event_id, 'style_snippet', snippet, json.dumps({}), embedding))
+    stats = sync_knowledge_items(conn, event_id, 'style_snippet', entries, api_key, mode)
+    print(f'[RAG] Indexed {len(entries)} style snippets: {stats}')
     
-    conn.commit()
-    print(f'[RAG] Indexed {len(snippets)} style snippets')
+    return stats
@@ -0,0 +1,83 @@
+'''
+Recall/latency of dimension-reduced search (truncation and PCA, with full-vector rerank) vs exact cosine
+
+Usage: python reduced_dim_recall.py [rows]                      synthetic clustered vectors (default 20000)
+       DATABASE_URL=postgres://... python reduced_dim_recall.py --event <id> [item_type]
+Real events should be embedded with text-embedding-3-*: truncation relies on Matryoshka training,
+synthetic vectors only show the PCA / rerank trade-off.
+'''
+
+import os
+import sys
+import time
+import numpy as np
+from dim_reduction import ReducedIndex
+from rag_module import build_embedding_matrix, load_embedding_matrix, top_k_indices
+
+DIMS = (64, 128, 256, 512, 768)
+RERANK_FACTORS = (1, 4)
+QUERIES = 100
+TOP_K = 10
+
+def synthetic_matrix(rows: int, dim: int = 1536, clusters: int = 200, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    return build_embedding_matrix(centers[rng.integers(clusters, size=rows)] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32))
+
+def event_matrix(event_id: int, item_type: str) -> np.ndarray:
+    import psycopg2
+    
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    _, matrix = load_embedding_matrix(conn, event_id, item_type)
+    conn.close()
+    
+    return matrix
+
+def timed_search(search, queries):
+    samples, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(set(search(query)[0].tolist()))
+        samples.append(time.perf_counter() - started)
+    return np.percentile(np.array(samples) * 1000, 50), results
+
+def recall(exact, approx):
+    return np.mean([len(e & a) / len(e) for e, a in zip(exact, approx)])
+
+def run(matrix: np.ndarray):
+    rows, dim = matrix.shape
+    print(f'== {rows} rows, dim {dim}, top_k={TOP_K} ==')
+    
+    rng = np.random.default_rng(7)
+    queries = build_embedding_matrix(
+        matrix[rng.choice(rows, min(QUERIES, rows), replace=False)] + 0.05 * rng.normal(size=(min(QUERIES, rows), dim)).astype(np.float32)
+    )
+    
+    exact_ms, exact = timed_search(lambda q: top_k_indices(matrix, q, TOP_K), queries)
+    print(f'  exact {dim:>4}            p50={exact_ms:7.2f}ms  {matrix.nbytes / 2**20:7.1f} MB')
+    
+    for method in ('truncate', 'pca'):
+        for reduced_dim in DIMS:
+            if reduced_dim >= dim:
+                continue
+            
+            started = time.perf_counter()
+            index = ReducedIndex.build(matrix, reduced_dim, method)
+            build_ms = (time.perf_counter() - started) * 1000
+            
+            for factor in RERANK_FACTORS:
+                index.rerank_factor = factor
+                ms, approx = timed_search(lambda q: top_k_indices(matrix, q, TOP_K, index), queries)
+                print(
+                    f'  {method:<8} {reduced_dim:>4} rerank x{factor}  p50={ms:7.2f}ms  {index.reduced.nbytes / 2**20:7.1f} MB'
+                    f'  recall@{TOP_K}={recall(exact, approx):.3f}  build {build_ms:.0f}ms'
+                )
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--event':
+        run(event_matrix(int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else 'program_item'))
+    else:
+        run(synthetic_matrix(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
+
+if __name__ == '__main__':
+    main()
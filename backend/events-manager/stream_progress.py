@@ -0,0 +1,126 @@
+'''
+Progress of a streamed generation, for the UI to poll while the POST is still running:
+the function runtime returns one response per invocation, so partial subject/HTML are
+flushed to generation_progress and read back with GET ?action=generation_progress
+'''
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+import psycopg2
+
+from partial_json import partial_string_fields
+
+STREAM_FLUSH_INTERVAL = float(os.environ.get('STREAM_FLUSH_INTERVAL', '0.5'))
+STREAM_FIELDS = ('subject', 'html')
+
+class ProgressWriter:
+    '''
+    on_text() callback for stream_chat_completion(): parses the envelope and upserts
+    the partial fields at most every STREAM_FLUSH_INTERVAL seconds. Uses its own
+    autocommit connection so progress is visible before the handler's transaction commits.
+    '''
+    
+    def __init__(self, stream_id: str, db_url: str):
+        self.stream_id = stream_id
+        self.conn = psycopg2.connect(db_url)
+        self.conn.autocommit = True
+        self.text = ''
+        self.flushed_at = 0.0
+        self.flushed_length = -1
+        self.flushes = 0
+        self.failed = False
+        self.write({'status': 'streaming', 'subject': '', 'html': '', 'chars': 0})
+        self.purge_stale()
+    
+    def purge_stale(self):
+        if self.failed:
+            return
+        
+        cur = self.conn.cursor()
+        cur.execute('''
+            DELETE FROM t_p22819116_event_schedule_app.generation_progress
+            WHERE updated_at < NOW() - INTERVAL '1 day'
+        ''')
+    
+    def write(self, values: Dict[str, Any]):
+        '''
+        Upsert the given columns; a failed write disables progress instead of failing the generation
+        '''
+        
+        if self.failed:
+            return
+        
+        columns = list(values)
+        try:
+            cur = self.conn.cursor()
+            cur.execute(f'''
+                INSERT INTO t_p22819116_event_schedule_app.generation_progress (stream_id, {', '.join(columns)})
+                VALUES (%s, {', '.join(['%s'] * len(columns))})
+                ON CONFLICT (stream_id) DO UPDATE
+                SET {', '.join(f'{column} = EXCLUDED.{column}' for column in columns)}, updated_at = CURRENT_TIMESTAMP
+            ''', (self.stream_id, *values.values()))
+        except Exception as e:
+            print(f'[STREAM] Progress write failed for {self.stream_id}: {type(e).__name__} - {e}')
+            self.failed = True
+    
+    def __call__(self, text: str):
+        self.text = text
+        if time.monotonic() - self.flushed_at >= STREAM_FLUSH_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        if len(self.text) == self.flushed_length:
+            return
+        
+        fields = partial_string_fields(self.text, STREAM_FIELDS)
+        self.write({
+            'subject': fields.get('subject', ('', False))[0],
+            'html': fields.get('html', ('', False))[0],
+            'chars': len(self.text)
+        })
+        self.flushed_at = time.monotonic()
+        self.flushed_length = len(self.text)
+        self.flushes += 1
+    
+    def finish(self, status: str, email_id: Optional[int] = None, subject: Optional[str] = None, error: Optional[str] = None):
+        '''
+        Final state: 'done' with the persisted email, or 'failed' with the error
+        '''
+        
+        try:
+            self.flush()
+            values = {'status': status, 'email_id': email_id, 'error': error}
+            if subject is not None:
+                values['subject'] = subject
+            self.write(values)
+        finally:
+            self.conn.close()
+
+def read_progress(cur, stream_id: str) -> Optional[Dict[str, Any]]:
+    cur.execute('''
+        SELECT stream_id, status, subject, html, chars, email_id, error, updated_at
+        FROM t_p22819116_event_schedule_app.generation_progress
+        WHERE stream_id = %s
+    ''', (stream_id,))
+    row = cur.fetchone()
+    
+    if row is None:
+        return None
+    
+    row = dict(row)
+    row['updated_at'] = row['updated_at'].isoformat() if row['updated_at'] else None
+    return row
+
+def open_progress(stream_id: str) -> Optional[ProgressWriter]:
+    '''
+    ProgressWriter for the stream, or None when progress cannot be recorded (the
+    generation then runs without progress events rather than failing)
+    '''
+    
+    try:
+        return ProgressWriter(stream_id, os.environ['DATABASE_URL'])
+    except Exception as e:
+        print(f'[STREAM] Progress disabled for {stream_id}: {type(e).__name__} - {e}')
+        return None
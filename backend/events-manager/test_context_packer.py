@@ -0,0 +1,124 @@
+'''
+Unit tests for relevance-ranked, token-budgeted prompt context
+'''
+
+import time
+import context_packer
+from context_packer import ContextPacker, Section, count_tokens, get_encoding
+
+MODEL = 'gpt-4o-mini'
+
+PROGRAM = 'Время\tСпикер\tТема\n' + '\n'.join(
+    f'10:{i:02d}\tИванов\tДоклад про продажи и переговоры {i}' for i in range(200)
+) + '\n16:00\tПетрова\tАналитика данных в ритейле'
+
+def test_relevant_line_past_the_old_cutoff_is_kept():
+    '''Test a matching row far beyond the first 3000 characters is packed, with the header row'''
+    
+    assert PROGRAM.index('Петрова') > 3000
+    
+    packed, used = Section(PROGRAM, MODEL).pack('Аналитика данных для ритейла', 300)
+    lines = packed.split('\n')
+    
+    assert lines[0] == 'Время\tСпикер\tТема'
+    assert '16:00\tПетрова\tАналитика данных в ритейле' in lines
+    assert used <= 300
+    assert sum(count_tokens(line, MODEL) + 1 for line in lines) == used
+    
+    print('✅ test_relevant_line_past_the_old_cutoff_is_kept passed')
+
+def test_budget_is_shared_and_respected():
+    '''Test sections stay within the budget and unused share goes to the others'''
+    
+    pain = 'Нет времени на аналитику\nСложно считать ROI'
+    packer = ContextPacker(MODEL, program=PROGRAM, pain=pain, examples='', budget=500)
+    
+    packed = packer.pack('Аналитика данных')
+    
+    assert packed['pain'] == pain
+    assert packed['examples'] == ''
+    
+    total = sum(count_tokens(line, MODEL) + 1 for text in packed.values() if text for line in text.split('\n'))
+    assert 450 < total <= 500
+    
+    print('✅ test_budget_is_shared_and_respected passed')
+
+def test_examples_are_a_cut_prefix():
+    '''Test style examples keep document order and a long single line is cut instead of dropped'''
+    
+    example = '<table><tr><td>' + 'Привет! ' * 2000 + '</td></tr></table>'
+    
+    packed, used = Section(example, MODEL, rank=False).pack('что угодно', 100)
+    
+    assert packed and example.startswith(packed)
+    assert used <= 100
+    
+    print('✅ test_examples_are_a_cut_prefix passed')
+
+def test_pain_points_are_packed_by_paragraph():
+    '''Test a multi-line pain paragraph is kept or dropped whole, and text without blank lines is split by lines'''
+    
+    relevant = 'Аналитика занимает слишком много времени.\nОтчёты собираются вручную из пяти систем.'
+    filler = '\n\n'.join(f'Сложно нанимать продавцов {i}.\nЛюди уходят через полгода.' for i in range(50))
+    pain = filler + '\n\n' + relevant
+    
+    section = Section(pain, MODEL, paragraphs=True)
+    packed, used = section.pack('Аналитика и отчёты', 60)
+    
+    assert len(section.lines) == 51
+    assert relevant in packed.split('\n\n')
+    assert used <= 60
+    
+    assert len(Section('Нет времени\nСложно считать ROI', MODEL, paragraphs=True).lines) == 2
+    
+    print('✅ test_pain_points_are_packed_by_paragraph passed')
+
+def test_fallback_estimate_is_not_below_tiktoken():
+    '''Test the ~3 characters per token fallback does not undercount against the real tokenizer'''
+    
+    encoding = get_encoding(MODEL)
+    if encoding is None:
+        print('⏭️ test_fallback_estimate_is_not_below_tiktoken skipped: tiktoken encoding not available')
+        return
+    
+    samples = [
+        PROGRAM,
+        'Нет времени на аналитику, и сложно посчитать ROI маркетинговых кампаний.',
+        'Marketing analytics for retail: how to measure the ROI of every campaign.'
+    ]
+    
+    for text in samples:
+        real = len(encoding.encode(text, disallowed_special=()))
+        estimate = len(text) // 3 + 1
+        assert real <= estimate <= 2 * real, (text[:40], real, estimate)
+    
+    print('✅ test_fallback_estimate_is_not_below_tiktoken passed')
+
+def test_slow_tokenizer_load_falls_back_to_estimate():
+    '''Test a tokenizer that does not load within the timeout does not block counting'''
+    
+    load_encoding, timeout = context_packer.load_encoding, context_packer.TOKENIZER_LOAD_TIMEOUT
+    context_packer.load_encoding = lambda model: time.sleep(1)
+    context_packer.TOKENIZER_LOAD_TIMEOUT = 0.05
+    
+    try:
+        started = time.monotonic()
+        assert count_tokens('Аналитика данных', 'slow/model') == len('Аналитика данных') // 3 + 1
+        assert count_tokens('ROI', 'slow/model') == 2
+        assert time.monotonic() - started < 0.5
+    finally:
+        context_packer.load_encoding, context_packer.TOKENIZER_LOAD_TIMEOUT = load_encoding, timeout
+    
+    print('✅ test_slow_tokenizer_load_falls_back_to_estimate passed')
+
+if __name__ == '__main__':
+    print('Running context packer tests...\n')
+    
+    test_relevant_line_past_the_old_cutoff_is_kept()
+    test_budget_is_shared_and_respected()
+    test_examples_are_a_cut_prefix()
+    test_pain_points_are_packed_by_paragraph()
+    test_fallback_estimate_is_not_below_tiktoken()
+    test_slow_tokenizer_load_falls_back_to_estimate()
+    
+    print('\n✅ All tests passed!')
@@ -0,0 +1,179 @@
+'''
+Unit tests for the pooled HTTP client (local HTTP server, no network)
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_pool
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status = 500 if self.path == '/fail' else 200
+        payload = json.dumps({'echo': json.loads(body or b'null'), 'port': self.client_address[1]}).encode('utf-8')
+        
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, *args):
+        pass
+
+class ClosingHandler(EchoHandler):
+    '''Answers as keep-alive, then drops the connection like an idle-timeout on the server'''
+    
+    def do_POST(self):
+        super().do_POST()
+        self.close_connection = True
+
+class DroppingHandler(EchoHandler):
+    '''Answers the first request of a connection, drops the connection on the second without answering'''
+    
+    requests = 0
+    
+    def do_POST(self):
+        DroppingHandler.requests += 1
+        if getattr(self, 'answered', False):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.close_connection = True
+            return
+        
+        self.answered = True
+        super().do_POST()
+
+def start_server(handler=EchoHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def test_connections_are_reused():
+    '''Test sequential calls to one host share a keep-alive connection'''
+    
+    server, base_url = start_server()
+    http_pool.POOL.clear()
+    before = http_pool.POOL.stats()
+    
+    ports = {http_pool.post_json(base_url + '/echo', {'n': i})['port'] for i in range(5)}
+    stats = http_pool.POOL.stats()
+    
+    assert len(ports) == 1
+    assert stats['created'] - before['created'] == 1
+    assert stats['reused'] - before['reused'] == 4
+    
+    req = urllib.request.Request(base_url + '/echo', data=json.dumps({'a': 1}).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    with http_pool.urlopen(req, timeout=5) as response:
+        assert json.loads(response.read().decode('utf-8'))['echo'] == {'a': 1}
+    
+    server.shutdown()
+    print('✅ test_connections_are_reused passed')
+
+def test_stale_connection_is_retried():
+    '''Test a pooled connection closed by the server is replaced transparently'''
+    
+    server, base_url = start_server(ClosingHandler)
+    http_pool.POOL.clear()
+    
+    results = []
+    for i in range(3):
+        results.append(http_pool.post_json(base_url + '/echo', {'n': i}, timeout=5)['echo'])
+        time.sleep(0.05)
+    
+    assert results == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert http_pool.POOL.stats()['dropped'] >= 2
+    
+    server.shutdown()
+    print('✅ test_stale_connection_is_retried passed')
+
+def test_sent_post_is_not_resent():
+    '''Test a POST that reached the server is not sent again when its connection drops'''
+    
+    DroppingHandler.requests = 0
+    server, base_url = start_server(DroppingHandler)
+    http_pool.POOL.clear()
+    
+    assert http_pool.post_json(base_url + '/echo', {'n': 0}, timeout=5)['echo'] == {'n': 0}
+    
+    try:
+        http_pool.post_json(base_url + '/echo', {'n': 1}, timeout=5)
+        assert False, 'expected URLError'
+    except urllib.error.URLError:
+        pass
+    
+    assert DroppingHandler.requests == 2
+    
+    server.shutdown()
+    print('✅ test_sent_post_is_not_resent passed')
+
+def test_idempotent_post_is_resent_once():
+    '''Test a POST marked idempotent (embeddings) is sent again once when the server drops a kept-alive connection'''
+    
+    DroppingHandler.requests = 0
+    server, base_url = start_server(DroppingHandler)
+    http_pool.POOL.clear()
+    
+    assert http_pool.post_json(base_url + '/echo', {'n': 0}, timeout=5, idempotent=True)['echo'] == {'n': 0}
+    assert http_pool.post_json(base_url + '/echo', {'n': 1}, timeout=5, idempotent=True)['echo'] == {'n': 1}
+    assert DroppingHandler.requests == 3
+    
+    server.shutdown()
+    print('✅ test_idempotent_post_is_resent_once passed')
+
+def test_errors_match_urllib():
+    '''Test 5xx raises HTTPError with a readable body and a dead host raises URLError'''
+    
+    server, base_url = start_server()
+    
+    try:
+        http_pool.post_json(base_url + '/fail', {'x': 1}, timeout=5)
+        assert False, 'expected HTTPError'
+    except urllib.error.HTTPError as e:
+        assert e.code == 500
+        assert json.loads(e.read().decode('utf-8'))['echo'] == {'x': 1}
+    
+    server.shutdown()
+    server.server_close()
+    http_pool.POOL.clear()
+    
+    try:
+        http_pool.request('POST', base_url + '/echo', b'{}', timeout=5)
+        assert False, 'expected URLError'
+    except urllib.error.URLError:
+        pass
+    
+    print('✅ test_errors_match_urllib passed')
+
+def test_function_copies_are_identical():
+    '''Test every committed copy of a shared module matches backend/shared (python backend/shared/sync.py)'''
+    
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(backend, 'shared'))
+    import sync
+    
+    stale = [f'{function}/{module}' for module, function, _ in sync.stale_copies()]
+    assert not stale, f'run python backend/shared/sync.py: {stale}'
+    
+    print('✅ test_function_copies_are_identical passed')
+
+if __name__ == '__main__':
+    print('Running HTTP pool tests...\n')
+    
+    test_connections_are_reused()
+    test_stale_connection_is_retried()
+    test_sent_post_is_not_resent()
+    test_idempotent_post_is_resent_once()
+    test_errors_match_urllib()
+    test_function_copies_are_identical()
+    
+    print('\n✅ All tests passed!')
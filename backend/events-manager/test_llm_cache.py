@@ -0,0 +1,125 @@
+'''
+Unit tests for the LLM response cache (in-process tier, local HTTP server, no network)
+'''
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import llm_cache
+
+class CountingHandler(BaseHTTPRequestHandler):
+    '''Answers every completion with the call number, so cached and fresh responses differ'''
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    calls = 0
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        CountingHandler.calls += 1
+        
+        body = json.dumps({'choices': [{'message': {'content': f'call {CountingHandler.calls}'}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+def start_server():
+    CountingHandler.calls = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+def content(response):
+    return response['choices'][0]['message']['content']
+
+def test_request_hash_is_canonical():
+    '''Test key order does not change the hash while any request field does'''
+    
+    messages = [{'role': 'user', 'content': 'Привет'}]
+    a = llm_cache.request_hash('https://openrouter.ai/api/v1/chat/completions', {'model': 'm', 'messages': messages, 'temperature': 0.8})
+    b = llm_cache.request_hash('https://openrouter.ai/api/v1/chat/completions', {'temperature': 0.8, 'messages': messages, 'model': 'm'})
+    
+    assert a == b
+    assert a != llm_cache.request_hash('https://openrouter.ai/api/v1/chat/completions', {'model': 'm', 'messages': messages, 'temperature': 0.9})
+    assert a != llm_cache.request_hash('https://api.openai.com/v1/chat/completions', {'model': 'm', 'messages': messages, 'temperature': 0.8})
+    
+    print('✅ test_request_hash_is_canonical passed')
+
+def test_repeat_request_is_served_from_cache():
+    '''Test an identical request skips the model call and force_fresh refreshes the entry'''
+    
+    server, url = start_server()
+    payload = {'model': 'cache-test', 'messages': [{'role': 'user', 'content': str(time.time())}], 'temperature': 0.8}
+    
+    first = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5)
+    second = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5)
+    
+    assert content(first) == content(second) == 'call 1'
+    assert CountingHandler.calls == 1
+    
+    fresh = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5, force_fresh=True)
+    after = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5)
+    
+    assert content(fresh) == content(after) == 'call 2'
+    assert CountingHandler.calls == 2
+    
+    server.shutdown()
+    print('✅ test_repeat_request_is_served_from_cache passed')
+
+def test_rejected_responses_are_not_cached():
+    '''Test a response validate rejects is returned but not stored, and a cached entry it rejects is requested again'''
+    
+    server, url = start_server()
+    payload = {'model': 'cache-test', 'messages': [{'role': 'user', 'content': str(time.time())}], 'temperature': 0.8}
+    rejected_before = llm_cache.LLM_RESPONSE_CACHE.stats()['rejected']
+    
+    rejected = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5, validate=lambda r: json.loads(content(r)))
+    assert content(rejected) == 'call 1'
+    assert llm_cache.LLM_RESPONSE_CACHE.stats()['rejected'] == rejected_before + 1
+    
+    accepted = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5, validate=lambda r: content(r).startswith('call'))
+    cached = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5, validate=lambda r: content(r).startswith('call'))
+    assert content(accepted) == content(cached) == 'call 2'
+    assert CountingHandler.calls == 2
+    
+    refreshed = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5, validate=lambda r: content(r) == 'call 3')
+    after = llm_cache.cached_chat_completion(None, url, 'key', payload, timeout=5)
+    assert content(refreshed) == content(after) == 'call 3'
+    assert CountingHandler.calls == 3
+    
+    server.shutdown()
+    print('✅ test_rejected_responses_are_not_cached passed')
+
+def test_expired_entries_are_not_served():
+    '''Test entries older than the TTL are dropped and LRU size is bounded'''
+    
+    cache = llm_cache.ResponseCache(max_entries=2, ttl_seconds=60)
+    
+    cache.put('old', {'n': 0}, created_at=time.time() - 61)
+    assert cache.get('old') is None
+    assert 'old' not in cache.entries
+    
+    for i in range(3):
+        cache.put(f'k{i}', {'n': i})
+    
+    assert cache.get('k0') is None
+    assert cache.get('k2') == {'n': 2}
+    
+    print('✅ test_expired_entries_are_not_served passed')
+
+if __name__ == '__main__':
+    print('Running LLM cache tests...\n')
+    
+    test_request_hash_is_canonical()
+    test_repeat_request_is_served_from_cache()
+    test_rejected_responses_are_not_cached()
+    test_expired_entries_are_not_served()
+    
+    print('\n✅ All tests passed!')
@@ -0,0 +1,153 @@
+'''
+Unit tests for rate-limited chat completions (local HTTP server, no network)
+'''
+
+import json
+import time
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import llm_client
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    '''Answers 429 with Retry-After to the first `failures` requests, then a completion'''
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    failures = 0
+    retry_after = '0'
+    calls = []
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        FlakyHandler.calls.append(time.monotonic())
+        
+        if len(FlakyHandler.calls) <= FlakyHandler.failures:
+            status, payload = 429, {'error': 'rate limited'}
+        else:
+            status, payload = 200, {'choices': [{'message': {'content': 'ok'}}], 'usage': {'total_tokens': 10}}
+        
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', FlakyHandler.retry_after)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+class StreamHandler(BaseHTTPRequestHandler):
+    '''Streams a completion as SSE deltas, with a keep-alive comment and a usage chunk'''
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    deltas = ['{"subject": "Тема', '", "html": "<p>', 'Привет</p>"}']
+    
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        assert request['stream'] is True
+        
+        events = [': keep-alive']
+        events += [f'data: {json.dumps({"choices": [{"delta": {"content": delta}}]})}' for delta in self.deltas]
+        events += [f'data: {json.dumps({"choices": [], "usage": {"total_tokens": 42}})}', 'data: [DONE]']
+        body = ''.join(f'{event}\n\n' for event in events).encode('utf-8')
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+def start_server(failures: int, retry_after: str):
+    FlakyHandler.failures = failures
+    FlakyHandler.retry_after = retry_after
+    FlakyHandler.calls = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+def test_token_bucket_wait_time():
+    '''Test the bucket refills at per_minute / 60 and reports the wait for a missing amount'''
+    
+    bucket = llm_client.TokenBucket(60)
+    now = bucket.updated
+    
+    assert bucket.wait_time(1, now) == 0
+    bucket.take(60)
+    assert abs(bucket.wait_time(1, now) - 1.0) < 1e-6
+    assert abs(bucket.wait_time(1, now + 0.5) - 0.5) < 1e-6
+    
+    bucket.block(10, now + 0.5)
+    assert abs(bucket.wait_time(1, now + 0.5) - 11.0) < 1e-6
+    
+    print('✅ test_token_bucket_wait_time passed')
+
+def test_retry_after_is_honoured():
+    '''Test a 429 is retried after the Retry-After delay and the call then succeeds'''
+    
+    server, url = start_server(failures=1, retry_after='0.3')
+    payload = {'model': 'test-retry', 'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 10}
+    
+    result = llm_client.chat_completion(url, 'key', payload, timeout=5, deadline=time.monotonic() + 30)
+    
+    assert result['choices'][0]['message']['content'] == 'ok'
+    assert len(FlakyHandler.calls) == 2
+    assert FlakyHandler.calls[1] - FlakyHandler.calls[0] >= 0.3
+    
+    server.shutdown()
+    print('✅ test_retry_after_is_honoured passed')
+
+def test_no_retry_past_deadline():
+    '''Test a retry that would end after the deadline is not attempted'''
+    
+    server, url = start_server(failures=5, retry_after='30')
+    payload = {'model': 'test-deadline', 'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 10}
+    started = time.monotonic()
+    
+    try:
+        llm_client.chat_completion(url, 'key', payload, timeout=5, deadline=started + 2)
+        assert False, 'expected HTTPError'
+    except urllib.error.HTTPError as e:
+        assert e.code == 429
+    
+    assert len(FlakyHandler.calls) == 1
+    assert time.monotonic() - started < 1
+    
+    server.shutdown()
+    print('✅ test_no_retry_past_deadline passed')
+
+def test_stream_assembles_deltas():
+    '''Test SSE deltas are reported as accumulated text and returned as a regular completion'''
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+    payload = {'model': 'test-stream', 'messages': [{'role': 'user', 'content': 'hi'}], 'max_tokens': 10}
+    seen = []
+    
+    result = llm_client.stream_chat_completion(url, 'key', payload, seen.append, timeout=5, deadline=time.monotonic() + 30)
+    
+    assert seen == ['{"subject": "Тема', '{"subject": "Тема", "html": "<p>', '{"subject": "Тема", "html": "<p>Привет</p>"}']
+    assert json.loads(result['choices'][0]['message']['content']) == {'subject': 'Тема', 'html': '<p>Привет</p>'}
+    assert result['usage'] == {'total_tokens': 42}
+    assert 'stream' not in payload
+    
+    server.shutdown()
+    print('✅ test_stream_assembles_deltas passed')
+
+if __name__ == '__main__':
+    print('Running LLM client tests...\n')
+    
+    test_token_bucket_wait_time()
+    test_retry_after_is_honoured()
+    test_no_retry_past_deadline()
+    test_stream_assembles_deltas()
+    
+    print('\n✅ All tests passed!')
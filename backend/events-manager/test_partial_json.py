@@ -0,0 +1,47 @@
+'''
+Unit tests for incremental reading of a streamed JSON envelope
+'''
+
+import json
+
+from partial_json import partial_string_fields
+
+def test_fields_grow_with_every_prefix():
+    '''Test every prefix of the envelope yields a prefix of the final field values'''
+    
+    envelope = '```json\n' + json.dumps({
+        'subject': 'Тема "письма"',
+        'html': '<div class="hero">\n  <p>Привет, «мир»</p>\n</div>'
+    }, ensure_ascii=True) + '\n```'
+    final = {'subject': 'Тема "письма"', 'html': '<div class="hero">\n  <p>Привет, «мир»</p>\n</div>'}
+    
+    for end in range(len(envelope) + 1):
+        fields = partial_string_fields(envelope[:end], ('subject', 'html'))
+        
+        for key, (value, complete) in fields.items():
+            assert final[key].startswith(value), (end, key, value)
+            assert complete == (json.dumps(final[key], ensure_ascii=True) in envelope[:end])
+    
+    fields = partial_string_fields(envelope, ('subject', 'html'))
+    assert fields == {'subject': (final['subject'], True), 'html': (final['html'], True)}
+    
+    print('✅ test_fields_grow_with_every_prefix passed')
+
+def test_missing_and_escaped_keys():
+    '''Test a key that has not started is absent and quoted key names inside values are not matched'''
+    
+    text = '{"subject": "Про \\"html\\": \\"x\\"", "ht'
+    
+    fields = partial_string_fields(text, ('subject', 'html'))
+    
+    assert fields == {'subject': ('Про "html": "x"', True)}
+    
+    print('✅ test_missing_and_escaped_keys passed')
+
+if __name__ == '__main__':
+    print('Running partial JSON tests...\n')
+    
+    test_fields_grow_with_every_prefix()
+    test_missing_and_escaped_keys()
+    
+    print('\n✅ All tests passed!')
@@ -0,0 +1,379 @@
+'''
+Unit tests for RAG retrieval (no DB / network)
+'''
+
+import os
+import random
+import numpy as np
+from ann_index import IVFIndex, recall_at_k
+from dim_reduction import ReducedIndex, get_reduced_index
+from embedding_providers import EmbeddingProvider, HashingEmbeddingProvider, get_embedding_provider
+from embedding_models import embedding_model_name
+from lexical_index import BM25Index, tokenize
+from query_embedding_cache import QueryEmbeddingCache
+import rag_module
+from rag_module import mmr_rerank, get_embeddings, pack_embedding, decode_embedding_rows, score_items_hybrid, score_items_lexical, build_embedding_matrix, score_items_exact, score_items_vectorized, EmbeddingMatrixCache, split_embedding_batches, text_hash, diff_knowledge_rows, server_knn_enabled
+
+def make_items(count: int, dim: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [
+        {
+            'id': i + 1,
+            'content': f'item {i}',
+            'metadata': {'title': f'Session {i}'},
+            'embedding': [rng.uniform(-1, 1) for _ in range(dim)]
+        }
+        for i in range(count)
+    ]
+
+def test_vectorized_matches_exact():
+    '''Test vectorized top-k returns the same ranking as the reference scorer'''
+    
+    items = make_items(200, 64)
+    matrix = build_embedding_matrix([item['embedding'] for item in items])
+    query = make_items(1, 64, seed=99)[0]['embedding']
+    
+    exact = score_items_exact(query, items, 'program_item', top_k=6)
+    fast = score_items_vectorized(query, items, matrix, 'program_item', top_k=6)
+    
+    assert [r['id'] for r in fast] == [r['id'] for r in exact]
+    for a, b in zip(fast, exact):
+        assert abs(a['score'] - b['score']) < 1e-5
+        assert a['type'] == 'program_item'
+    
+    print('✅ test_vectorized_matches_exact passed')
+
+def test_vectorized_top_k_larger_than_corpus():
+    '''Test top_k above corpus size and zero vectors'''
+    
+    items = make_items(3, 8)
+    items[1]['embedding'] = [0.0] * 8
+    matrix = build_embedding_matrix([item['embedding'] for item in items])
+    
+    result = score_items_vectorized(items[0]['embedding'], items, matrix, 'pain_point', top_k=10)
+    
+    assert len(result) == 3
+    assert result[0]['id'] == 1
+    assert abs(result[0]['score'] - 1.0) < 1e-5
+    assert any(r['id'] == 2 and r['score'] == 0.0 for r in result)
+    
+    print('✅ test_vectorized_top_k_larger_than_corpus passed')
+
+def test_matrix_cache_lru_by_bytes():
+    '''Test matrix cache evicts least recently used entries by byte budget'''
+    
+    items = make_items(4, 16)
+    matrix = build_embedding_matrix([item['embedding'] for item in items])
+    entry_size = matrix.nbytes + sum(len(item['content']) for item in items)
+    
+    cache = EmbeddingMatrixCache(max_bytes=entry_size * 2)
+    cache.put((1, 'program_item', 1), items, matrix)
+    cache.put((2, 'program_item', 1), items, matrix)
+    
+    assert cache.get((1, 'program_item', 1)) is not None
+    
+    cache.put((3, 'program_item', 1), items, matrix)
+    
+    assert cache.get((2, 'program_item', 1)) is None
+    assert cache.get((1, 'program_item', 1)) is not None
+    assert cache.current_bytes == entry_size * 2
+    
+    cache.invalidate(1)
+    
+    assert cache.get((1, 'program_item', 1)) is None
+    assert cache.get((3, 'program_item', 1)) is not None
+    
+    print('✅ test_matrix_cache_lru_by_bytes passed')
+
+def test_embedding_batches_respect_size_and_tokens():
+    '''Test embedding batches are capped by input count and estimated tokens'''
+    
+    texts = ['x' * 30] * 500
+    batches = split_embedding_batches(texts, batch_size=128, max_tokens=100000)
+    
+    assert len(batches) == 4
+    assert sum(len(b) for b in batches) == 500
+    assert [i for b in batches for i in b] == list(range(500))
+    
+    token_capped = split_embedding_batches(['y' * 300] * 10, batch_size=128, max_tokens=250)
+    assert [len(b) for b in token_capped] == [2, 2, 2, 2, 2]
+    
+    print('✅ test_embedding_batches_respect_size_and_tokens passed')
+
+def test_text_hash_normalization():
+    '''Test embedding cache key ignores whitespace differences only'''
+    
+    assert text_hash('  Иван Петров |  HR-аналитика\n') == text_hash('Иван Петров | HR-аналитика')
+    assert text_hash('Иван Петров') != text_hash('иван петров')
+    assert len(text_hash('x')) == 64
+    
+    print('✅ test_text_hash_normalization passed')
+
+def test_diff_knowledge_rows():
+    '''Test diff re-indexing keeps unchanged rows and finds new/vanished ones'''
+    
+    existing = [
+        {'id': 10, 'content': 'Keynote | Anna', 'content_hash': text_hash('Keynote | Anna'), 'metadata': {}},
+        {'id': 11, 'content': 'Old session | Boris', 'content_hash': None, 'metadata': {}},
+        {'id': 12, 'content': 'Panel | Vera', 'content_hash': None, 'metadata': {}},
+        {'id': 13, 'content': 'Panel |  Vera', 'content_hash': None, 'metadata': {}}
+    ]
+    entries = [
+        ('Keynote | Anna', {'time': '10:00'}),
+        ('Panel | Vera', {}),
+        ('New workshop | Gleb', {}),
+        ('New workshop | Gleb', {})
+    ]
+    
+    diff = diff_knowledge_rows(existing, entries)
+    
+    assert {row['id'] for row in diff['kept'].values()} == {10, 12}
+    assert sorted(diff['stale_ids']) == [11, 13]
+    assert diff['new_hashes'] == [text_hash('New workshop | Gleb')]
+    assert len(diff['desired']) == 3
+    
+    print('✅ test_diff_knowledge_rows passed')
+
+def make_clustered_matrix(rows: int, dim: int, clusters: int, seed: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    matrix = centers[rng.integers(clusters, size=rows)] + 0.3 * rng.normal(size=(rows, dim))
+    return build_embedding_matrix(matrix.tolist())
+
+def test_ivf_recall_against_exact():
+    '''Test IVF ANN search keeps recall@10 close to exact search'''
+    
+    matrix = make_clustered_matrix(3000, 64, 40)
+    index = IVFIndex.build(matrix)
+    
+    recall = recall_at_k(matrix, index, matrix[:50], top_k=10, nprobe=8)
+    assert recall >= 0.9
+    
+    items = [{'id': i, 'content': '', 'metadata': {}} for i in range(matrix.shape[0])]
+    query = matrix[7].tolist()
+    approx = score_items_vectorized(query, items, matrix, 'program_item', top_k=5, ann_index=index)
+    exact = score_items_vectorized(query, items, matrix, 'program_item', top_k=5)
+    
+    assert approx[0]['id'] == 7
+    assert [r['score'] for r in approx] == sorted([r['score'] for r in approx], reverse=True)
+    assert len({r['id'] for r in approx} & {r['id'] for r in exact}) >= 4
+    
+    print('✅ test_ivf_recall_against_exact passed')
+
+def test_query_embedding_cache_lru_ttl():
+    '''Test query embedding cache LRU eviction, TTL expiry and counters'''
+    
+    cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=3600)
+    cache.put(('m', 'professional'), [1.0])
+    cache.put(('m', 'friendly'), [2.0])
+    
+    assert cache.get(('m', 'professional')) == [1.0]
+    
+    cache.put(('m', 'formal'), [3.0])
+    
+    assert cache.get(('m', 'friendly')) is None
+    assert cache.get(('m', 'formal')) == [3.0]
+    
+    expired = QueryEmbeddingCache(max_entries=2, ttl_seconds=-1)
+    expired.put(('m', 'professional'), [1.0])
+    assert expired.get(('m', 'professional')) is None
+    
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1 and stats['size'] == 2
+    
+    print('✅ test_query_embedding_cache_lru_ttl passed')
+
+def test_bm25_stemming_and_ranking():
+    '''Test Russian inflections share a stem and BM25 ranks the exact term first'''
+    
+    assert tokenize('Аналитика данных') == tokenize('аналитики данными')
+    
+    docs = [
+        'Доклад про маркетинг и продажи',
+        'Воркшоп: аналитика данных в ClickHouse',
+        'Панельная дискуссия о найме',
+    ]
+    index = BM25Index(docs)
+    
+    indices, scores = index.search('clickhouse аналитикой', top_k=3)
+    assert indices.tolist() == [1]
+    assert scores[0] > 0
+    
+    empty, _ = index.search('блокчейн', top_k=3)
+    assert empty.shape[0] == 0
+    
+    print('✅ test_bm25_stemming_and_ranking passed')
+
+def test_hybrid_surfaces_lexical_match():
+    '''Test hybrid fusion keeps vector hits and adds exact-name matches missed by embeddings'''
+    
+    items = make_items(50, 32)
+    items[37]['content'] = 'Мастер-класс Ивана Петрова по Kubernetes'
+    matrix = build_embedding_matrix([item['embedding'] for item in items])
+    query = items[3]['embedding']
+    index = BM25Index([item['content'] for item in items])
+    
+    vector = score_items_vectorized(query, items, matrix, 'program_item', top_k=3)
+    hybrid = score_items_hybrid('Kubernetes Петров', query, items, matrix, index, 'program_item', top_k=3)
+    
+    assert vector[0]['id'] == 4 and hybrid[0]['id'] in (4, 38)
+    assert 38 in [r['id'] for r in hybrid]
+    assert 38 not in [r['id'] for r in vector]
+    
+    lexical = score_items_lexical('kubernetes', items, index, 'program_item', top_k=3)
+    assert [r['id'] for r in lexical] == [38] and lexical[0]['score'] == 1.0
+    
+    print('✅ test_hybrid_surfaces_lexical_match passed')
+
+def test_packed_embeddings_roundtrip():
+    '''Test i8/f16 packing is compact, decodes with frombuffer and keeps the ranking'''
+    
+    items = make_items(300, 128)
+    exact_matrix = build_embedding_matrix([item['embedding'] for item in items])
+    query = make_items(1, 128, seed=5)[0]['embedding']
+    exact = [r['id'] for r in score_items_vectorized(query, items, exact_matrix, 'program_item', top_k=10)]
+    
+    for codec, size in (('i8', 4 + 128), ('f16', 2 * 128)):
+        rows = [
+            {'embedding_packed': pack_embedding(item['embedding'], codec), 'embedding_codec': codec, 'embedding': None}
+            for item in items
+        ]
+        assert len(rows[0]['embedding_packed']) == size
+        
+        rows[0] = {'embedding_packed': None, 'embedding_codec': None, 'embedding': items[0]['embedding']}
+        matrix = build_embedding_matrix(decode_embedding_rows(rows))
+        
+        assert matrix.shape == exact_matrix.shape
+        assert np.abs(matrix - exact_matrix).max() < 0.02
+        
+        packed = [r['id'] for r in score_items_vectorized(query, items, matrix, 'program_item', top_k=10)]
+        assert len(set(packed) & set(exact)) >= 9
+    
+    print('✅ test_packed_embeddings_roundtrip passed')
+
+def test_local_hashing_provider_retrieval():
+    '''Test the offline provider is deterministic and ranks the related text first'''
+    
+    provider = get_embedding_provider(name='local')
+    assert isinstance(provider, HashingEmbeddingProvider)
+    assert provider.model == f'local-hash-ngram-{provider.dim}' and not provider.requires_api_key
+    
+    texts = [
+        'Доклад: найм и удержание ИТ-специалистов',
+        'Воркшоп по аналитике данных в ClickHouse',
+        'Кофе-брейк и нетворкинг',
+    ]
+    vectors = get_embeddings(texts, api_key=None, batch_size=2, provider=provider)
+    assert vectors == provider.embed(texts)
+    assert abs(np.linalg.norm(vectors[0]) - 1.0) < 1e-6
+    
+    items = [{'id': i + 1, 'content': text, 'metadata': {}} for i, text in enumerate(texts)]
+    matrix = build_embedding_matrix(vectors)
+    query = provider.embed(['аналитика данных'])[0]
+    
+    results = score_items_vectorized(query, items, matrix, 'program_item', top_k=1)
+    assert results[0]['id'] == 2
+    
+    print('✅ test_local_hashing_provider_retrieval passed')
+
+def test_provider_model_names():
+    '''Test every provider stores its own model tag and unknown providers fail loudly'''
+    
+    assert embedding_model_name('openai') == 'text-embedding-3-small'
+    assert embedding_model_name('local') == get_embedding_provider(name='local').model
+    assert embedding_model_name('sentence-transformers') == get_embedding_provider(name='sentence-transformers').model
+    assert embedding_model_name('sentence-transformers').startswith('st:')
+    
+    for call in (lambda: embedding_model_name('bert'), lambda: get_embedding_provider(name='bert'), lambda: EmbeddingProvider()):
+        try:
+            call()
+            assert False, 'expected an error'
+        except (ValueError, TypeError):
+            pass
+    
+    print('✅ test_provider_model_names passed')
+
+def test_mmr_rerank_skips_near_duplicates():
+    '''Test MMR keeps the best hit but replaces near-duplicates with distinct rows'''
+    
+    rng = np.random.default_rng(11)
+    base = rng.normal(size=32)
+    other = rng.normal(size=32)
+    query = base + 0.3 * other
+    
+    embeddings = [base + 0.01 * rng.normal(size=32) for _ in range(4)] + [other, rng.normal(size=32)]
+    items = [{'id': i + 1, 'content': f'row {i}', 'metadata': {}} for i in range(len(embeddings))]
+    matrix = build_embedding_matrix(embeddings)
+    
+    candidates = score_items_vectorized(query, items, matrix, 'program_item', top_k=6)
+    assert {r['id'] for r in candidates[:3]} <= {1, 2, 3, 4}
+    
+    diverse = mmr_rerank(candidates, items, matrix, top_k=3, lambda_=0.5)
+    ids = [r['id'] for r in diverse]
+    
+    assert ids[0] == candidates[0]['id']
+    assert 5 in ids
+    assert len([i for i in ids if i <= 4]) < 3
+    assert mmr_rerank(candidates, items, matrix, top_k=3, lambda_=1.0) == candidates[:3]
+    
+    print('✅ test_mmr_rerank_skips_near_duplicates passed')
+
+def test_reduced_index_rerank_recall():
+    '''Test truncated / PCA first stage with full-vector rerank stays close to exact search'''
+    
+    matrix = make_clustered_matrix(3000, 128, 40)
+    
+    for method in ('truncate', 'pca'):
+        index = ReducedIndex.build(matrix, 64, method)
+        assert index.reduced.shape == (3000, 64)
+        assert recall_at_k(matrix, index, matrix[:50], top_k=10) >= 0.9
+    
+    items = [{'id': i, 'content': '', 'metadata': {}} for i in range(matrix.shape[0])]
+    approx = score_items_vectorized(matrix[7].tolist(), items, matrix, 'program_item', top_k=5, ann_index=index)
+    exact = score_items_vectorized(matrix[7].tolist(), items, matrix, 'program_item', top_k=5)
+    
+    assert approx[0]['id'] == 7
+    assert [r['score'] for r in approx] == sorted([r['score'] for r in approx], reverse=True)
+    assert len({r['id'] for r in approx} & {r['id'] for r in exact}) >= 4
+    
+    assert get_reduced_index((1, 'program_item', 1), matrix, dim=0) is None
+    assert get_reduced_index((1, 'program_item', 1), matrix, dim=128) is None
+    assert get_reduced_index((1, 'program_item', 1), matrix, dim=32) is get_reduced_index((1, 'program_item', 1), matrix, dim=32)
+    
+    print('✅ test_reduced_index_rerank_recall passed')
+
+def test_default_retrieval_is_in_process_vector():
+    '''Test hybrid and server KNN are opt-in: the default path is in-process vector search'''
+    
+    if 'RAG_RETRIEVAL_MODE' in os.environ or 'RAG_SERVER_KNN' in os.environ:
+        print('⏭️ test_default_retrieval_is_in_process_vector skipped: retrieval env overridden')
+        return
+    
+    assert rag_module.RAG_RETRIEVAL_MODE == 'vector'
+    assert rag_module.RAG_SERVER_KNN == 'off'
+    # 'off' answers before probing the database
+    assert server_knn_enabled(None) is False
+    
+    print('✅ test_default_retrieval_is_in_process_vector passed')
+
+if __name__ == '__main__':
+    print('Running RAG Module Tests...\n')
+    
+    test_vectorized_matches_exact()
+    test_vectorized_top_k_larger_than_corpus()
+    test_matrix_cache_lru_by_bytes()
+    test_embedding_batches_respect_size_and_tokens()
+    test_text_hash_normalization()
+    test_diff_knowledge_rows()
+    test_ivf_recall_against_exact()
+    test_query_embedding_cache_lru_ttl()
+    test_bm25_stemming_and_ranking()
+    test_hybrid_surfaces_lexical_match()
+    test_default_retrieval_is_in_process_vector()
+    test_packed_embeddings_roundtrip()
+    test_local_hashing_provider_retrieval()
+    test_provider_model_names()
+    test_mmr_rerank_skips_near_duplicates()
+    test_reduced_index_rerank_recall()
+    
+    print('\n✅ All tests passed!')
@@ -3,10 +3,14 @@ Unit tests for V2 email generation pipeline
 '''
 
 import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from utm_utils import normalize_utm_params, map_cta_to_url, replace_cta_placeholders, validate_url
 from template_assembler import assemble_html_from_slots, qa_validate_email
 from jsonschema import validate, ValidationError
-from v2_generation import PASS1_SCHEMA
+from v2_generation import PASS1_SCHEMA, generate_pass1_plans_batch, parse_pass1_batch
+from v2_pipeline import run_stage_pipeline, stage_timing_report, v2_batch_stages
 
 def test_utm_normalization():
     '''Test UTM parameter normalization'''
@@ -223,6 +227,236 @@ def test_url_validation():
     
     print('✅ test_url_validation passed')
 
+def make_plan(subject):
+    return {
+        'subject_variants': [subject, subject + '!'],
+        'preheader': 'Preheader',
+        'angle': 'Angle',
+        'selected_program_items': [{'title': 'Workshop', 'speaker': 'John Doe'}],
+        'pain_to_benefit': [{'pain': 'Problem', 'benefit': 'Solution'}],
+        'ctas': [{'id': 'register'}]
+    }
+
+def test_pass1_batch_parsing():
+    '''Test batch items are validated one by one against PASS1_SCHEMA'''
+    
+    broken = make_plan('B')
+    del broken['angle']
+    response = '```json\n' + json.dumps({'plans': [
+        {'index': 2, **make_plan('C')},
+        {'index': 0, **make_plan('A')},
+        {'index': 1, **broken}
+    ]}) + '\n```'
+    
+    plans, errors = parse_pass1_batch(response, 4)
+    
+    assert plans[0]['subject_variants'][0] == 'A' and 'index' not in plans[0]
+    assert plans[2]['subject_variants'][0] == 'C'
+    assert plans[1] is None and 'angle' in errors[1]
+    assert plans[3] is None and errors[3] == 'missing in batch response'
+    
+    plans, errors = parse_pass1_batch('not json', 2)
+    assert plans == [None, None] and all('parse error' in error for error in errors)
+    
+    print('✅ test_pass1_batch_parsing passed')
+
+class PlannerHandler(BaseHTTPRequestHandler):
+    '''Batch call: a valid plan for row 0 and an invalid one for row 1; single calls: a valid plan'''
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    prompts = []
+    
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = request['messages'][-1]['content']
+        PlannerHandler.prompts.append(prompt)
+        
+        if 'ЗАДАНИЯ НА ПИСЬМА' in prompt:
+            content = json.dumps({'plans': [{'index': 0, **make_plan('Batch 0')}, {'index': 1, 'subject_variants': ['only one']}]})
+        else:
+            content = json.dumps(make_plan('Single'))
+        
+        body = json.dumps({'choices': [{'message': {'content': content}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+def test_pass1_batch_fallback():
+    '''Test one batch call plans all rows and only the invalid row is re-planned alone'''
+    
+    PlannerHandler.prompts = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PlannerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+    
+    results = generate_pass1_plans_batch(
+        event_context={'name': 'Test Event', 'date': '2026-01-01', 'venue': ''},
+        rag_context={'program_items': [], 'pain_points': [], 'style_snippets': []},
+        allowed_ctas=[{'id': 'register', 'label': 'Register'}],
+        items=[{'title': 'Batch fallback row A', 'segment': ''}, {'title': 'Batch fallback row B', 'segment': 'HR'}],
+        language='ru-RU',
+        tone='professional',
+        model='test-batch-planner',
+        api_key='key',
+        api_url=api_url
+    )
+    
+    assert [plan['subject_variants'][0] for plan, _ in results] == ['Batch 0', 'Single']
+    assert all(error is None for _, error in results)
+    assert len(PlannerHandler.prompts) == 2
+    assert 'Batch fallback row B' in PlannerHandler.prompts[1] and 'Batch fallback row A' not in PlannerHandler.prompts[1]
+    
+    server.shutdown()
+    print('✅ test_pass1_batch_fallback passed')
+
+def make_planned_job(content_plan_id, event_id, program_title):
+    return {
+        'content_plan_id': content_plan_id,
+        'event_id': event_id,
+        'content_type_id': 1,
+        'title': f'Pipeline planning row {content_plan_id}',
+        'segment': '',
+        'language': 'ru-RU',
+        'tone': 'professional',
+        'ai_model': 'test-pipeline-planner',
+        'event_context': {'name': 'Test Event', 'date': '2026-01-01', 'venue': ''},
+        'allowed_ctas': [{'id': 'register', 'label': 'Register'}],
+        'rag_context': {
+            'program_items': [{'id': content_plan_id, 'content': '', 'metadata': {'title': program_title, 'speaker': 'Speaker'}, 'score': 0.9}],
+            'pain_points': [],
+            'style_snippets': []
+        },
+        'template_row': {'html_layout': '', 'slots_schema': {}},
+        'error': None,
+        'timings': {}
+    }
+
+def test_batch_pipeline_plans_pass1_in_batches():
+    '''Test generate_emails_v2_batch stages plan rows of one event in one Pass1 call and re-plan a broken row alone with its own retrieval'''
+    
+    PlannerHandler.prompts = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PlannerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+    
+    jobs = [make_planned_job(0, 1, 'Program A'), make_planned_job(1, 1, 'Program B'), make_planned_job(2, 2, 'Program C')]
+    stages, first_stage_batch = v2_batch_stages('key', api_url)
+    done = list(run_stage_pipeline(jobs, stages[:1], first_stage_batch))
+    
+    assert [job['content_plan_id'] for job in done] == [0, 1, 2]
+    assert [job['pass1_data']['subject_variants'][0] for job in done] == ['Batch 0', 'Single', 'Single']
+    assert all(job['error'] is None and 'pass1' in job['timings'] for job in done)
+    
+    batch_prompts = [prompt for prompt in PlannerHandler.prompts if 'ЗАДАНИЯ НА ПИСЬМА' in prompt]
+    single_prompts = [prompt for prompt in PlannerHandler.prompts if 'ЗАДАНИЯ НА ПИСЬМА' not in prompt]
+    assert len(batch_prompts) == 1 and len(single_prompts) == 2
+    assert 'Pipeline planning row 0' in batch_prompts[0] and 'Pipeline planning row 1' in batch_prompts[0]
+    assert 'Program A' in batch_prompts[0] and 'Program B' in batch_prompts[0] and 'Program C' not in batch_prompts[0]
+    
+    fallback = next(prompt for prompt in single_prompts if 'Pipeline planning row 1' in prompt)
+    assert 'Program B' in fallback and 'Program A' not in fallback
+    
+    server.shutdown()
+    print('✅ test_batch_pipeline_plans_pass1_in_batches passed')
+
+def test_stage_pipeline_overlaps_and_keeps_order():
+    '''Test stages of different jobs overlap, jobs come back in order and a failed stage skips the rest'''
+    
+    events = []
+    lock = threading.Lock()
+    
+    def stage(name, seconds):
+        def run(job):
+            with lock:
+                events.append((name, job['id'], 'start', time.monotonic()))
+            if name == 'pass1' and job['id'] == 2:
+                raise ValueError('bad plan')
+            time.sleep(seconds)
+            with lock:
+                events.append((name, job['id'], 'end', time.monotonic()))
+            return job
+        return run
+    
+    jobs = [{'id': i, 'error': None, 'timings': {}} for i in range(6)]
+    started = time.monotonic()
+    done = list(run_stage_pipeline(jobs, [('pass1', stage('pass1', 0.05), 1), ('pass2', stage('pass2', 0.05), 1)]))
+    wall_clock = time.monotonic() - started
+    
+    assert [job['id'] for job in done] == list(range(6))
+    assert done[2]['error'] == 'pass1 failed: bad plan'
+    assert 'pass2' not in done[2]['timings']
+    assert not any(name == 'pass2' and job_id == 2 for name, job_id, _, _ in events)
+    
+    at = {(name, job_id, kind): moment for name, job_id, kind, moment in events}
+    assert at[('pass1', 1, 'start')] < at[('pass2', 0, 'end')]
+    
+    report = stage_timing_report(done, wall_clock)
+    assert report['emails'] == 6 and report['stages']['pass2']['jobs'] == 5
+    assert report['wall_clock_seconds'] < report['sequential_seconds']
+    
+    print('✅ test_stage_pipeline_overlaps_and_keeps_order passed')
+
+def test_stage_pipeline_prepares_jobs_on_calling_thread():
+    '''Test a job generator runs on the calling thread (where the DB connection lives) while pool threads run the stages of earlier jobs'''
+    
+    caller = threading.get_ident()
+    prepared = {}
+    stage_threads = set()
+    pass1_started = {}
+    
+    def prepare():
+        for i in range(3):
+            time.sleep(0.05)
+            prepared[i] = (threading.get_ident(), time.monotonic())
+            yield {'id': i, 'error': None, 'timings': {}}
+    
+    def pass1(job):
+        stage_threads.add(threading.get_ident())
+        pass1_started[job['id']] = time.monotonic()
+        time.sleep(0.05)
+        return job
+    
+    done = list(run_stage_pipeline(prepare(), [('pass1', pass1, 1)]))
+    
+    assert [job['id'] for job in done] == [0, 1, 2]
+    assert {thread for thread, _ in prepared.values()} == {caller}
+    assert caller not in stage_threads
+    assert pass1_started[0] < prepared[1][1]
+    
+    print('✅ test_stage_pipeline_prepares_jobs_on_calling_thread passed')
+
+def test_stage_pipeline_bounds_jobs_ahead():
+    '''Test max_ahead stops taking jobs from the generator until earlier jobs have been yielded, also with a partly filled batch'''
+    
+    prepared = []
+    
+    def prepare():
+        for i in range(7):
+            prepared.append(i)
+            yield {'id': i, 'group': i // 4, 'error': None, 'timings': {}}
+    
+    ahead = []
+    batches = []
+    
+    def pass1(jobs):
+        batches.append([job['id'] for job in jobs])
+        return jobs
+    
+    for count, job in enumerate(run_stage_pipeline(prepare(), [('pass1', pass1, 2)], (3, lambda job: job['group']), max_ahead=2), 1):
+        assert job['id'] == count - 1
+        ahead.append(len(prepared) - count)
+    
+    assert max(ahead) <= 1
+    assert sorted(sum(batches, [])) == list(range(7))
+    
+    print('✅ test_stage_pipeline_bounds_jobs_ahead passed')
+
 if __name__ == '__main__':
     print('Running V2 Pipeline Tests...\n')
     
@@ -235,5 +469,11 @@ if __name__ == '__main__':
     test_qa_validation_fail()
     test_pass1_schema_validation()
     test_url_validation()
+    test_pass1_batch_parsing()
+    test_pass1_batch_fallback()
+    test_batch_pipeline_plans_pass1_in_batches()
+    test_stage_pipeline_overlaps_and_keeps_order()
+    test_stage_pipeline_prepares_jobs_on_calling_thread()
+    test_stage_pipeline_bounds_jobs_ahead()
     
     print('\n✅ All tests passed!')
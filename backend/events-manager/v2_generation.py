@@ -4,10 +4,11 @@ V2 Email Generation Pipeline: Two-pass generation (Plan → Slots)
 
 import json
 import os
-import urllib.request
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from jsonschema import validate, ValidationError
 
+from llm_cache import cached_chat_completion
+
 PASS1_SCHEMA = {
     "type": "object",
     "required": ["subject_variants", "preheader", "angle", "selected_program_items", "pain_to_benefit", "ctas"],
@@ -55,16 +56,24 @@ PASS1_SCHEMA = {
     }
 }
 
+PASS1_BATCH_SIZE = int(os.environ.get('PASS1_BATCH_SIZE', '5'))
+PASS1_BATCH_MAX_TOKENS = int(os.environ.get('PASS1_BATCH_MAX_TOKENS', '8000'))
+
 def call_ai_model(
     messages: List[Dict[str, str]],
     model: str,
     api_key: str,
     api_url: str,
     temperature: float = 0.5,
-    max_tokens: int = 2000
+    max_tokens: int = 2000,
+    conn=None,
+    force_fresh: bool = False,
+    validate_content: Optional[Callable[[str], Any]] = None
 ) -> str:
     '''
-    Call OpenAI/OpenRouter API
+    Call OpenAI/OpenRouter API through the LLM response cache
+    (conn enables the Postgres tier, force_fresh bypasses the lookup);
+    only content that validate_content accepts is cached
     '''
     
     payload = {
@@ -74,18 +83,11 @@ def call_ai_model(
         'max_tokens': max_tokens
     }
     
-    req = urllib.request.Request(
-        api_url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
+    result = cached_chat_completion(
+        conn, api_url, api_key, payload, timeout=60, force_fresh=force_fresh,
+        validate=(lambda response: validate_content(response['choices'][0]['message']['content'])) if validate_content else None
     )
-    
-    with urllib.request.urlopen(req, timeout=60) as response:
-        result = json.loads(response.read().decode('utf-8'))
-        return result['choices'][0]['message']['content']
+    return result['choices'][0]['message']['content']
 
 def clean_json_response(content: str) -> str:
     '''
@@ -103,23 +105,12 @@ def clean_json_response(content: str) -> str:
     
     return content.strip()
 
-def generate_pass1_plan(
-    event_context: Dict[str, Any],
-    rag_context: Dict[str, Any],
-    allowed_ctas: List[Dict[str, str]],
-    title: str,
-    segment: str,
-    language: str,
-    tone: str,
-    model: str,
-    api_key: str,
-    api_url: str
-) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+def pass1_context_texts(rag_context: Dict[str, Any], allowed_ctas: List[Dict[str, str]]) -> Tuple[str, str, str, str]:
     '''
-    Pass 1: Generate email plan (subject variants, angle, content selection)
+    Program, pain point, style and CTA lists of the Pass1 prompt
     
     Returns:
-        (pass1_json, error_message)
+        (program_items_text, pain_points_text, style_snippets_text, ctas_text)
     '''
     
     program_items_text = '\n'.join([
@@ -142,6 +133,37 @@ def generate_pass1_plan(
         for cta in allowed_ctas
     ])
     
+    return program_items_text, pain_points_text, style_snippets_text, ctas_text
+
+def pass1_system_prompt(tone: str) -> str:
+    return f'''Ты — профессиональный email-маркетолог. Пиши кратко, по делу, без дутого маркетинга.
+Стиль общения: {tone}.
+Всегда возвращай валидный JSON строго по предоставленной JSON-схеме.
+Никогда не возвращай HTML.'''
+
+def generate_pass1_plan(
+    event_context: Dict[str, Any],
+    rag_context: Dict[str, Any],
+    allowed_ctas: List[Dict[str, str]],
+    title: str,
+    segment: str,
+    language: str,
+    tone: str,
+    model: str,
+    api_key: str,
+    api_url: str,
+    conn=None,
+    force_fresh: bool = False
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    '''
+    Pass 1: Generate email plan (subject variants, angle, content selection)
+    
+    Returns:
+        (pass1_json, error_message)
+    '''
+    
+    program_items_text, pain_points_text, style_snippets_text, ctas_text = pass1_context_texts(rag_context, allowed_ctas)
+    
     user_prompt = f'''Ты — профессиональный email-маркетолог. Создай план письма для рассылки.
 
 КОНТЕКСТ МЕРОПРИЯТИЯ:
@@ -180,13 +202,8 @@ def generate_pass1_plan(
 
 Верни ТОЛЬКО валидный JSON, без комментариев и дополнительного текста.'''
 
-    system_prompt = f'''Ты — профессиональный email-маркетолог. Пиши кратко, по делу, без дутого маркетинга.
-Стиль общения: {tone}.
-Всегда возвращай валидный JSON строго по предоставленной JSON-схеме.
-Никогда не возвращай HTML.'''
-    
     messages = [
-        {'role': 'system', 'content': system_prompt},
+        {'role': 'system', 'content': pass1_system_prompt(tone)},
         {'role': 'user', 'content': user_prompt}
     ]
     
@@ -200,13 +217,13 @@ def generate_pass1_plan(
                 api_key=api_key,
                 api_url=api_url,
                 temperature=0.5,
-                max_tokens=1500
+                max_tokens=1500,
+                conn=conn,
+                force_fresh=force_fresh,
+                validate_content=parse_pass1_response
             )
             
-            cleaned = clean_json_response(response)
-            pass1_data = json.loads(cleaned)
-            
-            validate(instance=pass1_data, schema=PASS1_SCHEMA)
+            pass1_data = parse_pass1_response(response)
             
             print(f'[PASS1] Success: {len(pass1_data["subject_variants"])} subjects, {len(pass1_data["ctas"])} CTAs')
             return pass1_data, None
@@ -229,6 +246,222 @@ def generate_pass1_plan(
     
     return None, 'Failed to generate valid Pass1 JSON after 2 attempts'
 
+def parse_pass1_response(response: str) -> Dict[str, Any]:
+    '''
+    Pass1 plan from the model response; JSONDecodeError / ValidationError when it is unusable
+    '''
+    
+    pass1_data = json.loads(clean_json_response(response))
+    validate(instance=pass1_data, schema=PASS1_SCHEMA)
+    return pass1_data
+
+def pass1_batch_schema(size: int) -> Dict[str, Any]:
+    '''
+    Batch response: {"plans": [PASS1_SCHEMA + "index"]}; items are validated one by one
+    against PASS1_SCHEMA, so one broken plan does not reject the others
+    '''
+    
+    item_schema = json.loads(json.dumps(PASS1_SCHEMA))
+    item_schema['required'] = ['index'] + item_schema['required']
+    item_schema['properties']['index'] = {'type': 'integer', 'minimum': 0, 'maximum': size - 1}
+    
+    return {
+        'type': 'object',
+        'required': ['plans'],
+        'properties': {
+            'plans': {'type': 'array', 'items': item_schema, 'minItems': size, 'maxItems': size}
+        }
+    }
+
+def parse_pass1_batch(response: str, size: int) -> Tuple[List[Optional[Dict[str, Any]]], List[Optional[str]]]:
+    '''
+    Split a batch response into per-item plans; an item that is missing, duplicated
+    or fails PASS1_SCHEMA is None with the reason in errors
+    
+    Returns:
+        (plans by item index, errors by item index)
+    '''
+    
+    plans = [None] * size
+    errors = ['missing in batch response'] * size
+    
+    try:
+        data = json.loads(clean_json_response(response))
+    except json.JSONDecodeError as e:
+        return plans, [f'batch JSON parse error: {e}'] * size
+    
+    items = data.get('plans') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return plans, ['batch response has no "plans" array'] * size
+    
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        
+        index = item.get('index')
+        if not isinstance(index, int) or not 0 <= index < size:
+            continue
+        
+        if plans[index] is not None:
+            plans[index] = None
+            errors[index] = 'duplicated index in batch response'
+            continue
+        
+        plan = {key: value for key, value in item.items() if key != 'index'}
+        try:
+            validate(instance=plan, schema=PASS1_SCHEMA)
+        except ValidationError as e:
+            errors[index] = f'schema validation error: {e.message}'
+            continue
+        
+        plans[index] = plan
+        errors[index] = None
+    
+    return plans, errors
+
+def generate_pass1_plans_batch(
+    event_context: Dict[str, Any],
+    rag_context: Dict[str, Any],
+    allowed_ctas: List[Dict[str, str]],
+    items: List[Dict[str, str]],
+    language: str,
+    tone: str,
+    model: str,
+    api_key: str,
+    api_url: str,
+    conn=None,
+    force_fresh: bool = False,
+    batch_size: int = PASS1_BATCH_SIZE
+) -> List[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    '''
+    Pass 1 for many content-plan rows: the shared event / RAG context is sent once per
+    batch of up to batch_size rows and the model returns one plan per row. Rows whose
+    plan is missing or fails PASS1_SCHEMA fall back to generate_pass1_plan() one by one.
+    
+    Args:
+        items: [{'title': ..., 'segment': ..., 'rag_context'?: ...}] in content-plan order;
+               a row's own rag_context is used when it is planned separately
+        rag_context: retrieval shared by the rows (e.g. merged over all titles)
+    
+    Returns:
+        [(pass1_json, error_message)] in the order of items
+    '''
+    
+    program_items_text, pain_points_text, style_snippets_text, ctas_text = pass1_context_texts(rag_context, allowed_ctas)
+    results = []
+    
+    for start in range(0, len(items), max(1, batch_size)):
+        chunk = items[start:start + max(1, batch_size)]
+        
+        rows_text = '\n'.join(
+            f"{i}. Тема/заголовок: {item.get('title', '')} | Сегмент: {item.get('segment') or 'общая аудитория'}"
+            for i, item in enumerate(chunk)
+        )
+        
+        user_prompt = f'''Ты — профессиональный email-маркетолог. Создай планы писем для рассылки — по одному на каждое задание.
+
+КОНТЕКСТ МЕРОПРИЯТИЯ:
+Название: {event_context.get('name', '')}
+Дата: {event_context.get('date', '')}
+Место: {event_context.get('venue', '')}
+Тон общения: {tone}
+Локаль: {language}
+
+ЗАДАНИЯ НА ПИСЬМА ({len(chunk)} шт., номер = index):
+{rows_text}
+
+РЕЛЕВАНТНАЯ ПРОГРАММА:
+{program_items_text}
+
+БОЛИ ЦЕЛЕВОЙ АУДИТОРИИ:
+{pain_points_text}
+
+ПРИМЕРЫ СТИЛЯ:
+{style_snippets_text or 'Используй профессиональный email-маркетинг стиль'}
+
+ДОСТУПНЫЕ CTA (призывы к действию):
+{ctas_text}
+
+ЗАДАЧА для каждого задания:
+1. Придумай 2-4 варианта цепляющей темы письма (subject) — до 60 символов каждая
+2. Создай preheader (до 90 символов) — дополняет subject
+3. Определи angle (угол) письма — главную идею/месседж (до 240 символов)
+4. Выбери 2-4 пункта программы, наиболее релевантных именно этому заданию
+5. Подбери 1-3 пары "боль → выгода" из аудитории
+6. Выбери 1-2 CTA по id из списка доступных (обязательно используй только id из списка!)
+Письма одной рассылки не должны повторять друг друга по темам и углу.
+
+ФОРМАТ ОТВЕТА (строго JSON по схеме, в plans ровно {len(chunk)} элементов, index — номер задания):
+{json.dumps(pass1_batch_schema(len(chunk)), ensure_ascii=False, indent=2)}
+
+Верни ТОЛЬКО валидный JSON, без комментариев и дополнительного текста.'''
+
+        messages = [
+            {'role': 'system', 'content': pass1_system_prompt(tone)},
+            {'role': 'user', 'content': user_prompt}
+        ]
+        
+        try:
+            print(f'[PASS1_BATCH] Planning rows {start}..{start + len(chunk) - 1}')
+            response = call_ai_model(
+                messages=messages,
+                model=model,
+                api_key=api_key,
+                api_url=api_url,
+                temperature=0.5,
+                max_tokens=min(PASS1_BATCH_MAX_TOKENS, 300 + 1200 * len(chunk)),
+                conn=conn,
+                force_fresh=force_fresh,
+                validate_content=lambda content: all(plan is not None for plan in parse_pass1_batch(content, len(chunk))[0])
+            )
+            plans, errors = parse_pass1_batch(response, len(chunk))
+        except Exception as e:
+            print(f'[PASS1_BATCH] Batch call failed: {e}')
+            plans, errors = [None] * len(chunk), [str(e)] * len(chunk)
+        
+        for item, plan, error in zip(chunk, plans, errors):
+            if plan is not None:
+                results.append((plan, None))
+                continue
+            
+            print(f'[PASS1_BATCH] "{item.get("title", "")}": {error}, planning it separately')
+            results.append(generate_pass1_plan(
+                event_context=event_context,
+                rag_context=item.get('rag_context') or rag_context,
+                allowed_ctas=allowed_ctas,
+                title=item.get('title', ''),
+                segment=item.get('segment', ''),
+                language=language,
+                tone=tone,
+                model=model,
+                api_key=api_key,
+                api_url=api_url,
+                conn=conn,
+                force_fresh=force_fresh
+            ))
+        
+        print(f'[PASS1_BATCH] {sum(plan is not None for plan in plans)}/{len(chunk)} plans from the batch call')
+    
+    return results
+
+def parse_pass2_response(response: str, slots_schema: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Pass2 slots from the model response; JSONDecodeError / ValidationError when
+    the JSON is broken or a required slot is missing
+    '''
+    
+    pass2_data = json.loads(clean_json_response(response))
+    
+    if 'slots' not in pass2_data:
+        raise ValidationError('Missing "slots" key in response')
+    
+    required_slots = slots_schema.get('required', [])
+    missing = [s for s in required_slots if s not in pass2_data['slots']]
+    if missing:
+        raise ValidationError(f'Missing required slots: {missing}')
+    
+    return pass2_data
+
 def generate_pass2_slots(
     pass1_data: Dict[str, Any],
     slots_schema: Dict[str, Any],
@@ -237,7 +470,9 @@ def generate_pass2_slots(
     language: str,
     model: str,
     api_key: str,
-    api_url: str
+    api_url: str,
+    conn=None,
+    force_fresh: bool = False
 ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     '''
     Pass 2: Generate slot texts based on Pass1 plan
@@ -323,19 +558,13 @@ Angle (главная идея): {pass1_data.get('angle', '')}
                 api_key=api_key,
                 api_url=api_url,
                 temperature=0.6,
-                max_tokens=2200
+                max_tokens=2200,
+                conn=conn,
+                force_fresh=force_fresh,
+                validate_content=lambda content: parse_pass2_response(content, slots_schema)
             )
             
-            cleaned = clean_json_response(response)
-            pass2_data = json.loads(cleaned)
-            
-            if 'slots' not in pass2_data:
-                raise ValidationError('Missing "slots" key in response')
-            
-            required_slots = slots_schema.get('required', [])
-            missing = [s for s in required_slots if s not in pass2_data['slots']]
-            if missing:
-                raise ValidationError(f'Missing required slots: {missing}')
+            pass2_data = parse_pass2_response(response, slots_schema)
             
             print(f'[PASS2] Success: {len(pass2_data["slots"])} slots filled')
             return pass2_data, None
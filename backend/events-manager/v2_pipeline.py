@@ -4,15 +4,23 @@ V2 Pipeline Orchestrator: Full workflow from content_plan to final HTML
 
 import json
 import os
-from typing import Dict, Any, List, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
 import psycopg2
 import psycopg2.extras
 
-from rag_module import search_knowledge
-from v2_generation import generate_pass1_plan, generate_pass2_slots
+from rag_module import search_knowledge_multi
+from v2_generation import PASS1_BATCH_SIZE, generate_pass1_plan, generate_pass1_plans_batch, generate_pass2_slots
 from utm_utils import normalize_utm_params, map_cta_to_url, replace_cta_placeholders
 from template_assembler import assemble_html_from_slots, generate_plain_text, qa_validate_email
 
+V2_PASS1_CONCURRENCY = int(os.environ.get('V2_PASS1_CONCURRENCY', '3'))
+V2_PASS2_CONCURRENCY = int(os.environ.get('V2_PASS2_CONCURRENCY', '3'))
+V2_MAX_AHEAD = int(os.environ.get('V2_MAX_AHEAD', '10'))
+
 def resolve_ai_model(
     content_plan_row: Optional[Dict[str, Any]],
     mailing_list_row: Optional[Dict[str, Any]],
@@ -58,34 +66,13 @@ def get_api_credentials() -> tuple:
     else:
         raise ValueError('No API key configured (OPENROUTER_API_KEY or OPENAI_API_KEY)')
 
-def generate_email_v2(
-    conn,
-    content_plan_id: int,
-    variant_index: int = 0
-) -> Dict[str, Any]:
+def load_job(cur, content_plan_id: int, variant_index: int = 0) -> Dict[str, Any]:
     '''
-    V2 Pipeline: Generate email from content_plan using two-pass generation
-    
-    Args:
-        conn: psycopg2 connection
-        content_plan_id: content_plan table ID
-        variant_index: A/B variant index (0 for first subject)
-    
-    Returns:
-        {
-            'success': bool,
-            'email_id': int or None,
-            'subject': str,
-            'html': str,
-            'plain_text': str,
-            'pass1_json': dict,
-            'pass2_json': dict,
-            'qa_report': dict,
-            'error': str or None
-        }
+    Content plan row with its event / mailing list and the resolved model and tone.
+    A missing row gives a job with 'error' set.
     '''
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    job = {'content_plan_id': content_plan_id, 'variant_index': variant_index, 'error': None, 'timings': {}}
     
     cur.execute('''
         SELECT cp.*, e.*, eml.utm_source, eml.utm_medium, eml.utm_campaign,
@@ -100,92 +87,192 @@ def generate_email_v2(
     row = cur.fetchone()
     
     if not row:
-        return {'success': False, 'error': f'Content plan {content_plan_id} not found'}
+        job['error'] = f'Content plan {content_plan_id} not found'
+        return job
     
-    event_id = row['event_id']
     list_id = row.get('list_id')
-    content_type_id = row.get('content_type_id')
     
-    title = row.get('title', '')
-    segment = row.get('segment', '')
-    language = row.get('language', 'ru-RU')
+    job.update({
+        'row': row,
+        'event_id': row['event_id'],
+        'list_id': list_id,
+        'content_type_id': row.get('content_type_id'),
+        'title': row.get('title', ''),
+        'segment': row.get('segment', ''),
+        'language': row.get('language', 'ru-RU'),
+        'ai_model': resolve_ai_model(row, row if list_id else None, row),
+        'tone': resolve_tone(row, row),
+        'event_context': {
+            'name': row.get('name', ''),
+            'date': str(row.get('start_date', '')) if row.get('start_date') else '',
+            'venue': ''
+        }
+    })
+    
+    return job
+
+def prefetch_job(conn, job: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+    '''
+    Everything the two passes read from the database: RAG context, content type CTAs
+    and the template. A missing template is recorded and reported after Pass1.
+    '''
     
-    ai_model = resolve_ai_model(row, row if list_id else None, row)
-    tone = resolve_tone(row, row)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
-    api_key, api_url, provider = get_api_credentials()
+    print(f'[V2] Starting generation for content_plan={job["content_plan_id"]}, model={job["ai_model"]}, tone={job["tone"]}')
     
-    print(f'[V2] Starting generation for content_plan={content_plan_id}, model={ai_model}, tone={tone}')
+    program_items, pain_points, style_snippets = search_knowledge_multi(conn, job['event_id'], [
+        (job['title'], 'program_item', 6),
+        (job['title'] + ' ' + job['segment'], 'pain_point', 4),
+        (job['tone'], 'style_snippet', 2)
+    ], api_key=api_key, mmr=True)
     
-    rag_context = {
-        'program_items': search_knowledge(conn, event_id, title, 'program_item', top_k=6, api_key=api_key),
-        'pain_points': search_knowledge(conn, event_id, title + ' ' + segment, 'pain_point', top_k=4, api_key=api_key),
-        'style_snippets': search_knowledge(conn, event_id, tone, 'style_snippet', top_k=2, api_key=api_key)
+    job['rag_context'] = {
+        'program_items': program_items,
+        'pain_points': pain_points,
+        'style_snippets': style_snippets
     }
     
-    print(f'[V2] RAG retrieved: {len(rag_context["program_items"])} programs, {len(rag_context["pain_points"])} pains, {len(rag_context["style_snippets"])} styles')
+    print(f'[V2] RAG retrieved: {len(program_items)} programs, {len(pain_points)} pains, {len(style_snippets)} styles')
     
     cur.execute('''
         SELECT allowed_ctas, default_cta_primary, default_cta_secondary
         FROM t_p22819116_event_schedule_app.content_types
         WHERE id = %s
-    ''', (content_type_id,))
+    ''', (job['content_type_id'],))
     
-    ct_row = cur.fetchone()
-    allowed_ctas = ct_row.get('allowed_ctas') if ct_row else []
-    if not allowed_ctas:
-        allowed_ctas = []
+    job['ct_row'] = cur.fetchone()
+    job['allowed_ctas'] = (job['ct_row'].get('allowed_ctas') if job['ct_row'] else None) or []
     
-    event_context = {
-        'name': row.get('name', ''),
-        'date': str(row.get('start_date', '')) if row.get('start_date') else '',
-        'venue': ''
-    }
+    cur.execute('''
+        SELECT html_layout, slots_schema
+        FROM t_p22819116_event_schedule_app.email_templates
+        WHERE event_id = %s AND content_type_id = %s
+        LIMIT 1
+    ''', (job['event_id'], job['content_type_id']))
+    
+    job['template_row'] = cur.fetchone()
     
+    return job
+
+def record_pass1(job: Dict[str, Any], pass1_data: Optional[Dict[str, Any]], pass1_error: Optional[str]) -> Dict[str, Any]:
+    if pass1_error:
+        job['error'] = f'Pass1 failed: {pass1_error}'
+    elif not job['template_row']:
+        job['error'] = f'No template found for event={job["event_id"]}, content_type={job["content_type_id"]}'
+    
+    job['pass1_data'] = pass1_data
+    return job
+
+def run_pass1(job: Dict[str, Any], api_key: str, api_url: str, conn=None, force_fresh: bool = False) -> Dict[str, Any]:
     pass1_data, pass1_error = generate_pass1_plan(
-        event_context=event_context,
-        rag_context=rag_context,
-        allowed_ctas=allowed_ctas,
-        title=title,
-        segment=segment,
-        language=language,
-        tone=tone,
-        model=ai_model,
+        event_context=job['event_context'],
+        rag_context=job['rag_context'],
+        allowed_ctas=job['allowed_ctas'],
+        title=job['title'],
+        segment=job['segment'],
+        language=job['language'],
+        tone=job['tone'],
+        model=job['ai_model'],
         api_key=api_key,
-        api_url=api_url
+        api_url=api_url,
+        conn=conn,
+        force_fresh=force_fresh
     )
     
-    if pass1_error:
-        return {'success': False, 'error': f'Pass1 failed: {pass1_error}'}
+    return record_pass1(job, pass1_data, pass1_error)
+
+def pass1_batch_key(job: Dict[str, Any]) -> Tuple:
+    '''
+    Jobs with the same key share everything in the Pass1 prompt except title, segment and retrieval
+    '''
     
-    cur.execute('''
-        SELECT html_layout, slots_schema
-        FROM t_p22819116_event_schedule_app.email_templates
-        WHERE event_id = %s AND content_type_id = %s
-        LIMIT 1
-    ''', (event_id, content_type_id))
+    return (
+        job['event_id'], job['ai_model'], job['tone'], job['language'],
+        json.dumps(job['allowed_ctas'], sort_keys=True, ensure_ascii=False)
+    )
+
+def merge_rag_contexts(contexts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Union of several jobs' retrieval, first occurrence of each row id kept, in job order
+    '''
     
-    template_row = cur.fetchone()
+    merged = {}
+    for key in ('program_items', 'pain_points', 'style_snippets'):
+        rows = OrderedDict()
+        for context in contexts:
+            for item in context.get(key, []):
+                rows.setdefault(item['id'], item)
+        merged[key] = list(rows.values())
     
-    if not template_row:
-        return {'success': False, 'error': f'No template found for event={event_id}, content_type={content_type_id}'}
+    return merged
+
+def run_pass1_batch(jobs: List[Dict[str, Any]], api_key: str, api_url: str, conn=None, force_fresh: bool = False) -> List[Dict[str, Any]]:
+    '''
+    Pass1 for jobs with the same pass1_batch_key in one generate_pass1_plans_batch call on
+    their merged retrieval; a row the batch response does not cover is planned alone
+    (generate_pass1_plan, validated by parse_pass1_response) with its own retrieval
+    '''
     
-    html_layout = template_row.get('html_layout', '')
-    slots_schema = template_row.get('slots_schema', {})
+    if len(jobs) == 1:
+        return [run_pass1(jobs[0], api_key, api_url, conn, force_fresh)]
+    
+    first = jobs[0]
+    plans = generate_pass1_plans_batch(
+        event_context=first['event_context'],
+        rag_context=merge_rag_contexts([job['rag_context'] for job in jobs]),
+        allowed_ctas=first['allowed_ctas'],
+        items=[{'title': job['title'], 'segment': job['segment'], 'rag_context': job['rag_context']} for job in jobs],
+        language=first['language'],
+        tone=first['tone'],
+        model=first['ai_model'],
+        api_key=api_key,
+        api_url=api_url,
+        conn=conn,
+        force_fresh=force_fresh,
+        batch_size=len(jobs)
+    )
     
+    return [record_pass1(job, pass1_data, pass1_error) for job, (pass1_data, pass1_error) in zip(jobs, plans)]
+
+def run_pass2(job: Dict[str, Any], api_key: str, api_url: str, conn=None, force_fresh: bool = False) -> Dict[str, Any]:
     pass2_data, pass2_error = generate_pass2_slots(
-        pass1_data=pass1_data,
-        slots_schema=slots_schema,
-        event_context=event_context,
-        tone=tone,
-        language=language,
-        model=ai_model,
+        pass1_data=job['pass1_data'],
+        slots_schema=job['template_row'].get('slots_schema', {}),
+        event_context=job['event_context'],
+        tone=job['tone'],
+        language=job['language'],
+        model=job['ai_model'],
         api_key=api_key,
-        api_url=api_url
+        api_url=api_url,
+        conn=conn,
+        force_fresh=force_fresh
     )
     
     if pass2_error:
-        return {'success': False, 'error': f'Pass2 failed: {pass2_error}'}
+        job['error'] = f'Pass2 failed: {pass2_error}'
+    
+    job['pass2_data'] = pass2_data
+    return job
+
+def finish_job(conn, job: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Assemble HTML from the slots, run QA and save the email; returns the generate_email_v2() result
+    '''
+    
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
+    row = job['row']
+    ct_row = job['ct_row']
+    allowed_ctas = job['allowed_ctas']
+    event_context = job['event_context']
+    pass1_data = job['pass1_data']
+    pass2_data = job['pass2_data']
+    rag_context = job['rag_context']
+    html_layout = job['template_row'].get('html_layout', '')
+    slots_schema = job['template_row'].get('slots_schema', {})
+    content_type_id = job['content_type_id']
+    variant_index = job['variant_index']
     
     subject_variants = pass1_data.get('subject_variants', [])
     selected_subject = subject_variants[min(variant_index, len(subject_variants) - 1)] if subject_variants else ''
@@ -267,7 +354,7 @@ def generate_email_v2(
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
         RETURNING id
     ''', (
-        list_id,
+        job['list_id'],
         content_type_id,
         selected_subject,
         html,
@@ -278,11 +365,11 @@ def generate_email_v2(
         json.dumps(rag_source_ids),
         json.dumps(qa_report['metrics']),
         json.dumps({
-            'title': title,
-            'segment': segment,
-            'language': language,
-            'tone': tone,
-            'model': ai_model,
+            'title': job['title'],
+            'segment': job['segment'],
+            'language': job['language'],
+            'tone': job['tone'],
+            'model': job['ai_model'],
             'variant_index': variant_index
         }),
         'generated' if qa_report['passed'] else 'requires_review'
@@ -305,3 +392,352 @@ def generate_email_v2(
         'qa_report': qa_report,
         'error': None
     }
+
+def generate_email_v2(
+    conn,
+    content_plan_id: int,
+    variant_index: int = 0,
+    force_fresh: bool = False
+) -> Dict[str, Any]:
+    '''
+    V2 Pipeline: Generate email from content_plan using two-pass generation
+    
+    Args:
+        conn: psycopg2 connection
+        content_plan_id: content_plan table ID
+        variant_index: A/B variant index (0 for first subject)
+        force_fresh: bypass the LLM response cache for both passes
+    
+    Returns:
+        {
+            'success': bool,
+            'email_id': int or None,
+            'subject': str,
+            'html': str,
+            'plain_text': str,
+            'pass1_json': dict,
+            'pass2_json': dict,
+            'qa_report': dict,
+            'error': str or None
+        }
+    '''
+    
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
+    job = load_job(cur, content_plan_id, variant_index)
+    if job['error']:
+        return {'success': False, 'error': job['error']}
+    
+    api_key, api_url, provider = get_api_credentials()
+    
+    for stage in (
+        lambda job: prefetch_job(conn, job, api_key),
+        lambda job: run_pass1(job, api_key, api_url, conn, force_fresh),
+        lambda job: run_pass2(job, api_key, api_url, conn, force_fresh)
+    ):
+        job = stage(job)
+        if job['error']:
+            return {'success': False, 'error': job['error']}
+    
+    return finish_job(conn, job)
+
+def run_stage_pipeline(
+    jobs: Iterable[Dict[str, Any]],
+    stages: List[Tuple[str, Callable[[Dict[str, Any]], Dict[str, Any]], int]],
+    first_stage_batch: Optional[Tuple[int, Callable[[Dict[str, Any]], Any]]] = None,
+    max_ahead: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    '''
+    Run every job through the stages as a pipeline: each stage has its own thread pool
+    (name, fn, concurrency), and a job moves to the next stage as soon as it leaves the
+    previous one, so stage k of one job overlaps stage k+1 of the job before it.
+    
+    jobs is consumed on the calling thread; a generator that prepares each job there
+    (e.g. with DB reads) overlaps the stages of the jobs before it. With max_ahead, at
+    most that many jobs are taken from jobs and not yet yielded, which bounds memory and
+    lets the caller handle the first results while later jobs are still prepared;
+    without it jobs is consumed completely before the first job is yielded. Stage
+    functions run in pool threads and must not touch the caller's connection.
+    
+    first_stage_batch = (size, key) makes the first stage take a list: consecutive jobs
+    with the same key(job) are grouped, up to size, into one call of the first stage's
+    fn (list of jobs -> list of jobs), and each job then moves on by itself.
+    
+    A job that already has 'error' set, or whose stage raises, skips the remaining
+    stages. Seconds per stage are recorded in job['timings'].
+    
+    Yields:
+        Jobs in input order, each as soon as it and all jobs before it are done
+    '''
+    
+    pools = [ThreadPoolExecutor(max_workers=max(1, concurrency)) for _, _, concurrency in stages]
+    
+    def run_stage(position: int, job: Dict[str, Any]) -> Dict[str, Any]:
+        name, fn, _ = stages[position]
+        if job.get('error'):
+            return job
+        
+        started = time.monotonic()
+        try:
+            job = fn(job)
+        except Exception as e:
+            print(f'[PIPELINE] {name} failed for job {job.get("content_plan_id")}: {type(e).__name__} - {e}')
+            job['error'] = f'{name} failed: {e}'
+        job.setdefault('timings', {})[name] = time.monotonic() - started
+        return job
+    
+    def run_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        name, fn, _ = stages[0]
+        
+        started = time.monotonic()
+        try:
+            batch = fn(batch)
+        except Exception as e:
+            print(f'[PIPELINE] {name} failed for jobs {[job.get("content_plan_id") for job in batch]}: {type(e).__name__} - {e}')
+            for job in batch:
+                job['error'] = f'{name} failed: {e}'
+        for job in batch:
+            job.setdefault('timings', {})[name] = time.monotonic() - started
+        return batch
+    
+    def advance(position: int, job: Dict[str, Any], done: Future):
+        if position == len(stages):
+            done.set_result(job)
+            return
+        
+        future = pools[position].submit(run_stage, position, job)
+        
+        def next_stage(finished: Future):
+            try:
+                advance(position + 1, finished.result(), done)
+            except Exception as e:
+                done.set_exception(e)
+        
+        future.add_done_callback(next_stage)
+    
+    def advance_batch(batch: List[Dict[str, Any]], dones: List[Future]):
+        future = pools[0].submit(run_batch, batch)
+        
+        def next_stage(finished: Future):
+            try:
+                finished_jobs = finished.result()
+            except Exception as e:
+                for done in dones:
+                    done.set_exception(e)
+                return
+            
+            for job, done in zip(finished_jobs, dones):
+                try:
+                    advance(1, job, done)
+                except Exception as e:
+                    done.set_exception(e)
+        
+        future.add_done_callback(next_stage)
+    
+    try:
+        completions = deque()
+        batch, batch_dones, batch_key = [], [], None
+        
+        for job in jobs:
+            done = Future()
+            completions.append(done)
+            
+            if first_stage_batch is None or job.get('error'):
+                advance(0, job, done)
+            else:
+                size, key = first_stage_batch
+                job_key = key(job)
+                if batch and job_key != batch_key:
+                    advance_batch(batch, batch_dones)
+                    batch, batch_dones = [], []
+                
+                batch.append(job)
+                batch_dones.append(done)
+                batch_key = job_key
+                
+                if len(batch) >= size:
+                    advance_batch(batch, batch_dones)
+                    batch, batch_dones = [], []
+            
+            while max_ahead and len(completions) >= max_ahead:
+                # The oldest job may still wait for its batch to fill up
+                if batch_dones and completions[0] is batch_dones[0]:
+                    advance_batch(batch, batch_dones)
+                    batch, batch_dones = [], []
+                yield completions.popleft().result()
+        
+        if batch:
+            advance_batch(batch, batch_dones)
+        
+        while completions:
+            yield completions.popleft().result()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+
+def stage_timing_report(jobs: List[Dict[str, Any]], wall_clock: float) -> Dict[str, Any]:
+    '''
+    Wall clock of the batch vs the sum of all stage times (what a sequential run would take)
+    '''
+    
+    stages = {}
+    for job in jobs:
+        for name, seconds in job.get('timings', {}).items():
+            stage = stages.setdefault(name, {'total_seconds': 0.0, 'max_seconds': 0.0, 'jobs': 0})
+            stage['total_seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+            stage['jobs'] += 1
+    
+    sequential = sum(stage['total_seconds'] for stage in stages.values())
+    
+    return {
+        'emails': len(jobs),
+        'wall_clock_seconds': round(wall_clock, 3),
+        'sequential_seconds': round(sequential, 3),
+        'speedup': round(sequential / wall_clock, 2) if wall_clock > 0 else None,
+        'stages': {
+            name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stage.items()}
+            for name, stage in stages.items()
+        }
+    }
+
+class WorkerConnections:
+    '''
+    One autocommit connection per pool thread, opened on first use, so the passes can
+    read and write the Postgres tier of the LLM cache without the caller's connection.
+    Without a DSN, or if connecting fails, get() returns None (in-process LRU only).
+    '''
+    
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+    
+    def get(self):
+        if not self.dsn:
+            return None
+        
+        if not hasattr(self.local, 'conn'):
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with self.lock:
+                    self.connections.append(conn)
+            except psycopg2.Error as e:
+                print(f'[V2_BATCH] Worker connection failed, LLM cache stays in memory: {e}')
+                conn = None
+            self.local.conn = conn
+        
+        return self.local.conn
+    
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+def v2_batch_stages(
+    api_key: str,
+    api_url: str,
+    connections: Optional[WorkerConnections] = None,
+    force_fresh: bool = False
+) -> Tuple[List[Tuple[str, Callable, int]], Tuple[int, Callable[[Dict[str, Any]], Any]]]:
+    '''
+    run_stage_pipeline() stages of generate_emails_v2_batch(): Pass1 batched over up to
+    PASS1_BATCH_SIZE consecutive jobs with the same pass1_batch_key, then Pass2 per job.
+    Each pool thread caches LLM responses through its own connection from connections.
+    
+    Returns:
+        (stages, first_stage_batch)
+    '''
+    
+    def conn():
+        return connections.get() if connections else None
+    
+    return [
+        ('pass1', lambda jobs: run_pass1_batch(jobs, api_key, api_url, conn(), force_fresh), V2_PASS1_CONCURRENCY),
+        ('pass2', lambda job: run_pass2(job, api_key, api_url, conn(), force_fresh), V2_PASS2_CONCURRENCY)
+    ], (PASS1_BATCH_SIZE, pass1_batch_key)
+
+def generate_emails_v2_batch(
+    conn,
+    content_plan_ids: List[int],
+    variant_index: int = 0,
+    force_fresh: bool = False,
+    dsn: Optional[str] = None
+) -> Dict[str, Any]:
+    '''
+    generate_email_v2() for many content plan rows, pipelined: Pass1 and Pass2 run in
+    their own pools (V2_PASS1_CONCURRENCY, V2_PASS2_CONCURRENCY), so Pass1 of email k+1
+    overlaps Pass2 of email k, and both overlap the prefetch of later rows. Consecutive
+    rows of one event with the same model, tone, language and CTAs are planned together,
+    PASS1_BATCH_SIZE per Pass1 call (see v2_batch_stages).
+    
+    conn is used on the calling thread only: rows are loaded and prefetched (retrieval,
+    CTAs, template) there, and emails are assembled and saved there in content plan
+    order, each committed or rolled back on its own. Prefetch runs at most V2_MAX_AHEAD
+    rows ahead of saving. The passes cache LLM responses in Postgres through one
+    connection per pool thread, opened from dsn (DATABASE_URL by default).
+    
+    Returns:
+        {
+            'results': [generate_email_v2() result + 'content_plan_id'] in input order,
+            'timing': stage_timing_report()
+        }
+    '''
+    
+    started = time.monotonic()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    api_key, api_url, provider = get_api_credentials()
+    
+    jobs = []
+    
+    def prefetched_jobs() -> Iterator[Dict[str, Any]]:
+        for content_plan_id in content_plan_ids:
+            load_started = time.monotonic()
+            job = load_job(cur, content_plan_id, variant_index)
+            job['timings']['load'] = time.monotonic() - load_started
+            jobs.append(job)
+            
+            if not job['error']:
+                prefetch_started = time.monotonic()
+                try:
+                    prefetch_job(conn, job, api_key)
+                    # What prefetch wrote (persisted ANN indexes) is not part of any email's transaction
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f'[V2_BATCH] Prefetch for content_plan={content_plan_id} failed: {type(e).__name__} - {e}')
+                    job['error'] = f'prefetch failed: {e}'
+                job['timings']['prefetch'] = time.monotonic() - prefetch_started
+            
+            yield job
+    
+    connections = WorkerConnections(dsn or os.environ.get('DATABASE_URL'))
+    stages, first_stage_batch = v2_batch_stages(api_key, api_url, connections, force_fresh)
+    
+    results = []
+    try:
+        for job in run_stage_pipeline(prefetched_jobs(), stages, first_stage_batch, V2_MAX_AHEAD):
+            if job['error']:
+                results.append({'content_plan_id': job['content_plan_id'], 'success': False, 'error': job['error']})
+                continue
+            
+            finish_started = time.monotonic()
+            try:
+                result = finish_job(conn, job)
+            except Exception as e:
+                conn.rollback()
+                print(f'[V2_BATCH] Saving content_plan={job["content_plan_id"]} failed: {type(e).__name__} - {e}')
+                result = {'success': False, 'error': f'finish failed: {e}'}
+            job['timings']['finish'] = time.monotonic() - finish_started
+            
+            results.append({'content_plan_id': job['content_plan_id'], **result})
+    finally:
+        connections.close()
+    
+    timing = stage_timing_report(jobs, time.monotonic() - started)
+    print(f'[V2_BATCH] {sum(result["success"] for result in results)}/{len(results)} emails in {timing["wall_clock_seconds"]}s wall clock (sequential {timing["sequential_seconds"]}s)')
+    
+    return {'results': results, 'timing': timing}
@@ -9,7 +9,7 @@ import os
 import re
 from typing import Dict, Any, List
 import psycopg2
-import requests
+import http_pool
 
 
 def format_knowledge_base(knowledge_rows: List[tuple]) -> Dict[str, str]:
@@ -89,13 +89,10 @@ def build_block_prompt(block: Dict[str, Any], knowledge: Dict[str, str], theme:
 def call_openai(prompt: str, openai_key: str) -> Dict[str, Any]:
     """Вызывает OpenAI API для генерации контента"""
     
-    response = requests.post(
+    response = http_pool.request(
+        'POST',
         'https://api.openai.com/v1/chat/completions',
-        headers={
-            'Authorization': f'Bearer {openai_key}',
-            'Content-Type': 'application/json'
-        },
-        json={
+        body=json.dumps({
             'model': 'gpt-4o-mini',
             'messages': [
                 {'role': 'system', 'content': 'Ты — эксперт копирайтер email-рассылок. Отвечаешь только валидным JSON.'},
@@ -103,12 +100,16 @@ def call_openai(prompt: str, openai_key: str) -> Dict[str, Any]:
             ],
             'temperature': 0.7,
             'max_tokens': 2000
+        }).encode('utf-8'),
+        headers={
+            'Authorization': f'Bearer {openai_key}',
+            'Content-Type': 'application/json'
         },
         timeout=30
     )
     
-    if response.status_code != 200:
-        raise Exception(f'OpenAI API error: {response.status_code} - {response.text}')
+    if response.status != 200:
+        raise Exception(f'OpenAI API error: {response.status} - {response.text}')
     
     data = response.json()
     content = data['choices'][0]['message']['content'].strip()
@@ -3,6 +3,13 @@ import os
 from typing import Dict, Any, List
 import psycopg2
 import urllib.request
+import http_pool
+from embedding_models import EMBEDDING_PROVIDER, LOCAL_EMBEDDING_DIM, embedding_model_name, hashed_ngram_embedding
+from query_embedding_cache import QUERY_EMBEDDING_CACHE
+
+# Провайдеры эмбеддингов запросов в этой функции (openai — через OpenRouter); с другим EMBEDDING_PROVIDER handler отвечает ошибкой
+QUERY_EMBEDDING_PROVIDERS = ('openai', 'local')
+EMBEDDING_MODEL = embedding_model_name() if EMBEDDING_PROVIDER in QUERY_EMBEDDING_PROVIDERS else None
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -49,6 +56,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'DATABASE_URL not configured'})
             }
         
+        if EMBEDDING_MODEL is None:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f"EMBEDDING_PROVIDER={EMBEDDING_PROVIDER} не поддерживается (поддерживаются: {', '.join(QUERY_EMBEDDING_PROVIDERS)})"})
+            }
+        
         openrouter_key = os.environ.get('OPENROUTER_API_KEY', '')
         if not openrouter_key:
             return {
@@ -117,10 +131,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         query_text = key_message if key_message else (instructions if instructions else template_name)
         query_embedding = create_embedding(query_text, openrouter_key)
+        print(f"[RAG] Query embedding cache: {QUERY_EMBEDDING_CACHE.stats()}")
         
+        query_vector = '[' + ','.join(repr(float(x)) for x in query_embedding) + ']'
         cur.execute(
-            "SELECT content, item_type, metadata FROM t_p22819116_event_schedule_app.knowledge_store WHERE event_id = " + 
-            str(event_id) + " ORDER BY embedding <-> ARRAY[" + ",".join(str(x) for x in query_embedding) + "] LIMIT 5"
+            "SELECT content, item_type, metadata FROM t_p22819116_event_schedule_app.knowledge_store "
+            "WHERE event_id = %s AND embedding_model = %s AND embedding IS NOT NULL "
+            "ORDER BY embedding <=> %s::vector LIMIT 5",
+            (event_id, EMBEDDING_MODEL, query_vector)
         )
         
         rag_results = cur.fetchall()
@@ -247,6 +265,7 @@ CTA ссылка будет подставлена автоматически: {
                     'slots_data': slots_data,
                     'template_name': template_name,
                     'rag_context_items': len(rag_results),
+                    'query_embedding_cache': QUERY_EMBEDDING_CACHE.stats(),
                     'validation': validation_result
                 })
             }
@@ -293,7 +312,26 @@ def fill_html_template(html_layout: str, slots_data: Dict[str, Any]) -> str:
     return result
 
 def create_embedding(text: str, api_key: str) -> List[float]:
-    """Создаёт эмбеддинг через OpenRouter API"""
+    """Создаёт эмбеддинг провайдером EMBEDDING_PROVIDER (openai через OpenRouter или local),
+    повторные запросы берёт из LRU/TTL-кэша тёплого контейнера (shared/query_embedding_cache.py, общий с rag_module)"""
+    key = (EMBEDDING_MODEL, text)
+    embedding = QUERY_EMBEDDING_CACHE.get(key)
+    if embedding is not None:
+        return embedding
+    
+    if EMBEDDING_PROVIDER == 'local':
+        embedding = hashed_ngram_embedding(text, LOCAL_EMBEDDING_DIM)
+    elif EMBEDDING_PROVIDER == 'openai':
+        embedding = create_embedding_openrouter(text, api_key)
+    else:
+        raise ValueError(f'Unsupported embedding provider: {EMBEDDING_PROVIDER}')
+    
+    QUERY_EMBEDDING_CACHE.put(key, embedding)
+    
+    return embedding
+
+def create_embedding_openrouter(text: str, api_key: str) -> List[float]:
+    """Эмбеддинг text-embedding-3-small через OpenRouter API"""
     data = {
         'model': 'openai/text-embedding-3-small',
         'input': text
@@ -310,7 +348,7 @@ def create_embedding(text: str, api_key: str) -> List[float]:
         }
     )
     
-    with urllib.request.urlopen(req) as response:
+    with http_pool.urlopen(req, idempotent=True) as response:
         result = json.loads(response.read().decode('utf-8'))
         return result['data'][0]['embedding']
 
@@ -333,6 +371,6 @@ def call_openai(prompt: str, api_key: str) -> str:
         }
     )
     
-    with urllib.request.urlopen(req) as response:
+    with http_pool.urlopen(req) as response:
         result = json.loads(response.read().decode('utf-8'))
         return result['choices'][0]['message']['content']
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+Бенчмарк вставки в knowledge_store: построчные INSERT со строковым ARRAY[...] против execute_values.
+Запуск: DATABASE_URL=postgres://... python bench_ingest.py [rows]
+Всё выполняется в транзакции, которая откатывается — данные в базе не остаются.
+"""
+import os
+import sys
+import time
+import json
+import random
+import psycopg2
+from index import EMBEDDING_CODEC, EMBEDDING_MODEL, insert_knowledge_rows, pack_embedding, text_hash, vector_literal
+
+def make_rows(event_id: int, count: int, dim: int = 1536):
+    rng = random.Random(42)
+    rows = []
+    for i in range(count):
+        text = f"Бенчмарк: доклад {i} про аналитику, найм и удержание сотрудников"
+        embedding = [rng.uniform(-0.1, 0.1) for _ in range(dim)]
+        rows.append((
+            event_id, 'program_item', text, vector_literal(embedding), psycopg2.Binary(pack_embedding(embedding)),
+            EMBEDDING_CODEC, EMBEDDING_MODEL, dim, text_hash(text)
+        ))
+    return rows
+
+def insert_row_by_row(cur, rows):
+    """Старый путь индексатора: один INSERT на строку, эмбеддинг склеен в SQL-текст"""
+    for event_id, item_type, text, embedding, h in rows:
+        cur.execute(
+            "INSERT INTO t_p22819116_event_schedule_app.knowledge_store (event_id, item_type, content, metadata, embedding, content_hash) VALUES (" +
+            str(event_id) + ", '" + item_type + "', '" + text.replace("'", "''") + "', '{}', ARRAY[" +
+            ",".join(str(x) for x in embedding) + "], '" + h + "')"
+        )
+
+def measure(conn, label: str, insert, rows) -> float:
+    cur = conn.cursor()
+    started = time.perf_counter()
+    insert(cur, rows)
+    elapsed = time.perf_counter() - started
+    conn.rollback()
+    cur.close()
+    
+    rate = len(rows) / elapsed if elapsed > 0 else float('inf')
+    print(f"{label:<16} {len(rows)} rows in {elapsed:.2f}s — {rate:.0f} rows/sec")
+    return rate
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM t_p22819116_event_schedule_app.events ORDER BY id LIMIT 1")
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        print("No events found: create an event first, rows are attached to it and rolled back")
+        return
+    
+    rows = make_rows(row[0], count)
+    legacy_rows = [(r[0], r[1], r[2], json.loads(r[3]), r[8]) for r in rows]
+    
+    before = measure(conn, 'row-by-row', insert_row_by_row, legacy_rows)
+    after = measure(conn, 'execute_values', insert_knowledge_rows, rows)
+    print(f"speedup: {after / before:.1f}x")
+    
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,36 @@
 import json
 import os
+import time
 from typing import Dict, Any, List
 import psycopg2
+import psycopg2.extras
 import urllib.request
 import urllib.parse
 import csv
 from io import StringIO
+import http_pool
+from embedding_models import EMBEDDING_PROVIDER, LOCAL_EMBEDDING_DIM, embedding_model_name, hashed_ngram_embedding
+from knowledge_codec import (
+    EMBEDDING_CODEC, EMBEDDING_INPUT_MAX_CHARS, VECTOR_COLUMN_DIM, knowledge_column_available, pack_embedding,
+    short_vector_literal, split_embedding_batches, text_hash, vector_literal
+)
+
+# None, если EMBEDDING_PROVIDER не поддерживается индексацией (см. EMBEDDING_PROVIDERS) — handler отвечает ошибкой
+EMBEDDING_MODEL = embedding_model_name() if EMBEDDING_PROVIDER in ('openai', 'local') else None
+KNOWLEDGE_INSERT_PAGE_SIZE = int(os.environ.get('KNOWLEDGE_INSERT_PAGE_SIZE', '200'))
+INDEX_JOB_CHUNK_SIZE = int(os.environ.get('INDEX_JOB_CHUNK_SIZE', '100'))
+INDEX_JOB_SLICE_SECONDS = float(os.environ.get('INDEX_JOB_SLICE_SECONDS', '20'))
+INDEX_JOB_MAX_ATTEMPTS = int(os.environ.get('INDEX_JOB_MAX_ATTEMPTS', '3'))
+INDEX_JOB_STALE_SECONDS = int(os.environ.get('INDEX_JOB_STALE_SECONDS', '600'))
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Индексирует знания мероприятия из Google Docs в knowledge_store с эмбеддингами для RAG
-    Args: event - dict с httpMethod, body {event_id: int}
-    Returns: HTTP response с количеством проиндексированных элементов
+    фоновым возобновляемым заданием: каждый POST обрабатывает кусок не дольше INDEX_JOB_SLICE_SECONDS
+    Args: event - dict с httpMethod; POST body {event_id: int, mode?: 'diff'|'full'} или {job_id: int} для продолжения,
+          GET ?job_id= или ?event_id= — статус задания
+    Returns: HTTP response со статусом задания (200 — готово, 202 — нужно повторить POST с job_id,
+             500 — кусок не удался; после INDEX_JOB_MAX_ATTEMPTS ошибок подряд задание failed и новый POST начинает заново)
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -20,13 +39,57 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        job_id = params.get('job_id')
+        event_id = params.get('event_id')
+        
+        if not job_id and not event_id:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'job_id or event_id required'})
+            }
+        
+        db_url = os.environ.get('DATABASE_URL', '')
+        if not db_url:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'DATABASE_URL not configured'})
+            }
+        
+        conn = psycopg2.connect(db_url)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        
+        if job_id:
+            job = load_index_job(cur, job_id=int(job_id))
+        else:
+            job = load_index_job(cur, event_id=int(event_id))
+        
+        cur.close()
+        conn.close()
+        
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Indexing job not found'})
+            }
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(job_status(job))
+        }
+    
     if method == 'POST':
         body_str = event.get('body', '{}')
         if not body_str or body_str == '':
@@ -34,14 +97,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body_data = json.loads(body_str)
         
         event_id = body_data.get('event_id')
+        job_id = body_data.get('job_id')
+        mode = body_data.get('mode', 'diff')
         
-        if not event_id:
+        if not event_id and not job_id:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'event_id required'})
             }
         
+        if mode not in ('diff', 'full'):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'mode must be diff or full'})
+            }
+        
         db_url = os.environ.get('DATABASE_URL', '')
         if not db_url:
             return {
@@ -50,115 +122,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'DATABASE_URL not configured'})
             }
         
-        openrouter_key = os.environ.get('OPENROUTER_API_KEY', '')
-        if not openrouter_key:
+        if EMBEDDING_MODEL is None:
             return {
                 'statusCode': 500,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'OPENROUTER_API_KEY not configured'})
+                'body': json.dumps({'error': unsupported_provider_message()})
             }
         
-        conn = psycopg2.connect(db_url)
-        cur = conn.cursor()
-        
-        cur.execute(
-            "SELECT program_doc_id, pain_doc_id FROM t_p22819116_event_schedule_app.events WHERE id = " + str(event_id)
-        )
-        
-        result = cur.fetchone()
-        
-        if not result:
-            cur.close()
-            conn.close()
+        openrouter_key = os.environ.get('OPENROUTER_API_KEY', '')
+        if not openrouter_key and EMBEDDING_PROVIDER == 'openai':
             return {
-                'statusCode': 404,
+                'statusCode': 500,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Event not found'})
+                'body': json.dumps({'error': 'OPENROUTER_API_KEY not configured'})
             }
         
-        program_doc_url, pain_doc_url = result
+        deadline = time.monotonic() + INDEX_JOB_SLICE_SECONDS
         
-        cur.execute(
-            "DELETE FROM t_p22819116_event_schedule_app.knowledge_store WHERE event_id = " + str(event_id)
-        )
-        conn.commit()
-        
-        indexed_count = 0
+        conn = psycopg2.connect(db_url)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
-        if program_doc_url:
-            program_text = read_google_doc(program_doc_url)
-            if program_text:
-                lines = program_text.strip().split('\n')
-                
-                max_items = 50
-                processed = 0
+        if job_id:
+            job = load_index_job(cur, job_id=int(job_id))
+            if not job:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Indexing job not found'})
+                }
+        else:
+            expire_stale_index_job(cur, event_id)
+            conn.commit()
+            job = load_index_job(cur, event_id=event_id, running_only=True)
+            
+            if job:
+                print(f"[INFO] Resuming running job {job['id']} for event {event_id}")
+            else:
+                cur.execute(
+                    "SELECT program_doc_id, pain_doc_id FROM t_p22819116_event_schedule_app.events WHERE id = %s",
+                    (event_id,)
+                )
                 
-                for line in lines:
-                    if processed >= max_items:
-                        print(f"[INFO] Reached limit of {max_items} program items")
-                        break
-                    
-                    line = line.strip()
-                    if not line or len(line) < 10:
-                        continue
-                    
-                    try:
-                        embedding = create_embedding(line, openrouter_key)
-                        
-                        cur.execute(
-                            "INSERT INTO t_p22819116_event_schedule_app.knowledge_store (event_id, item_type, content, metadata, embedding) VALUES (" + 
-                            str(event_id) + ", 'program_item', '" + line.replace("'", "''") + "', '{}', ARRAY[" + 
-                            ",".join(str(x) for x in embedding) + "])"
-                        )
-                        
-                        indexed_count += 1
-                        processed += 1
-                    except Exception as e:
-                        print(f"[ERROR] Failed to index program line: {str(e)}")
-                        continue
-        
-        if pain_doc_url:
-            pain_text = read_google_doc(pain_doc_url)
-            if pain_text:
-                paragraphs = [p.strip() for p in pain_text.split('\n\n') if p.strip()]
+                result = cur.fetchone()
                 
-                max_pain_items = 20
-                processed_pain = 0
+                if not result:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Event not found'})
+                    }
                 
-                for para in paragraphs:
-                    if processed_pain >= max_pain_items:
-                        print(f"[INFO] Reached limit of {max_pain_items} pain points")
-                        break
-                    
-                    if len(para) < 10:
-                        continue
-                    
-                    try:
-                        embedding = create_embedding(para, openrouter_key)
-                        
-                        cur.execute(
-                            "INSERT INTO t_p22819116_event_schedule_app.knowledge_store (event_id, item_type, content, metadata, embedding) VALUES (" + 
-                            str(event_id) + ", 'pain_point', '" + para.replace("'", "''") + "', '{}', ARRAY[" + 
-                            ",".join(str(x) for x in embedding) + "])"
-                        )
-                        
-                        indexed_count += 1
-                        processed_pain += 1
-                    except Exception as e:
-                        print(f"[ERROR] Failed to index pain point: {str(e)}")
-                        continue
+                try:
+                    job = create_index_job(cur, event_id, mode, result['program_doc_id'], result['pain_doc_id'])
+                    conn.commit()
+                except psycopg2.IntegrityError:
+                    # Параллельный POST успел создать running-задание (уникальный индекс) — продолжаем его
+                    conn.rollback()
+                    job = load_index_job(cur, event_id=event_id, running_only=True)
+                    if not job:
+                        raise
+                    print(f"[INFO] Job {job['id']} for event {event_id} was created concurrently, resuming it")
+        
+        if job['status'] == 'running':
+            try:
+                job = run_index_job(conn, cur, job, openrouter_key, deadline)
+            except Exception as e:
+                conn.rollback()
+                print(f"[ERROR] Indexing job {job['id']} stopped at {job['cursor_position']}/{job['total_items']}: {str(e)}")
+                cur.execute(
+                    "UPDATE t_p22819116_event_schedule_app.knowledge_index_jobs "
+                    "SET error = %s, attempts = attempts + 1, "
+                    "status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE status END, "
+                    "finished_at = CASE WHEN attempts + 1 >= %s THEN CURRENT_TIMESTAMP ELSE finished_at END, "
+                    "updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (str(e)[:1000], INDEX_JOB_MAX_ATTEMPTS, INDEX_JOB_MAX_ATTEMPTS, job['id'])
+                )
+                conn.commit()
+                job = load_index_job(cur, job_id=job['id'])
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({**job_status(job), 'error': str(e)})
+                }
         
-        conn.commit()
         cur.close()
         conn.close()
         
+        status = job_status(job)
+        print(f"[INFO] Indexing job {job['id']} for event {job['event_id']}: {status['processed']}/{status['total']} ({status['status']})")
+        
+        if job['status'] == 'failed':
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({**status, 'error': job['error'] or 'Indexing job failed'})
+            }
+        
         return {
-            'statusCode': 200,
+            'statusCode': 200 if job['status'] == 'done' else 202,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'success': True,
-                'indexed_count': indexed_count,
-                'event_id': event_id
+                'indexed_count': job['inserted'] + job['unchanged'],
+                **status
             })
         }
     
@@ -168,6 +240,268 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'body': json.dumps({'error': 'Method not allowed'})
     }
 
+def job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Прогресс задания индексации для ответа API"""
+    total = job['total_items']
+    processed = job['cursor_position']
+    
+    return {
+        'job_id': job['id'],
+        'event_id': job['event_id'],
+        'mode': job['mode'],
+        'status': job['status'],
+        'processed': processed,
+        'total': total,
+        'progress': round(processed / total, 4) if total else 1.0,
+        'inserted': job['inserted'],
+        'deleted': job['deleted'],
+        'unchanged': job['unchanged'],
+        'attempts': job['attempts'],
+        'last_error': job['error']
+    }
+
+def load_index_job(cur, job_id: int = None, event_id: int = None, running_only: bool = False):
+    """Задание по id или последнее (либо текущее running) задание мероприятия"""
+    columns = (
+        "id, event_id, mode, status, item_types, items, total_items, cursor_position, "
+        "inserted, deleted, unchanged, error, attempts, replace_below_id"
+    )
+    
+    if job_id:
+        cur.execute(
+            "SELECT " + columns + " FROM t_p22819116_event_schedule_app.knowledge_index_jobs WHERE id = %s",
+            (job_id,)
+        )
+    else:
+        cur.execute(
+            "SELECT " + columns + " FROM t_p22819116_event_schedule_app.knowledge_index_jobs "
+            "WHERE event_id = %s" + (" AND status = 'running'" if running_only else "") + " ORDER BY id DESC LIMIT 1",
+            (event_id,)
+        )
+    
+    return cur.fetchone()
+
+def expire_stale_index_job(cur, event_id: int):
+    """Переводит в failed running-задание мероприятия, которое не продолжали дольше INDEX_JOB_STALE_SECONDS,
+    чтобы новый POST по event_id создал свежее задание, а не продолжал брошенное"""
+    cur.execute(
+        "UPDATE t_p22819116_event_schedule_app.knowledge_index_jobs "
+        "SET status = 'failed', error = COALESCE(error, 'stale: not resumed'), finished_at = CURRENT_TIMESTAMP, "
+        "updated_at = CURRENT_TIMESTAMP WHERE event_id = %s AND status = 'running' "
+        "AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second' RETURNING id",
+        (event_id, INDEX_JOB_STALE_SECONDS)
+    )
+    
+    for row in cur.fetchall():
+        print(f"[INFO] Indexing job {row['id']} for event {event_id} is stale, marked failed")
+
+def create_index_job(cur, event_id: int, mode: str, program_doc_url: str, pain_doc_url: str) -> Dict[str, Any]:
+    """Читает документы целиком (без ограничения числа элементов) и создаёт задание с курсором 0.
+    В режиме full запоминается граница id старых строк — они удаляются в finish_index_job, когда новые уже вставлены;
+    в diff у старых строк заполняется content_hash"""
+    items = []
+    item_types = []
+    
+    if program_doc_url:
+        program_text = read_google_doc(program_doc_url)
+        if program_text:
+            item_types.append('program_item')
+            for line in program_text.strip().split('\n'):
+                line = line.strip()
+                if line and len(line) >= 10:
+                    items.append(['program_item', line])
+    
+    if pain_doc_url:
+        pain_text = read_google_doc(pain_doc_url)
+        if pain_text:
+            item_types.append('pain_point')
+            paragraphs = [p.strip() for p in pain_text.split('\n\n') if p.strip()]
+            for para in paragraphs:
+                if len(para) >= 10:
+                    items.append(['pain_point', para])
+    
+    replace_below_id = None
+    if mode == 'full':
+        cur.execute(
+            "SELECT COALESCE(MAX(id), 0) AS max_id FROM t_p22819116_event_schedule_app.knowledge_store WHERE event_id = %s",
+            (event_id,)
+        )
+        replace_below_id = cur.fetchone()['max_id']
+        item_types = ['program_item', 'pain_point', 'style_snippet']
+    else:
+        backfill_content_hashes(cur, event_id)
+    
+    cur.execute(
+        "INSERT INTO t_p22819116_event_schedule_app.knowledge_index_jobs "
+        "(event_id, mode, item_types, items, total_items, replace_below_id) VALUES (%s, %s, %s, %s, %s, %s) "
+        "RETURNING id, event_id, mode, status, item_types, items, total_items, cursor_position, "
+        "inserted, deleted, unchanged, error, attempts, replace_below_id",
+        (event_id, mode, item_types, json.dumps(items, ensure_ascii=False), len(items), replace_below_id)
+    )
+    
+    job = cur.fetchone()
+    print(f"[INFO] Created indexing job {job['id']} for event {event_id} ({mode}): {len(items)} items")
+    
+    return job
+
+def backfill_content_hashes(cur, event_id: int):
+    """Заполняет content_hash у строк, проиндексированных до его появления"""
+    cur.execute(
+        "SELECT id, content FROM t_p22819116_event_schedule_app.knowledge_store "
+        "WHERE event_id = %s AND content_hash IS NULL",
+        (event_id,)
+    )
+    backfill = [(row['id'], text_hash(row['content'] or '')) for row in cur.fetchall()]
+    
+    if backfill:
+        psycopg2.extras.execute_values(
+            cur,
+            "UPDATE t_p22819116_event_schedule_app.knowledge_store AS ks SET content_hash = v.content_hash "
+            "FROM (VALUES %s) AS v (id, content_hash) WHERE ks.id = v.id",
+            backfill,
+            page_size=KNOWLEDGE_INSERT_PAGE_SIZE
+        )
+
+def run_index_job(conn, cur, job: Dict[str, Any], api_key: str, deadline: float) -> Dict[str, Any]:
+    """Обрабатывает задание кусками по INDEX_JOB_CHUNK_SIZE элементов до дедлайна.
+    Вставка строк и сдвиг курсора коммитятся вместе, поэтому прерванное задание продолжается без дублей"""
+    items = job['items']
+    if isinstance(items, str):
+        items = json.loads(items)
+    
+    while job['cursor_position'] < job['total_items'] and time.monotonic() < deadline:
+        start = job['cursor_position']
+        chunk = items[start:start + INDEX_JOB_CHUNK_SIZE]
+        
+        chunk_stats = {'inserted': 0, 'unchanged': 0}
+        for item_type in ('program_item', 'pain_point'):
+            texts = [text for t, text in chunk if t == item_type]
+            if texts:
+                type_stats = insert_missing_items(cur, job['event_id'], item_type, texts, api_key, job['replace_below_id'])
+                for key in chunk_stats:
+                    chunk_stats[key] += type_stats[key]
+        
+        cur.execute(
+            "UPDATE t_p22819116_event_schedule_app.knowledge_index_jobs "
+            "SET cursor_position = %s, inserted = inserted + %s, unchanged = unchanged + %s, "
+            "error = NULL, attempts = 0, updated_at = CURRENT_TIMESTAMP WHERE id = %s "
+            "RETURNING cursor_position, inserted, unchanged, error, attempts",
+            (start + len(chunk), chunk_stats['inserted'], chunk_stats['unchanged'], job['id'])
+        )
+        job.update(cur.fetchone())
+        conn.commit()
+    
+    if job['cursor_position'] >= job['total_items']:
+        finish_index_job(cur, job, items)
+        conn.commit()
+    
+    return job
+
+def insert_missing_items(cur, event_id: int, item_type: str, texts: List[str], api_key: str, replace_below_id: int = None) -> Dict[str, int]:
+    """Вставляет тексты, которых ещё нет в knowledge_store (по content_hash); существующие строки и их id не трогает.
+    replace_below_id (режим full): строки с id не больше него будут удалены, поэтому существующими не считаются"""
+    desired = {}
+    for text in texts:
+        h = text_hash(text)
+        if h not in desired:
+            desired[h] = text
+    
+    cur.execute(
+        "SELECT DISTINCT content_hash FROM t_p22819116_event_schedule_app.knowledge_store "
+        "WHERE event_id = %s AND item_type = %s AND embedding_model = %s AND content_hash = ANY(%s) AND id > %s",
+        (event_id, item_type, EMBEDDING_MODEL, list(desired.keys()), replace_below_id or 0)
+    )
+    existing = {row['content_hash'] for row in cur.fetchall()}
+    
+    new_hashes = [h for h in desired if h not in existing]
+    new_texts = [desired[h] for h in new_hashes]
+    embeddings = create_embeddings_cached(cur, new_texts, api_key)
+    
+    rows = [
+        (
+            event_id, item_type, text, vector_literal(embedding) if len(embedding) == VECTOR_COLUMN_DIM else None,
+            psycopg2.Binary(pack_embedding(embedding)), EMBEDDING_CODEC, EMBEDDING_MODEL, len(embedding), h
+        )
+        for h, text, embedding in zip(new_hashes, new_texts, embeddings)
+    ]
+    insert_knowledge_rows(cur, rows)
+    
+    return {'inserted': len(rows), 'unchanged': len(existing)}
+
+def finish_index_job(cur, job: Dict[str, Any], items: List[List[str]]):
+    """Удаляет строки, которых больше нет в документах (и дубли), а в режиме full — все строки мероприятия
+    до replace_below_id; поднимает версии индекса, закрывает задание"""
+    deleted = 0
+    
+    if job['mode'] == 'full':
+        cur.execute(
+            "DELETE FROM t_p22819116_event_schedule_app.knowledge_store WHERE event_id = %s AND id <= %s",
+            (job['event_id'], job['replace_below_id'] or 0)
+        )
+        deleted += cur.rowcount
+    
+    if job['mode'] == 'diff':
+        for item_type in job['item_types']:
+            hashes = list({text_hash(text) for t, text in items if t == item_type})
+            
+            cur.execute(
+                "DELETE FROM t_p22819116_event_schedule_app.knowledge_store "
+                "WHERE event_id = %s AND item_type = %s AND (content_hash IS NULL OR content_hash <> ALL(%s) "
+                "OR embedding_model IS DISTINCT FROM %s)",
+                (job['event_id'], item_type, hashes, EMBEDDING_MODEL)
+            )
+            deleted += cur.rowcount
+            
+            cur.execute(
+                "DELETE FROM t_p22819116_event_schedule_app.knowledge_store AS a "
+                "USING t_p22819116_event_schedule_app.knowledge_store AS b "
+                "WHERE a.event_id = %s AND a.item_type = %s AND b.event_id = a.event_id "
+                "AND b.item_type = a.item_type AND b.content_hash = a.content_hash AND b.id < a.id",
+                (job['event_id'], item_type)
+            )
+            deleted += cur.rowcount
+    
+    if job['mode'] == 'full' or job['inserted'] or deleted:
+        for item_type in sorted(job['item_types']):
+            cur.execute(
+                "INSERT INTO t_p22819116_event_schedule_app.knowledge_index_versions (event_id, item_type, version) "
+                "VALUES (%s, %s, 1) ON CONFLICT (event_id, item_type) "
+                "DO UPDATE SET version = knowledge_index_versions.version + 1, updated_at = CURRENT_TIMESTAMP",
+                (job['event_id'], item_type)
+            )
+    
+    cur.execute(
+        "UPDATE t_p22819116_event_schedule_app.knowledge_index_jobs "
+        "SET status = 'done', deleted = deleted + %s, items = '[]', updated_at = CURRENT_TIMESTAMP, "
+        "finished_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING status, deleted",
+        (deleted, job['id'])
+    )
+    job.update(cur.fetchone())
+
+def insert_knowledge_rows(cur, rows: List[tuple], page_size: int = None):
+    """Пакетная вставка в knowledge_store: один многострочный INSERT на page_size строк вместо INSERT на строку.
+    rows: (event_id, item_type, content, embedding, embedding_packed, embedding_codec, embedding_model, embedding_dim, content_hash),
+    embedding — текст pgvector '[...]' (vector_literal) для серверного KNN или None для размерности не 1536;
+    при наличии колонки embedding_vec_short (V0034) из него же строится укороченный вектор"""
+    if not rows:
+        return
+    
+    if not knowledge_column_available(cur, 'embedding_vec_short'):
+        columns = "(event_id, item_type, content, metadata, embedding, embedding_packed, embedding_codec, embedding_model, embedding_dim, content_hash)"
+        template = "(%s, %s, %s, '{}', %s::vector, %s, %s, %s, %s, %s)"
+    else:
+        rows = [row[:4] + (short_vector_literal(json.loads(row[3])) if row[3] else None,) + row[4:] for row in rows]
+        columns = "(event_id, item_type, content, metadata, embedding, embedding_vec_short, embedding_packed, embedding_codec, embedding_model, embedding_dim, content_hash)"
+        template = "(%s, %s, %s, '{}', %s::vector, %s::vector, %s, %s, %s, %s, %s)"
+    
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO t_p22819116_event_schedule_app.knowledge_store " + columns + " VALUES %s",
+        rows,
+        template=template,
+        page_size=page_size or KNOWLEDGE_INSERT_PAGE_SIZE
+    )
+
 def read_google_doc(url: str) -> str:
     """Читает Google Docs или Sheets"""
     try:
@@ -210,11 +544,71 @@ def read_google_doc(url: str) -> str:
         print(f'[ERROR] Failed to read Google doc: {str(e)}')
         return ''
 
+def create_embeddings_cached(cur, texts: List[str], api_key: str) -> List[Any]:
+    """Берёт эмбеддинги из embedding_cache, в API отправляет только отсутствующие тексты.
+    Ошибка батча не глотается: кусок задания откатывается, курсор остаётся на месте, ошибка пишется в задание"""
+    if not texts:
+        return []
+    
+    hashes = [text_hash(text) for text in texts]
+    
+    cur.execute(
+        "SELECT text_hash, embedding FROM t_p22819116_event_schedule_app.embedding_cache "
+        "WHERE model = %s AND text_hash = ANY(%s)",
+        (EMBEDDING_MODEL, list(set(hashes)))
+    )
+    cached = {row['text_hash']: row['embedding'] for row in cur.fetchall()}
+    
+    missing = {}
+    for text, h in zip(texts, hashes):
+        if h not in cached and h not in missing:
+            missing[h] = text
+    
+    missing_hashes = list(missing.keys())
+    missing_texts = [missing[h] for h in missing_hashes]
+    
+    for batch in split_embedding_batches(missing_texts):
+        embeddings = create_embeddings([missing_texts[i] for i in batch], api_key)
+        
+        for i, embedding in zip(batch, embeddings):
+            cached[missing_hashes[i]] = embedding
+        
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO t_p22819116_event_schedule_app.embedding_cache (model, text_hash, embedding) "
+            "VALUES %s ON CONFLICT (model, text_hash) DO NOTHING",
+            [(EMBEDDING_MODEL, missing_hashes[i], embedding) for i, embedding in zip(batch, embeddings)],
+            page_size=KNOWLEDGE_INSERT_PAGE_SIZE
+        )
+    
+    print(f"[INFO] Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+    
+    return [cached.get(h) for h in hashes]
+
 def create_embedding(text: str, api_key: str) -> List[float]:
-    """Создаёт эмбеддинг через OpenRouter API"""
+    """Создаёт эмбеддинг выбранным провайдером (EMBEDDING_PROVIDER)"""
+    return create_embeddings([text], api_key)[0]
+
+def create_embeddings(texts: List[str], api_key: str) -> List[List[float]]:
+    """Эмбеддинги для списка текстов провайдером EMBEDDING_PROVIDER: openai (через OpenRouter) или local"""
+    provider = EMBEDDING_PROVIDERS.get(EMBEDDING_PROVIDER)
+    if provider is None:
+        raise ValueError(unsupported_provider_message())
+    return provider([text[:EMBEDDING_INPUT_MAX_CHARS] for text in texts], api_key)
+
+def unsupported_provider_message() -> str:
+    return f"EMBEDDING_PROVIDER={EMBEDDING_PROVIDER} не поддерживается индексацией (поддерживаются: {', '.join(EMBEDDING_PROVIDERS)})"
+
+def create_embeddings_local(texts: List[str], api_key: str = None) -> List[List[float]]:
+    """Локальные детерминированные эмбеддинги без сети: хэшированные слова и символьные 3-5-граммы
+    (shared/embedding_models.py, тот же модуль используют запросы events-manager и generate-drafts-v2)"""
+    return [hashed_ngram_embedding(text, LOCAL_EMBEDDING_DIM) for text in texts]
+
+def create_embeddings_openrouter(texts: List[str], api_key: str) -> List[List[float]]:
+    """Создаёт эмбеддинги для списка текстов одним запросом к OpenRouter API"""
     data = {
         'model': 'openai/text-embedding-3-small',
-        'input': text
+        'input': texts
     }
     
     req = urllib.request.Request(
@@ -228,14 +622,23 @@ def create_embedding(text: str, api_key: str) -> List[float]:
         }
     )
     
-    with urllib.request.urlopen(req) as response:
+    with http_pool.urlopen(req, timeout=60, idempotent=True) as response:
         response_text = response.read().decode('utf-8')
         result = json.loads(response_text)
         
         if 'error' in result:
             raise Exception(f"OpenRouter API error: {result['error']}")
         
-        if 'data' not in result or len(result['data']) == 0:
+        if 'data' not in result or len(result['data']) != len(texts):
             raise Exception(f"Invalid OpenRouter response: {response_text[:200]}")
         
-        return result['data'][0]['embedding']
\ No newline at end of file
+        embeddings = [None] * len(texts)
+        for entry in result['data']:
+            embeddings[entry.get('index', 0)] = entry['embedding']
+        
+        return embeddings
+
+EMBEDDING_PROVIDERS = {
+    'openai': create_embeddings_openrouter,
+    'local': create_embeddings_local
+}
@@ -0,0 +1,125 @@
+'''
+knowledge_store row encoding shared by index-knowledge (indexing) and events-manager
+(rag_module): text hash for embedding_cache and content_hash, the embedding_packed
+codec, pgvector literals and embedding batch splitting. Both writers use this file, so
+hashes and packed bytes match whichever function produced the row.
+
+Source: backend/shared/knowledge_codec.py, copied into the functions by backend/shared/sync.py.
+'''
+
+import os
+import math
+import struct
+import hashlib
+import unicodedata
+from typing import List
+
+EMBEDDING_CODECS = ('i8', 'f16')
+EMBEDDING_CODEC = os.environ.get('EMBEDDING_CODEC', 'i8')
+VECTOR_COLUMN_DIM = 1536  # knowledge_store.embedding is vector(1536); other dims are stored packed only
+SHORT_VECTOR_DIM = 256  # knowledge_store.embedding_vec_short: normalized prefix for the reduced first stage
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '128'))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get('EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+EMBEDDING_INPUT_MAX_CHARS = 8000  # longer texts are truncated before embedding; the hash covers the full text
+
+KNOWLEDGE_COLUMN_STATE = {}
+
+def normalize_text(text: str) -> str:
+    '''
+    Canonical form used for embedding cache keys: NFC, collapsed whitespace
+    '''
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def text_hash(text: str) -> str:
+    '''
+    sha256 of normalized text
+    '''
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def estimate_tokens(text: str) -> int:
+    '''
+    Rough token count for batching (~3 chars per token for mixed ru/en text)
+    '''
+    return len(text) // 3 + 1
+
+def split_embedding_batches(
+    texts: List[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS
+) -> List[List[int]]:
+    '''
+    Group text indices into batches limited by count and estimated tokens
+    '''
+    
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        
+        current.append(i)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+def pack_embedding(embedding: List[float], codec: str = None) -> bytes:
+    '''
+    Encode an embedding for knowledge_store.embedding_packed (little-endian)
+    
+    i8:  float32 scale + int8[dim], value = q * scale (4x smaller than float32)
+    f16: float16[dim] (2x smaller than float32)
+    '''
+    
+    codec = codec or EMBEDDING_CODEC
+    values = [float(x) for x in embedding]
+    
+    if codec == 'f16':
+        return struct.pack(f'<{len(values)}e', *values)
+    
+    if codec == 'i8':
+        max_abs = max((abs(x) for x in values), default=0.0)
+        scale = max_abs / 127 if max_abs > 0 else 1.0
+        quantized = [max(-127, min(127, round(x / scale))) for x in values]
+        return struct.pack('<f', scale) + struct.pack(f'<{len(quantized)}b', *quantized)
+    
+    raise ValueError(f'Unknown embedding codec: {codec}')
+
+def vector_literal(embedding: List[float]) -> str:
+    '''
+    pgvector text input, sent as one bind parameter ('[0.1,0.2,...]')
+    '''
+    return '[' + ','.join(repr(float(x)) for x in embedding) + ']'
+
+def short_vector_literal(embedding: List[float]) -> str:
+    '''
+    First SHORT_VECTOR_DIM components, renormalized (Matryoshka truncation)
+    '''
+    
+    prefix = [float(x) for x in embedding[:SHORT_VECTOR_DIM]]
+    norm = math.sqrt(sum(x * x for x in prefix))
+    
+    return vector_literal([x / norm for x in prefix] if norm > 0 else prefix)
+
+def knowledge_column_available(cur, column: str) -> bool:
+    '''
+    Whether a knowledge_store column from an optional migration exists; checked once per warm container
+    '''
+    
+    if column not in KNOWLEDGE_COLUMN_STATE:
+        cur.execute('''
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 't_p22819116_event_schedule_app'
+              AND table_name = 'knowledge_store' AND column_name = %s
+        ''', (column,))
+        KNOWLEDGE_COLUMN_STATE[column] = cur.fetchone() is not None
+    
+    return KNOWLEDGE_COLUMN_STATE[column]
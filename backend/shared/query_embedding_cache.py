@@ -0,0 +1,63 @@
+'''
+Warm-container LRU + TTL cache of query embeddings keyed by (model, text), used for
+retrieval queries by events-manager (rag_module) and generate-drafts-v2. Sized by
+QUERY_EMBEDDING_CACHE_SIZE entries, entries expire after QUERY_EMBEDDING_CACHE_TTL seconds.
+
+Source: backend/shared/query_embedding_cache.py, copied into the functions by backend/shared/sync.py.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+QUERY_EMBEDDING_CACHE_TTL = int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+
+class QueryEmbeddingCache:
+    '''
+    LRU + TTL cache of query embeddings keyed by (model, text), with hit/miss counters
+    '''
+    
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: Tuple[str, str], embedding: List[float]):
+        with self.lock:
+            self.entries[key] = (embedding, time.monotonic())
+            self.entries.move_to_end(key)
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self.entries)
+            }
+
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
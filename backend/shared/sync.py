@@ -0,0 +1,67 @@
+'''
+Copy shared modules into the functions that import them. Every function in
+backend/ is deployed as its own directory, exactly as committed, so each one
+carries a committed copy of the shared modules it imports. Edit only the file in
+backend/shared, run this script and commit the copies with it.
+
+Usage: python backend/shared/sync.py           write the copies
+       python backend/shared/sync.py --check   exit 1 if a copy is missing or differs
+                                               (pre-commit / CI guard; test_http_pool runs it too)
+'''
+
+import os
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SHARED_DIR)
+
+# module -> functions that import it
+SHARED_MODULES = {
+    'http_pool.py': (
+        'events-manager', 'index-knowledge', 'generate-drafts-v2',
+        'style-validator', 'template-generator', 'fill-template-v2'
+    ),
+    'embedding_models.py': ('events-manager', 'index-knowledge', 'generate-drafts-v2'),
+    'knowledge_codec.py': ('events-manager', 'index-knowledge'),
+    'query_embedding_cache.py': ('events-manager', 'generate-drafts-v2')
+}
+
+def read(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def stale_copies():
+    '''
+    (module, function, target path) for every copy that is missing or differs from the source
+    '''
+    
+    stale = []
+    for module, functions in SHARED_MODULES.items():
+        source = read(os.path.join(SHARED_DIR, module))
+        for function in functions:
+            target = os.path.join(BACKEND_DIR, function, module)
+            if read(target) != source:
+                stale.append((module, function, target))
+    return stale
+
+def main():
+    stale = stale_copies()
+    
+    if '--check' in sys.argv[1:]:
+        for module, function, _ in stale:
+            print(f'{function}/{module} is missing or differs from shared/{module}')
+        sys.exit(1 if stale else 0)
+    
+    for module, function, target in stale:
+        with open(os.path.join(SHARED_DIR, module), encoding='utf-8') as f:
+            source = f.read()
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(source)
+        print(f'{function}/{module} updated')
+    
+    print(f'{len(stale)} copies updated')
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ import os
 from typing import Dict, Any, List
 import psycopg2
 import urllib.request
+import http_pool
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -190,6 +191,6 @@ def call_openrouter(prompt: str, api_key: str) -> str:
         }
     )
     
-    with urllib.request.urlopen(req) as response:
+    with http_pool.urlopen(req) as response:
         result = json.loads(response.read().decode('utf-8'))
         return result['choices'][0]['message']['content']
\ No newline at end of file
@@ -2,6 +2,7 @@ import json
 import os
 from typing import Dict, Any
 import urllib.request
+import http_pool
 import psycopg2
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -208,6 +209,6 @@ def call_openrouter(prompt: str, api_key: str, model: str = 'anthropic/claude-3.
         }
     )
     
-    with urllib.request.urlopen(req, timeout=50) as response:
+    with http_pool.urlopen(req, timeout=50) as response:
         result = json.loads(response.read().decode('utf-8'))
         return result['choices'][0]['message']['content']
\ No newline at end of file
@@ -0,0 +1,11 @@
+-- Версия индекса базы знаний: увеличивается при каждой переиндексации knowledge_store
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.knowledge_index_versions (
+    event_id INTEGER NOT NULL,
+    item_type VARCHAR(50) NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (event_id, item_type)
+);
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.knowledge_index_versions IS 'Версии индекса knowledge_store по (event_id, item_type) для инвалидации кэша эмбеддингов в тёплых контейнерах';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_versions.version IS 'Увеличивается индексаторами при перезаписи строк knowledge_store';
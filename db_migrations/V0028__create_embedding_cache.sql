@@ -0,0 +1,11 @@
+-- Кэш эмбеддингов по хэшу нормализованного текста: неизменённые строки не эмбеддятся повторно
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.embedding_cache (
+    model VARCHAR(100) NOT NULL,
+    text_hash CHAR(64) NOT NULL,
+    embedding DOUBLE PRECISION[] NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model, text_hash)
+);
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.embedding_cache IS 'Постоянный кэш эмбеддингов: ключ (модель, sha256 нормализованного текста)';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.embedding_cache.text_hash IS 'sha256 от текста после схлопывания пробелов и NFC-нормализации';
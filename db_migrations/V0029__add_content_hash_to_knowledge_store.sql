@@ -0,0 +1,8 @@
+-- Хэш содержимого строки базы знаний для инкрементальной (diff) переиндексации
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_store
+ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_store_event_type_hash
+ON t_p22819116_event_schedule_app.knowledge_store(event_id, item_type, content_hash);
+
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_store.content_hash IS 'sha256 нормализованного content; по нему diff-режим индексации находит неизменённые строки и сохраняет их id';
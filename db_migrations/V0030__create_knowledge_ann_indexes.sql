@@ -0,0 +1,19 @@
+-- Сохранённые ANN-индексы (IVF) базы знаний: тёплые контейнеры загружают их вместо повторного обучения
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.knowledge_ann_indexes (
+    event_id INTEGER NOT NULL,
+    item_type VARCHAR(50) NOT NULL,
+    index_version INTEGER NOT NULL,
+    dim INTEGER NOT NULL,
+    recall REAL,
+    centroids BYTEA NOT NULL,
+    assignments BYTEA NOT NULL,
+    row_ids BYTEA NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (event_id, item_type)
+);
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.knowledge_ann_indexes IS 'IVF-индексы для приближённого поиска по knowledge_store, строятся для мероприятий с большим числом строк';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_ann_indexes.index_version IS 'Версия из knowledge_index_versions, для которой построен индекс';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_ann_indexes.centroids IS 'float32 центроиды (nlist x dim)';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_ann_indexes.assignments IS 'int32 номер кластера для каждой строки, в порядке row_ids';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_ann_indexes.recall IS 'recall@10 относительно точного поиска на выборке строк';
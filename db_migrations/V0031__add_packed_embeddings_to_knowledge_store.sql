@@ -0,0 +1,9 @@
+-- Компактное бинарное хранение эмбеддингов: int8 с масштабом на вектор или float16 вместо массива double
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_store
+ADD COLUMN IF NOT EXISTS embedding_packed BYTEA;
+
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_store
+ADD COLUMN IF NOT EXISTS embedding_codec VARCHAR(8);
+
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_store.embedding_packed IS 'Эмбеддинг в бинарном виде (little-endian): i8 — float32 масштаб + int8[dim], f16 — float16[dim]';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_store.embedding_codec IS 'Формат embedding_packed: i8 или f16; NULL — строка проиндексирована до перехода, читается из embedding';
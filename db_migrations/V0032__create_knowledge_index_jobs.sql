@@ -0,0 +1,31 @@
+-- Фоновые возобновляемые задания индексации базы знаний: каждый вызов index-knowledge
+-- обрабатывает ограниченный по времени кусок и сохраняет курсор
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.knowledge_index_jobs (
+    id SERIAL PRIMARY KEY,
+    event_id INTEGER NOT NULL,
+    mode VARCHAR(10) NOT NULL DEFAULT 'diff',
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    item_types TEXT[] NOT NULL DEFAULT '{}',
+    items JSONB NOT NULL DEFAULT '[]',
+    total_items INTEGER NOT NULL DEFAULT 0,
+    cursor_position INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    unchanged INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP WITHOUT TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_index_jobs_event
+ON t_p22819116_event_schedule_app.knowledge_index_jobs(event_id, id DESC);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_index_jobs_running
+ON t_p22819116_event_schedule_app.knowledge_index_jobs(event_id)
+WHERE status = 'running';
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.knowledge_index_jobs IS 'Задания индексации knowledge_store: список элементов, курсор и счётчики; не более одного running-задания на мероприятие';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.items IS 'Элементы для индексации в порядке обработки: [[item_type, text], ...]';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.item_types IS 'Типы, прочитанные из документов; устаревшие строки удаляются только для них';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.cursor_position IS 'Сколько элементов items уже обработано; фиксируется в одной транзакции со вставкой строк';
@@ -0,0 +1,23 @@
+-- Серверный KNN по базе знаний работает по pgvector-колонке embedding (V1): HNSW-индекс вместо ivfflat
+-- и частичный индекс по (event_id, item_type) для точного перебора строк небольших мероприятий
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- HNSW (pgvector >= 0.5.0) заменяет ivfflat из V1; без HNSW остаётся ivfflat
+DO $$
+BEGIN
+    CREATE INDEX IF NOT EXISTS idx_knowledge_store_embedding_hnsw
+        ON t_p22819116_event_schedule_app.knowledge_store
+        USING hnsw (embedding vector_cosine_ops)
+        WITH (m = 16, ef_construction = 64);
+    DROP INDEX IF EXISTS t_p22819116_event_schedule_app.idx_knowledge_embedding_ivf;
+EXCEPTION
+    WHEN OTHERS THEN
+        RAISE NOTICE 'HNSW unavailable, keeping ivfflat on embedding: %', SQLERRM;
+END $$;
+
+-- Для небольших мероприятий rag_module перебирает строки мероприятия точно, через этот индекс
+CREATE INDEX IF NOT EXISTS idx_knowledge_store_event_type_embedding
+ON t_p22819116_event_schedule_app.knowledge_store(event_id, item_type)
+WHERE embedding IS NOT NULL;
+
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_store.embedding IS 'Эмбеддинг как pgvector для серверного KNN (ORDER BY embedding <=> запрос); NULL для моделей с размерностью не 1536. Для загрузки в контейнер используется embedding_packed';
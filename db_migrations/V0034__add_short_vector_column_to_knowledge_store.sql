@@ -0,0 +1,31 @@
+-- Укороченные эмбеддинги (первые 256 компонент, перенормированные; Matryoshka) для быстрого первого этапа KNN.
+-- Полные вектора остаются в embedding / embedding_packed и используются для переранжирования кандидатов
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_store
+ADD COLUMN IF NOT EXISTS embedding_vec_short vector(256);
+
+DO $$
+BEGIN
+    UPDATE t_p22819116_event_schedule_app.knowledge_store
+    SET embedding_vec_short = l2_normalize(subvector(embedding, 1, 256))::vector(256)
+    WHERE embedding_vec_short IS NULL AND embedding IS NOT NULL;
+EXCEPTION
+    WHEN OTHERS THEN
+        RAISE NOTICE 'Skipping embedding_vec_short backfill (needs pgvector >= 0.7.0): %', SQLERRM;
+END $$;
+
+DO $$
+BEGIN
+    CREATE INDEX IF NOT EXISTS idx_knowledge_store_embedding_vec_short_hnsw
+        ON t_p22819116_event_schedule_app.knowledge_store
+        USING hnsw (embedding_vec_short vector_cosine_ops)
+        WITH (m = 16, ef_construction = 64);
+EXCEPTION
+    WHEN OTHERS THEN
+        RAISE NOTICE 'HNSW unavailable, using ivfflat: %', SQLERRM;
+        CREATE INDEX IF NOT EXISTS idx_knowledge_store_embedding_vec_short_ivf
+            ON t_p22819116_event_schedule_app.knowledge_store
+            USING ivfflat (embedding_vec_short vector_cosine_ops)
+            WITH (lists = 100);
+END $$;
+
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_store.embedding_vec_short IS 'Первые 256 компонент эмбеддинга, L2-нормированные; первый этап серверного KNN при RAG_REDUCED_DIM=256';
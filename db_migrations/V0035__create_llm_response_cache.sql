@@ -0,0 +1,14 @@
+-- Кэш ответов LLM по хэшу канонического запроса (провайдер, модель, сообщения, параметры):
+-- повторная генерация того же черновика отдаётся из кэша без обращения к модели
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.llm_response_cache (
+    request_hash CHAR(64) PRIMARY KEY,
+    model VARCHAR(100) NOT NULL DEFAULT '',
+    response JSONB NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_created
+ON t_p22819116_event_schedule_app.llm_response_cache(created_at);
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.llm_response_cache IS 'Ответы chat completions по sha256 канонического запроса; записи старше LLM_CACHE_TTL не читаются и удаляются при записи новых';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.llm_response_cache.request_hash IS 'sha256 JSON {provider, payload} с отсортированными ключами';
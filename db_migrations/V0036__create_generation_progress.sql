@@ -0,0 +1,19 @@
+-- Прогресс потоковой генерации письма: частичные subject/html, которые UI читает
+-- опросом GET ?action=generation_progress, пока POST generate_single_email ещё выполняется
+CREATE TABLE IF NOT EXISTS t_p22819116_event_schedule_app.generation_progress (
+    stream_id VARCHAR(64) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'streaming',
+    subject TEXT NOT NULL DEFAULT '',
+    html TEXT NOT NULL DEFAULT '',
+    chars INTEGER NOT NULL DEFAULT 0,
+    email_id INTEGER,
+    error TEXT,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_progress_updated
+ON t_p22819116_event_schedule_app.generation_progress(updated_at);
+
+COMMENT ON TABLE t_p22819116_event_schedule_app.generation_progress IS 'Частичный результат потоковой генерации; строки старше суток удаляются при создании новых';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.generation_progress.status IS 'streaming | done | failed';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.generation_progress.chars IS 'Сколько символов ответа модели получено на момент записи';
@@ -0,0 +1,12 @@
+-- Счётчик неудачных кусков задания индексации: после INDEX_JOB_MAX_ATTEMPTS ошибок подряд задание
+-- переходит в failed и больше не блокирует новый POST по event_id (уникальный индекс только на running).
+-- replace_below_id — граница старых строк мероприятия для режима full: они удаляются при завершении задания
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_index_jobs
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p22819116_event_schedule_app.knowledge_index_jobs
+ADD COLUMN IF NOT EXISTS replace_below_id BIGINT;
+
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.status IS 'running | done | failed';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.attempts IS 'Неудачные куски подряд; сбрасывается после успешного куска';
+COMMENT ON COLUMN t_p22819116_event_schedule_app.knowledge_index_jobs.replace_below_id IS 'Режим full: строки мероприятия с id <= этого значения заменяются строками задания в finish';
@@ -143,6 +143,27 @@ export default function ContentPlanDialog({ open, onOpenChange, event, mailingLi
           status: `Генерируем: ${item.title}` 
         });
 
+        // Пока письмо генерируется, читаем частичный subject из потока
+        const streamId = crypto.randomUUID();
+        const progressTimer = setInterval(async () => {
+          try {
+            const progressResponse = await fetch(
+              `https://functions.poehali.dev/b56e5895-fb22-4d96-b746-b046a9fd2750?action=generation_progress&stream_id=${streamId}`
+            );
+            if (!progressResponse.ok) return;
+            const progress = await progressResponse.json();
+            if (progress.status === 'streaming' && progress.chars > 0) {
+              setGeneratingProgress({
+                current: i,
+                total: preview.length,
+                status: `Генерируем: ${item.title}${progress.subject ? ` — «${progress.subject}»` : ''} (${progress.chars} симв.)`
+              });
+            }
+          } catch {
+            // прогресс необязателен
+          }
+        }, 1000);
+
         try {
           const response = await fetch('https://functions.poehali.dev/b56e5895-fb22-4d96-b746-b046a9fd2750', {
             method: 'POST',
@@ -152,7 +173,9 @@ export default function ContentPlanDialog({ open, onOpenChange, event, mailingLi
               event_id: event.id,
               event_list_id: parseInt(selectedListId),
               title: item.title,
-              content_type: item.content_type
+              content_type: item.content_type,
+              stream: true,
+              stream_id: streamId
             })
           });
 
@@ -204,6 +227,8 @@ export default function ContentPlanDialog({ open, onOpenChange, event, mailingLi
         } catch (itemError) {
           errorCount++;
           console.error(`Error generating ${item.title}:`, itemError);
+        } finally {
+          clearInterval(progressTimer);
         }
         
         // Обновляем прогресс
@@ -87,18 +87,26 @@ export function useEventAPI({ eventId, toast, onUpdate }: UseEventAPIProps) {
     
     setIndexing(true);
     try {
-      const res = await fetch(INDEX_KNOWLEDGE_URL, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ event_id: eventId }),
-      });
-      
-      const data = await res.json();
-      
-      if (data.error) {
-        throw new Error(data.error);
-      }
-      
+      let payload: Record<string, unknown> = { event_id: eventId };
+      let data: any;
+
+      // Индексация идёт кусками: пока задание не завершено (202), продолжаем его по job_id
+      do {
+        const res = await fetch(INDEX_KNOWLEDGE_URL, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(payload),
+        });
+
+        data = await res.json();
+
+        if (data.error) {
+          throw new Error(data.error);
+        }
+
+        payload = { job_id: data.job_id };
+      } while (data.status === 'running');
+
       sonnerToast.success(`Проиндексировано ${data.indexed_count} элементов знаний`);
     } catch (error: any) {
       sonnerToast.error(`Ошибка индексации: ${error.message}`);